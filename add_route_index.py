@@ -0,0 +1,18 @@
+import argparse
+
+from readingdb.db import DB
+from readingdb.endpoints import DYNAMO_ENDPOINT
+from readingdb.constants import *
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--endpoint', help='the dynamodb endpoint holding the reading table', type=str, default=DYNAMO_ENDPOINT)
+parser.add_argument('--region', help='the region where the reading table is stored', type=str, default=REGION_NAME)
+parser.add_argument('--poll', help='seconds to wait between checks on the index backfill', type=int, default=10)
+
+args = parser.parse_args()
+
+db = DB(args.endpoint, region_name=args.region)
+
+print(f'adding {Constants.ROUTE_INDEX_NAME} to {Constants.READING_TABLE_NAME}')
+db.add_route_index(poll_seconds=args.poll)
+print(f'{Constants.ROUTE_INDEX_NAME} is active')
@@ -38,14 +38,34 @@ pippush 'commit name' hotfix master
 aws dynamodb delete-table --table-name Readings2
 aws dynamodb create-table \
     --table-name Readings2\
-    --attribute-definitions AttributeName=PK,AttributeType=S AttributeName=SK,AttributeType=S \
+    --attribute-definitions AttributeName=PK,AttributeType=S AttributeName=SK,AttributeType=S AttributeName=RouteID,AttributeType=S \
     --key-schema AttributeName=PK,KeyType=HASH AttributeName=SK,KeyType=RANGE \
+    --global-secondary-indexes 'IndexName=RouteIndex,KeySchema=[{AttributeName=RouteID,KeyType=HASH},{AttributeName=SK,KeyType=RANGE}],Projection={ProjectionType=ALL}' \
     --billing-mode PAY_PER_REQUEST
 
+# add the RouteIndex to a Readings2 table created before it existed
+python add_route_index.py
+
+# let dynamodb delete expired SnapCache entries from an Org table created before they existed
+python enable_org_ttl.py
+
+# write image index items for readings saved before the image index existed
+python index_images.py
+
+# write geohash index items for layer memberships saved before the layer geohash index existed
+python index_layer_geohashes.py
+
+# compute road segment aggregates for layers saved before segments existed (run after index_layer_geohashes.py)
+python index_segments.py
+
+# build the fault statistics tile pyramid of each layer (run after index_layer_geohashes.py)
+python index_tiles.py
+
 aws dynamodb delete-table --table-name Org
 aws dynamodb create-table \
     --table-name Org\
     --attribute-definitions AttributeName=PK,AttributeType=S AttributeName=SK,AttributeType=S \
     --key-schema AttributeName=PK,KeyType=HASH AttributeName=SK,KeyType=RANGE \
     --billing-mode PAY_PER_REQUEST
+aws dynamodb update-time-to-live --table-name Org --time-to-live-specification 'Enabled=true,AttributeName=ExpiresAt'
 
@@ -0,0 +1,17 @@
+import argparse
+
+from readingdb.db import DB
+from readingdb.endpoints import DYNAMO_ENDPOINT
+from readingdb.constants import *
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--endpoint', help='the dynamodb endpoint holding the org table', type=str, default=DYNAMO_ENDPOINT)
+parser.add_argument('--region', help='the region where the org table is stored', type=str, default=REGION_NAME)
+
+args = parser.parse_args()
+
+db = DB(args.endpoint, region_name=args.region)
+
+print(f'enabling time to live on {Constants.EXPIRES_AT} in {Constants.ORG_TABLE_NAME}')
+db.enable_org_ttl()
+print(f'expired items in {Constants.ORG_TABLE_NAME} will be deleted by dynamodb')
@@ -8,15 +8,17 @@ parser.add_argument('bucket', help='the bucket where the zipped file is kept', t
 parser.add_argument('key', help='the object key for the zipped file', type=str)
 parser.add_argument('region', help='the region where the data resources (s3 and dynamodb) are stored', type=str, default='ap-southeast-2')
 parser.add_argument('name', help='the name of the new route', type=str, default=None)
+parser.add_argument('--stream', help='read the zipped file in place with ranged requests instead of downloading it into memory', action='store_true')
+parser.add_argument('--no-snap-cache', help='snap every point with the roads api instead of reusing cached snaps of nearby points', action='store_true')
 
 args = parser.parse_args()
 
-def perform_unzip(bucket: str, key: str, name: str=None):
+def perform_unzip(bucket: str, key: str, name: str=None, stream: bool=False, snap_cache: bool=True):
     print('initializing digester')
-    z = Digester(DYNAMO_ENDPOINT, region_name=args.region)
+    z = Digester(DYNAMO_ENDPOINT, region_name=args.region, snap_cache=snap_cache)
 
     print('digesting')
-    z.process(bucket, key, name)
+    z.process(bucket, key, name, stream=stream)
     print('digesting and saving complete')
 
-perform_unzip(args.bucket, args.key, args.name)
\ No newline at end of file
+perform_unzip(args.bucket, args.key, args.name, args.stream, not args.no_snap_cache)
\ No newline at end of file
@@ -0,0 +1,17 @@
+import argparse
+
+from readingdb.db import DB
+from readingdb.endpoints import DYNAMO_ENDPOINT
+from readingdb.constants import *
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--endpoint', help='the dynamodb endpoint holding the reading and org tables', type=str, default=DYNAMO_ENDPOINT)
+parser.add_argument('--region', help='the region where the tables are stored', type=str, default=REGION_NAME)
+
+args = parser.parse_args()
+
+db = DB(args.endpoint, region_name=args.region)
+
+print(f'indexing the images of every reading in {Constants.READING_TABLE_NAME}')
+indexed = db.index_images()
+print(f'finished indexing the images of {indexed} readings')
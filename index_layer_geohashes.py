@@ -0,0 +1,17 @@
+import argparse
+
+from readingdb.db import DB
+from readingdb.endpoints import DYNAMO_ENDPOINT
+from readingdb.constants import *
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--endpoint', help='the dynamodb endpoint holding the reading and org tables', type=str, default=DYNAMO_ENDPOINT)
+parser.add_argument('--region', help='the region where the tables are stored', type=str, default=REGION_NAME)
+
+args = parser.parse_args()
+
+db = DB(args.endpoint, region_name=args.region)
+
+print(f'indexing every layer membership in {Constants.ORG_TABLE_NAME} by geohash')
+indexed = db.index_layer_geohashes()
+print(f'finished indexing {indexed} layer memberships')
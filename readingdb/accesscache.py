@@ -0,0 +1,73 @@
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+class AccessCache():
+    '''Remembers which groups each user belongs to and which layers each
+    group can see for ttl seconds. It lives as long as the DB object does,
+    so in a warm Lambda container it is shared across invocations. Writes
+    made through the same DB object invalidate the affected entries
+    straight away; writes made anywhere else become visible once the
+    entries expire. A ttl of 0 disables caching.
+    '''
+
+    USER = 'User'
+    GROUP = 'Group'
+
+    def __init__(
+        self,
+        ttl: float = 60,
+        max_entries: int = 10000,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.__entries: Dict[Tuple[str, str], Tuple[float, Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def user_groups(self, user_id: str) -> Optional[List[str]]:
+        return self.__get(self.USER, user_id)
+
+    def set_user_groups(self, user_id: str, group_ids: List[str]) -> None:
+        self.__set(self.USER, user_id, group_ids)
+
+    def group_layers(self, group_id: str) -> Optional[List[str]]:
+        return self.__get(self.GROUP, group_id)
+
+    def set_group_layers(self, group_id: str, layer_ids: List[str]) -> None:
+        self.__set(self.GROUP, group_id, layer_ids)
+
+    def invalidate_user(self, user_id: str) -> None:
+        self.__entries.pop((self.USER, user_id), None)
+
+    def invalidate_group(self, group_id: str) -> None:
+        self.__entries.pop((self.GROUP, group_id), None)
+
+    def clear(self) -> None:
+        self.__entries.clear()
+
+    def __get(self, kind: str, id: str) -> Optional[List[str]]:
+        entry = self.__entries.get((kind, id))
+        if entry is None:
+            return None
+
+        expires, value = entry
+        if self.clock() >= expires:
+            del self.__entries[(kind, id)]
+            return None
+
+        return list(value)
+
+    def __set(self, kind: str, id: str, value: List[str]) -> None:
+        if self.ttl <= 0:
+            return
+
+        now = self.clock()
+        if len(self.__entries) >= self.max_entries:
+            self.__entries = {k: e for k, e in self.__entries.items() if e[0] > now}
+            if len(self.__entries) >= self.max_entries:
+                self.__entries.clear()
+
+        self.__entries[(kind, id)] = (now + self.ttl, list(value))
@@ -0,0 +1,78 @@
+from typing import Any, Dict, List
+
+from readingdb.accesscache import AccessCache
+from readingdb.constants import *
+from readingdb.db import DB
+
+class AccessContext():
+    '''Everything needed to decide what a single user may see during one
+    request. Each piece (groups, layers, routes) is loaded at most once
+    per context, and groups and layers come from the longer lived 
+    AccessCache when it has them.
+    '''
+
+    def __init__(self, db: DB, user_id: str, cache: AccessCache = None) -> None:
+        self.db = db
+        self.user_id = user_id
+        self.cache = cache if cache is not None else AccessCache(ttl=0)
+
+        self.__group_ids = None
+        self.__layer_ids = None
+        self.__routes: Dict[str, Dict[str, Any]] = {}
+        self.__all_routes = None
+
+    @property
+    def group_ids(self) -> List[str]:
+        if self.__group_ids is None:
+            group_ids = self.cache.user_groups(self.user_id)
+            if group_ids is None:
+                group_ids = self.db.groups_for_user(self.user_id)
+                self.cache.set_user_groups(self.user_id, group_ids)
+            self.__group_ids = group_ids
+
+        return self.__group_ids
+
+    @property
+    def layer_ids(self) -> List[str]:
+        if self.__layer_ids is None:
+            layer_ids = []
+            for group_id in self.group_ids:
+                group_layers = self.cache.group_layers(group_id)
+                if group_layers is None:
+                    group_layers = self.db.layer_ids_for_group(group_id)
+                    self.cache.set_group_layers(group_id, group_layers)
+                layer_ids.extend(group_layers)
+            self.__layer_ids = layer_ids
+
+        return self.__layer_ids
+
+    def route(self, route_id: str) -> Dict[str, Any]:
+        '''Returns the route as stored (without presigned urls) or None
+        if it does not exist, whether or not the user can access it.
+        '''
+
+        if route_id not in self.__routes:
+            self.__routes[route_id] = DB.get_route(self.db, route_id)
+
+        return self.__routes[route_id]
+
+    def routes(self) -> List[Dict[str, Any]]:
+        '''Returns every route the user can access.'''
+
+        if self.__all_routes is None:
+            self.__all_routes = []
+            for route in self.db.all_routes():
+                route_id = route[Constants.ROUTE_ID]
+                if self.__routes.get(route_id) is None:
+                    self.__routes[route_id] = route
+                self.__all_routes.append(self.__routes[route_id])
+
+        group_ids = set(self.group_ids)
+        return [r for r in self.__all_routes if r[Constants.GROUP_ID] in group_ids]
+
+    def can_access_route(self, route_id: str) -> bool:
+        route = self.route(route_id)
+        if route is None:
+            return False
+
+        return route[Constants.GROUP_ID] in self.group_ids
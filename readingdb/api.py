@@ -1,13 +1,22 @@
+import base64
 from collections import defaultdict
+import gzip
+import heapq
 import json
-import sys
 import time
 from readingdb.routestatus import RouteStatus
 from readingdb.converter import Converter
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Set, Tuple
 from readingdb.s3uri import S3Uri
+from readingdb.accesscontext import AccessContext
+from readingdb.checkpoint import Checkpoint
+from readingdb.bbox import BBox
+from readingdb.presigner import Presigner
+from readingdb.segment import Segment
+from readingdb.tile import TILE_MAX_PRECISION, TILE_MIN_PRECISION, Tile
+from readingdb.spill import SpillWriter, json_list_chunks
 from readingdb.route import Route
-from readingdb.reading import Reading, json_to_reading
+from readingdb.reading import Reading, image_keys, json_to_reading
 from readingdb.routespec import RouteSpec
 import boto3
 import uuid
@@ -18,6 +27,10 @@ from readingdb.constants import *
 
 class API(DB):
     ECS_TASKS_KEY = 'tasks'
+    S3_DELETE_LIMIT = 1000
+    S3_DELETE_ATTEMPTS = 5
+    MAX_BBOX_GEOHASHES = 500
+    MAX_VIEWPORT_TILES = 1024
 
     def __init__(
         self, 
@@ -27,16 +40,35 @@ class API(DB):
         bucket='mobileappsessions172800-main',
         region_name='ap-southeast-2',
         config=None,
-        size_limit=999999999999999
+        size_limit=999999999999999,
         # size_limit=2_500_000
+        max_query_workers=16,
+        presigned_url_lifetime=259200,
+        access_cache_ttl=60,
+        debug=False,
     ):
-        super().__init__(url=url, resource_name=resource_name, region_name=region_name, config=config)
+        super().__init__(
+            url=url, 
+            resource_name=resource_name, 
+            region_name=region_name, 
+            config=config,
+            max_query_workers=max_query_workers,
+            access_cache_ttl=access_cache_ttl,
+            debug=debug,
+        )
         self.bucket = bucket
         self.tmp_bucket = tmp_bucket
         self.region_name = region_name
         self.size_limit = size_limit
 
-        self.s3_client = boto3.client('s3', region_name=region_name, config=config)
+        session = boto3.Session(region_name=region_name)
+        self.s3_client = session.client('s3', config=config)
+        self.presigner = Presigner(
+            self.s3_client, 
+            expires_in=presigned_url_lifetime, 
+            min_remaining=presigned_url_lifetime // 3,
+            credentials=session.get_credentials(),
+        )
         self.ecs = boto3.client('ecs', region_name=region_name, config=config)
 
     # -----------------------------------------------------------------
@@ -47,21 +79,79 @@ class API(DB):
     # -----------------------------------------------------------------
     # -----------------------------------------------------------------
 
-    def __same_image(self, r1: Dict[str, Any], r2: Dict[str, Any]) -> bool:
-        r1 = r1[Constants.READING]
-        r2 = r2[Constants.READING]
-
-        if Constants.FILENAME in r1 and\
-            Constants.FILENAME in r2 and\
-            r2[Constants.FILENAME] == r1[Constants.FILENAME]:
-            return True
-        if Constants.URI in r1 and\
-            Constants.URI in r2 and\
-            r1[Constants.URI][Constants.BUCKET] == r2[Constants.URI][Constants.BUCKET] and\
-            r1[Constants.URI][Constants.KEY] == r2[Constants.URI][Constants.KEY]:
-            return True
+    def __image_index(self, readings: List[Dict[str, Any]]) -> Dict[str, List[int]]:
+        # Maps each filename and each (bucket, key) pair to the 
+        # positions of the readings that refer to that image.
+        index = defaultdict(list)
+
+        for i, r in enumerate(readings):
+            for image_key in image_keys(r):
+                index[image_key].append(i)
         
-        return False
+        return index
+
+    def __same_image_readings(
+        self, 
+        r: Dict[str, Any], 
+        readings: List[Dict[str, Any]], 
+        index: Dict[str, List[int]]
+    ) -> Iterator[Dict[str, Any]]:
+        '''Yields the readings that share an image with r in the order
+        they appear in readings. The image keys of r are looked up again
+        after every match because the caller may point r at the matched
+        reading's image, which changes which later readings match.
+        '''
+
+        queued = set()
+        to_visit = []
+
+        def queue_matches(after: int) -> None:
+            for image_key in image_keys(r):
+                for i in index.get(image_key, []):
+                    if i > after and i not in queued:
+                        queued.add(i)
+                        heapq.heappush(to_visit, i)
+
+        queue_matches(-1)
+        while len(to_visit) > 0:
+            i = heapq.heappop(to_visit)
+            if set(image_keys(r)).isdisjoint(image_keys(readings[i])):
+                continue
+
+            yield readings[i]
+            queue_matches(i)
+
+    def __same_image_route_readings(
+        self, 
+        route_id: str, 
+        readings: List[Dict[str, Any]],
+        save_imgs: bool,
+    ) -> List[Dict[str, Any]]:
+        '''Loads only the route readings that share an image with one of
+        the given readings, in the same order as get_route_readings.
+        '''
+
+        found = {}
+        searched = set()
+        to_search = set([k for r in readings for k in image_keys(r)])
+
+        while len(to_search) > 0:
+            searched.update(to_search)
+            matched = self.readings_for_images(route_id, to_search)
+            to_search = set()
+
+            for er in matched:
+                found[er[Constants.READING_ID]] = er
+
+                # When images are not being saved the readings take on the
+                # S3Uri of the reading they match, so readings sharing that
+                # S3Uri can also match.
+                if not save_imgs:
+                    to_search.update([k for k in image_keys(er) if k.startswith(Constants.URI)])
+
+            to_search -= searched
+
+        return sorted(found.values(), key=lambda r: r[Constants.READING_ID])
 
     def save_predictions(
         self, 
@@ -71,19 +161,19 @@ class API(DB):
         save_imgs: bool = True,
         layer_id: str = None
     ) -> List[PredictionReading]:
-        existing_readings = self.all_route_readings(route_id, size_limit=99999999999)
+        existing_readings = self.__same_image_route_readings(route_id, readings, save_imgs)
+        image_index = self.__image_index(existing_readings)
         
         to_delete = {}
         for r in readings:
             saved = False
-            for er in existing_readings:
-                if self.__same_image(r, er):
-                    if not save_imgs:
-                        r[Constants.READING][Constants.URI] = er[Constants.READING][Constants.URI]
-                    saved=True
-
-                    if (er[Constants.READING_TYPE] == Constants.PREDICTION and er[Constants.ANNOTATOR_ID] == r[Constants.ANNOTATOR_ID]):
-                        to_delete[er[Constants.READING_ID]] = er 
+            for er in self.__same_image_readings(r, existing_readings, image_index):
+                if not save_imgs:
+                    r[Constants.READING][Constants.URI] = er[Constants.READING][Constants.URI]
+                saved=True
+
+                if (er[Constants.READING_TYPE] == Constants.PREDICTION and er[Constants.ANNOTATOR_ID] == r[Constants.ANNOTATOR_ID]):
+                    to_delete[er[Constants.READING_ID]] = er 
             
             if not saved and not save_imgs:
                 raise ValueError(f'could not find an existing reading with the same image as {r} and saving images has been disallowed')
@@ -95,7 +185,9 @@ class API(DB):
             reading_data = []
             for e in saved_entries:
                 reading_data.append(e.query_data())     
-            self.add_readings_to_layer(layer_id, reading_data)
+            self.add_readings_to_layer(layer_id, reading_data, update_aggregates=False)
+            changed_geohashes = [e.geohash for e in saved_entries] + [r[Constants.GEOHASH] for r in to_delete.values()]
+            self.update_layer_aggregates(layer_id, changed_geohashes)
 
         return saved_entries
         
@@ -142,7 +234,8 @@ class API(DB):
         key: str = None, 
         size_limit = None,
         predictions_only = False,
-        annotator_preference = None
+        annotator_preference = None,
+        compress = False,
     ) -> List[Dict[str, Any]]:
         readings = self.get_route_readings(route_id)
 
@@ -159,28 +252,62 @@ class API(DB):
 
         # Lambda cannot send responses that are larger than
         # 6 mb in size. The JSON for the readings will often
-        # be larger than 6mb.
-        reading_json = json.dumps(readings)
-        resp_size = sys.getsizeof(reading_json)
-        print('response size:', resp_size)
-        if resp_size > size_limit:
-            s3_key = str(uuid.uuid1()) + '.json' if key is None else key
-            self.s3_client.put_object(
-                Body=str(json.dumps(readings)),
-                Bucket = self.tmp_bucket,
-                Key=s3_key
-            )
-
+        # be larger than 6mb, so it is encoded one reading at 
+        # a time and streamed to s3 once it passes the limit.
+        if compress:
+            return self.__compressed_readings(readings, key, size_limit)
+
+        s3_key = str(uuid.uuid1()) + '.json' if key is None else key
+        with SpillWriter(self.s3_client, self.tmp_bucket, s3_key, size_limit) as writer:
+            for chunk in json_list_chunks(readings):
+                writer.write(chunk)
+
+        print('response size:', writer.size)
+        if writer.spilled:
             return { Constants.BUCKET: self.tmp_bucket, Constants.KEY: s3_key }
 
         return readings
 
+    def __compressed_readings(
+        self, 
+        readings: List[Dict[str, Any]], 
+        key: str, 
+        size_limit: int
+    ) -> Dict[str, Any]:
+        # Compressed readings are returned inline as base64, 
+        # which is 4/3 the size of the gzipped bytes.
+        s3_key = str(uuid.uuid1()) + '.json.gz' if key is None else key
+        with SpillWriter(
+            self.s3_client, 
+            self.tmp_bucket, 
+            s3_key, 
+            size_limit * 3 // 4, 
+            content_encoding=Constants.GZIP
+        ) as writer:
+            with gzip.GzipFile(fileobj=writer, mode='wb', compresslevel=6, mtime=0) as gz:
+                for chunk in json_list_chunks(readings):
+                    gz.write(chunk)
+
+        print('compressed response size:', writer.size)
+        if writer.spilled:
+            return { 
+                Constants.BUCKET: self.tmp_bucket, 
+                Constants.KEY: s3_key,
+                Constants.CONTENT_ENCODING: Constants.GZIP,
+            }
+
+        return {
+            Constants.CONTENT_ENCODING: Constants.GZIP,
+            Constants.COMPRESSED_DATA: base64.b64encode(writer.getvalue()).decode('utf-8'),
+        }
+
     def prediction_readings(
         self, 
         route_id: str, 
         annotator_preference: List[str] = [],
         key: str = None, 
         size_limit: int = None,
+        compress: bool = False,
     )-> List[Dict[str, Any]]:
 
         return self.all_route_readings(
@@ -189,9 +316,103 @@ class API(DB):
             size_limit,
             predictions_only=True,
             annotator_preference=annotator_preference,
+            compress=compress,
+        )
+
+    def get_geohash_readings_by_user(
+        self, 
+        geohashes, 
+        user_id: str, 
+        access: AccessContext = None
+    ) -> List[Dict[str, Any]]:
+        geohashes = self.__geohash_set(geohashes)
+
+        if access is None:
+            access = self.access_context(user_id)
+
+        geohash_reading_ids = defaultdict(set)
+        for reading_identifier in self.identifiers_for_layer_geohashes(access.layer_ids, geohashes):
+            geohash = reading_identifier[Constants.GEOHASH]
+            geohash_reading_ids[geohash].add(reading_identifier[Constants.READING_ID])
+
+        authorized_readings = self.readings_by_geohash(geohash_reading_ids)
+            
+        self.__inject_presigned_urls(authorized_readings)
+
+        return authorized_readings
+
+    def tiles_in_bbox(
+        self, 
+        min_lat: float, 
+        min_lng: float, 
+        max_lat: float, 
+        max_lng: float, 
+        precision: int,
+        user_id: str,
+        access: AccessContext = None,
+    ) -> List[Dict[str, Any]]:
+        '''Returns the fault statistics tiles of the given precision that
+        overlap the box. Tiles only summarize readings in layers the user
+        can access. Each layer has its own copy of a tile, tagged with the
+        layer's id, and these copies cannot be summed: a reading that is
+        in more than one of the user's layers is counted in each of them.
+        Areas without such readings have no tile.
+        '''
+
+        if isinstance(precision, bool) or not isinstance(precision, int):
+            raise TypeError(f'precision must be an integer, got {precision!r}')
+        if not TILE_MIN_PRECISION <= precision <= TILE_MAX_PRECISION:
+            raise ValueError(f'precision must be between {TILE_MIN_PRECISION} and {TILE_MAX_PRECISION}, got {precision}')
+
+        box = BBox(min_lat, min_lng, max_lat, max_lng)
+
+        cover_size = box.cover_size(precision)
+        if cover_size > self.MAX_VIEWPORT_TILES:
+            raise ValueError(f'bounding box covers {cover_size} tiles at precision {precision}, at most {self.MAX_VIEWPORT_TILES} are allowed')
+
+        if access is None:
+            access = self.access_context(user_id)
+
+        tiles = sorted(
+            self.tiles_for_layer_geohashes(access.layer_ids, box.geohash_cover(precision)),
+            key=lambda t: (t.geohash, t.layer_id)
         )
 
-    def get_geohash_readings_by_user(self, geohashes, user_id: str) -> List[Dict[str, Any]]:
+        return [{Constants.LAYER_ID: t.layer_id, **t.to_json()} for t in tiles]
+
+    def segments_by_user(
+        self, 
+        geohashes, 
+        user_id: str, 
+        access: AccessContext = None
+    ) -> List[Dict[str, Any]]:
+        '''Returns the aggregated segments in the given geohashes from
+        every layer the user can access. The parts of a segment in
+        different geohashes are merged together, but each layer has its
+        own copy of a segment, tagged with the layer's id. These copies 
+        cannot be summed: a reading that is in more than one of the 
+        user's layers is counted in each of them.
+        '''
+
+        geohashes = self.__geohash_set(geohashes)
+
+        if access is None:
+            access = self.access_context(user_id)
+
+        merged: Dict[Tuple[str, str], Segment] = {}
+        for segment in self.segments_for_layer_geohashes(access.layer_ids, geohashes):
+            key = (segment.id, segment.layer_id)
+            if key in merged:
+                merged[key].merge(segment)
+            else:
+                merged[key] = segment
+
+        return [
+            {Constants.LAYER_ID: merged[key].layer_id, **merged[key].to_json()} 
+            for key in sorted(merged)
+        ]
+
+    def __geohash_set(self, geohashes) -> Set[str]:
         if not isinstance(geohashes, list):
             if not isinstance(geohashes, str):
                 raise TypeError('must be a string or list of strings')
@@ -203,26 +424,36 @@ class API(DB):
         if len(geohashes) != len(set(geohashes)):
             raise ValueError('passed in duplicate geohashes')
             
-        geohashes = set(geohashes)
-        readings = []
-        for g in geohashes:
-            readings += self.geohash_readings(g, Constants.PREDICTION)
+        return set(geohashes)
 
-        layer_ids = self.layer_ids_for_user(user_id)
-        reading_id_set = set()
-        reading_identifiers = self.identifiers_for_layers(layer_ids)
-        for reading_identifier in reading_identifiers:
-            reading_id_set.add(reading_identifier[Constants.READING_ID])
+    def readings_in_bbox(
+        self, 
+        min_lat: float, 
+        min_lng: float, 
+        max_lat: float, 
+        max_lng: float, 
+        user_id: str,
+        access: AccessContext = None,
+    ) -> List[Dict[str, Any]]:
+        box = BBox(min_lat, min_lng, max_lat, max_lng)
 
-        authorized_readings = []
+        cover_size = box.cover_size()
+        if cover_size > self.MAX_BBOX_GEOHASHES:
+            raise ValueError(f'bounding box covers {cover_size} geohashes, at most {self.MAX_BBOX_GEOHASHES} are allowed')
 
-        for reading in readings:
-            if reading[Constants.READING_ID] in reading_id_set:
-                authorized_readings.append(reading)
-            
-        self.__inject_presigned_urls(authorized_readings)
+        if access is None:
+            access = self.access_context(user_id)
 
-        return authorized_readings
+        geohash_reading_ids = defaultdict(set)
+        for reading_identifier in self.identifiers_for_layer_geohashes(access.layer_ids, box.geohash_cover()):
+            geohash = reading_identifier[Constants.GEOHASH]
+            geohash_reading_ids[geohash].add(reading_identifier[Constants.READING_ID])
+
+        readings = [r for r in self.readings_by_geohash(geohash_reading_ids) if box.contains_reading(r)]
+
+        self.__inject_presigned_urls(readings)
+
+        return readings
 
     def __preferred_readings(self, preference: List[str], readings: Dict[str, Any]) -> None:
         reading_groups = defaultdict(lambda: [])
@@ -260,28 +491,52 @@ class API(DB):
 
     def __inject_samples_with_presigned_urls(self, route: Dict[str, Any]) -> None:
         if Constants.SAMPLE_DATA in route:
-            for _, sample in route[Constants.SAMPLE_DATA].items():
-                self.__inject_presigned_url(sample)
+            self.__inject_presigned_urls(list(route[Constants.SAMPLE_DATA].values()))
 
     def __inject_presigned_urls(self, readings: List[Dict[str, Any]]) -> None:
-        for r in readings:
-            self.__inject_presigned_url(r)
-    
-    def __inject_presigned_url(self, r: Dict[str, Any]) -> None:    
-        if Constants.URI in r[Constants.READING]:
-            uri = r[Constants.READING][Constants.URI]
-
-            r[Constants.READING][Constants.PRESIGNED_URL] = self.__presigned_url(
-                uri[Constants.BUCKET],
-                uri[Constants.KEY],
+        readings = [r for r in readings if Constants.URI in r[Constants.READING]]
+        urls = self.presigner.urls([
+            (r[Constants.READING][Constants.URI][Constants.BUCKET], r[Constants.READING][Constants.URI][Constants.KEY])
+            for r in readings
+        ])
+
+        for r, url in zip(readings, urls):
+            r[Constants.READING][Constants.PRESIGNED_URL] = url
+
+    def __delete_objects(self, uris: List[Dict[str, str]]) -> int:
+        bucket_keys = defaultdict(set)
+        for uri in uris:
+            bucket_keys[uri[Constants.BUCKET]].add(uri[Constants.KEY])
+
+        batches = []
+        for bucket, keys in bucket_keys.items():
+            keys = sorted(keys)
+            for start in range(0, len(keys), self.S3_DELETE_LIMIT):
+                batches.append((bucket, keys[start:start + self.S3_DELETE_LIMIT]))
+
+        return sum(self.fan_out.map(lambda batch: self.__delete_object_batch(*batch), batches))
+
+    def __delete_object_batch(self, bucket: str, keys: List[str]) -> int:
+        deleted = 0
+        attempt = 0
+
+        while len(keys) > 0:
+            response = self.s3_client.delete_objects(
+                Bucket=bucket,
+                Delete={'Objects': [{'Key': k} for k in keys]}
             )
+            deleted += len(response.get('Deleted', []))
 
-    def __presigned_url(self, bucket: str, object: str) -> str:
-        return self.s3_client.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': bucket,'Key': object},
-            ExpiresIn=259200
-        )
+            errors = response.get('Errors', [])
+            keys = [e['Key'] for e in errors]
+            if len(keys) > 0:
+                if attempt >= self.S3_DELETE_ATTEMPTS:
+                    raise ValueError(f'could not delete {len(keys)} objects from {bucket}: {errors[:3]}')
+
+                time.sleep(min(0.05 * 2 ** attempt, 2))
+                attempt += 1
+        
+        return deleted
 
     def __upload_file(self, route_id, file_name, bucket):
         object_name = route_id + file_name        
@@ -312,14 +567,22 @@ class API(DB):
             object_name,
         )
 
-    def __save_entries(self, route_id, entry_type, entries, save_img=True) -> List[Reading]:
+    def __save_entries(
+        self, 
+        route_id, 
+        entry_type, 
+        entries, 
+        save_img=True, 
+        reading_ids: List[str] = None
+    ) -> List[Reading]:
         finalized: List[Reading] = []
         n_entries = len(entries)
         for i, e in enumerate(entries):
             if i % 10 == 0:
                 print(f'uploading entry {i} of {n_entries}')
 
-            e = self.__json_to_entry(e, entry_type, str(uuid.uuid1()), route_id)
+            reading_id = reading_ids[i] if reading_ids is not None else str(uuid.uuid1())
+            e = self.__json_to_entry(e, entry_type, reading_id, route_id)
             e = self.__save_entry_data(e, save_img)
             finalized.append(e)
 
@@ -340,7 +603,13 @@ class API(DB):
     # -----------------------------------------------------------------
     # -----------------------------------------------------------------
 
-    def save_new_route(self, bucket: str, key: str, name: str = None) -> None:
+    def save_new_route(self, bucket: str, key: str, name: str = None, stream: bool = False) -> None:
+        command = ['python', 'farg.py', bucket, key, self.region_name, name]
+        if stream:
+            # Only task definitions whose farg.py accepts --stream can read
+            # the archive in place.
+            command.append('--stream')
+
         resp = self.ecs.run_task(
             networkConfiguration={
                 'awsvpcConfiguration': {
@@ -356,7 +625,7 @@ class API(DB):
                 'containerOverrides': [
                     {
                         'name': 'unzipper', 
-                        'command':  ['python', 'farg.py', bucket, key, self.region_name, name]
+                        'command': command
                     }
                 ]
             }
@@ -380,46 +649,134 @@ class API(DB):
 
         print(f'uploading route {route_spec} as {route_id}')
 
-        initial_entries = {}
-        timestamp = 0
-        geohashes = set()
+        if layer_id is None:
+            layer_id = self.new_route_layer(route_id)
 
-        all_entries = []
+        readings: Dict[str, List[Reading]] = {}
         for reading_spec in route_spec.reading_specs:
             print(f'starting upload for reading {reading_spec}')
 
             entries = reading_spec.load_readings()
 
             if len(entries) > 0:
-                finalized_readings = self.__save_entries(route_id, reading_spec.reading_type, entries)
-
-                for e in finalized_readings:
-                    geohashes.add(e.geohash)
-
-                first_entry: Reading = finalized_readings[0]
-                initial_entries[reading_spec.reading_type] = first_entry
-
-                if timestamp == 0:
-                    timestamp = first_entry.timestamp
-
-                all_entries.extend([r.query_data() for r in finalized_readings])
+                readings[reading_spec.reading_type] = self.save_route_readings(
+                    route_id, 
+                    reading_spec.reading_type, 
+                    entries, 
+                    layer_id
+                )
 
                 print('Finished saving all readings to FDS database')
             else:
                 print(f'No entries found for reading specification {reading_spec}')
 
+        return self.finish_route(
+            route_id, 
+            user_id, 
+            group_id, 
+            layer_id, 
+            readings, 
+            route_spec.name
+        )
+
+    def new_route_layer(self, route_id: str, layer_id: str = None) -> str:
         if layer_id is None:
             layer_id = str(uuid.uuid1())
-            self.put_layer(layer_id, name=f'RouteLayer#{route_id}')
+        self.put_layer(layer_id, name=f'RouteLayer#{route_id}')
+
+        return layer_id
 
-        self.add_readings_to_layer(layer_id, all_entries)
+    def save_route_readings(
+        self, 
+        route_id: str, 
+        reading_type: str, 
+        entries: List[Dict[str, Any]], 
+        layer_id: str,
+        checkpoint: Checkpoint = None
+    ) -> List[Reading]:
+        '''Saves one batch of a route's readings and adds them to the 
+        route's layer. A route can be saved in any number of batches, 
+        as long as finish_route is called once they have all been saved.
+        Tiles and segments are only rebuilt by finish_route, so that 
+        each affected geohash is rebuilt once per route rather than once
+        per batch.
+
+        With a checkpoint, every entry must already carry its 
+        READING_ID. Readings the checkpoint has as written or linked are
+        not written or linked again, and the rest are checkpointed once
+        saved.
+        '''
+
+        if checkpoint is None:
+            finalized = self.__save_entries(route_id, reading_type, entries)
+            self.add_readings_to_layer(layer_id, [r.query_data() for r in finalized], update_aggregates=False)
+
+            return finalized
+
+        to_write = [e for e in entries if not checkpoint.is_done(Checkpoint.WRITTEN, e[Constants.READING_ID])]
+        written = self.__save_entries(
+            route_id, 
+            reading_type, 
+            to_write, 
+            reading_ids=[e[Constants.READING_ID] for e in to_write]
+        )
+        self.add_checkpoints(checkpoint, Checkpoint.WRITTEN, [r.id for r in written])
+
+        written = {r.id: r for r in written}
+        finalized = [
+            written[e[Constants.READING_ID]] if e[Constants.READING_ID] in written 
+            else self.__json_to_entry(e, reading_type, e[Constants.READING_ID], route_id) 
+            for e in entries
+        ]
+        to_link = [r for r in finalized if not checkpoint.is_done(Checkpoint.LINKED, r.id)]
+        self.add_readings_to_layer(layer_id, [r.query_data() for r in to_link], update_aggregates=False)
+        self.add_checkpoints(checkpoint, Checkpoint.LINKED, [r.id for r in to_link])
+
+        return finalized
+
+    def finish_route(
+        self,
+        route_id: str,
+        user_id: str,
+        group_id: str,
+        layer_id: str,
+        readings: Dict[str, List[Reading]],
+        name: str = None
+    ) -> Route:
+        '''Rebuilds the tiles and segments covering readings and saves 
+        the route itself, once all of its readings have been saved with
+        save_route_readings. readings maps each reading type to the
+        readings of that type, in the order they were recorded.
+        '''
+
+        initial_entries = {}
+        timestamp = 0
+        geohashes = set()
+        prediction_geohashes = set()
+
+        for reading_type, finalized_readings in readings.items():
+            if len(finalized_readings) == 0:
+                continue
+
+            for e in finalized_readings:
+                geohashes.add(e.geohash)
+                if e.reading_type == Constants.PREDICTION:
+                    prediction_geohashes.add(e.geohash)
+
+            first_entry: Reading = finalized_readings[0]
+            initial_entries[reading_type] = first_entry
+
+            if timestamp == 0:
+                timestamp = first_entry.timestamp
+
+        self.update_layer_aggregates(layer_id, prediction_geohashes)
 
         route = Route(
             user_id=user_id,
             group_id=group_id,
             id=route_id,
             timestamp=timestamp,
-            name=route_spec.name if route_spec.name else None,
+            name=name if name else None,
             geohashes=geohashes,
             sample_data=initial_entries,
             layer_id=layer_id
@@ -430,39 +787,56 @@ class API(DB):
 
         return route
 
-    def routes_for_user(self, user_id: str) -> List[Dict[str, Any]]:
-        routes = super().routes_for_user(user_id)
-        for r in routes:
-            self.__inject_samples_with_presigned_urls(r)
+    def routes_for_user(self, user_id: str, access: AccessContext = None) -> List[Dict[str, Any]]:
+        if access is None:
+            access = self.access_context(user_id)
+
+        routes = access.routes()
+        samples = [
+            sample 
+            for r in routes if Constants.SAMPLE_DATA in r 
+            for sample in r[Constants.SAMPLE_DATA].values()
+        ]
+        self.__inject_presigned_urls(samples)
         
         return routes
 
     def set_as_predicting(self, route_id: str) -> None:
         self.set_route_status(route_id, RouteStatus.PREDICTING)
 
-    def delete_route(self, route_id: str) -> Any:
-        deletedImgCount = 0
+    def delete_route(self, route_id: str, layer_ids: Iterable[str] = ()) -> Tuple[int, int]:
+        '''Deletes a route, its readings and their images. The readings 
+        are removed from the route's own layer and from any other layers
+        in layer_ids, but not looked for in any other layer.
+        '''
 
-        readings = self.all_route_readings(route_id)
+        route = super().get_route(route_id)
+        readings = self.get_route_readings(route_id)
 
+        image_uris = []
         for r in readings:
             if r[Constants.READING_TYPE] == Constants.PREDICTION:
                 reading = r[Constants.READING]
                 if Constants.URI in reading:
-                    uri = reading[Constants.URI]
-                    self.s3_client.delete_object(
-                        Bucket=uri[Constants.BUCKET],
-                        Key=uri[Constants.KEY]
-                    )
+                    image_uris.append(reading[Constants.URI])
 
+        deletedImgCount = self.__delete_objects(image_uris)
+        layer_ids = set(layer_ids)
+        if route and Constants.LAYER_ID in route:
+            layer_ids.add(route[Constants.LAYER_ID])
+        self.remove_readings_from_layers(layer_ids, readings)
         deletedReadingCount = self.delete_reading_items(readings)
 
         self.remove_route(route_id)
 
         return (deletedReadingCount, deletedImgCount)
 
-    def get_route(self, route_id: str) -> Dict[str, Any]:
-        r = super().get_route(route_id)
+    def get_route(self, route_id: str, access: AccessContext = None) -> Dict[str, Any]:
+        if access is None:
+            r = super().get_route(route_id)
+        else:
+            r = access.route(route_id)
+
         if not r:
             return r
 
@@ -489,19 +863,15 @@ class API(DB):
     # -----------------------------------------------------------------
     # -----------------------------------------------------------------
 
-    def can_access_route(self, user_id: str, route_id: str) -> bool:
-        group_ids = self.groups_for_user(user_id)
-
-        route = self.get_route(route_id)
+    def access_context(self, user_id: str) -> AccessContext:
+        '''Returns an object that answers access questions for the given
+        user, loading what it needs at most once. Create one per request.
+        '''
 
-        if route is None:
-            return False
+        return AccessContext(self, user_id, self.access_cache)
 
-        for group_id in group_ids:
-            if route[Constants.GROUP_ID] == group_id:
-                return True
-        
-        return False
+    def can_access_route(self, user_id: str, route_id: str) -> bool:
+        return self.access_context(user_id).can_access_route(route_id)
 
     def save_user(self, org_name:str, uid: str, data_access_groups: List[Dict[str, str]] = []) -> None:
         all_users = self.all_users(org_name)
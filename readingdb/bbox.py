@@ -0,0 +1,77 @@
+import math
+from typing import Any, Dict, List, Tuple
+
+import pygeohash as pgh
+
+from readingdb.constants import *
+
+class BBox():
+    '''A latitude/longitude aligned box, edges included. Boxes that cross
+    the antimeridian are not supported.
+    '''
+
+    def __init__(self, min_lat: float, min_lng: float, max_lat: float, max_lng: float) -> None:
+        for name, value in [('min_lat', min_lat), ('min_lng', min_lng), ('max_lat', max_lat), ('max_lng', max_lng)]:
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise TypeError(f'{name} must be a number, got {value!r}')
+
+        if not -90 <= min_lat <= max_lat <= 90:
+            raise ValueError(f'latitudes must satisfy -90 <= min_lat <= max_lat <= 90, got {min_lat}, {max_lat}')
+        if not -180 <= min_lng <= max_lng <= 180:
+            raise ValueError(f'longitudes must satisfy -180 <= min_lng <= max_lng <= 180, got {min_lng}, {max_lng}')
+
+        self.min_lat = min_lat
+        self.min_lng = min_lng
+        self.max_lat = max_lat
+        self.max_lng = max_lng
+
+    def contains(self, lat: float, lng: float) -> bool:
+        return self.min_lat <= lat <= self.max_lat and self.min_lng <= lng <= self.max_lng
+
+    def contains_reading(self, reading: Dict[str, Any]) -> bool:
+        return self.contains(
+            float(reading[Constants.READING][Constants.LATITUDE]),
+            float(reading[Constants.READING][Constants.LONGITUDE]),
+        )
+
+    def geohash_cover(self, precision: int = GEOHASH_PRECISION) -> List[str]:
+        '''Returns every geohash of the given precision that overlaps the
+        box, which is the smallest set of geohashes of that precision
+        that covers it.
+        '''
+
+        rows, cols, cell_height, cell_width = self.__grid(precision)
+
+        return [
+            pgh.encode(
+                -90 + (row + 0.5) * cell_height,
+                -180 + (col + 0.5) * cell_width,
+                precision=precision
+            )
+            for row in rows
+            for col in cols
+        ]
+
+    def cover_size(self, precision: int = GEOHASH_PRECISION) -> int:
+        rows, cols, _, _ = self.__grid(precision)
+        return len(rows) * len(cols)
+
+    def __grid(self, precision: int) -> Tuple[range, range, float, float]:
+        # A geohash of precision p interleaves 5p bits, starting with
+        # longitude, so each precision is a regular grid over the world.
+        lng_bits = math.ceil(5 * precision / 2)
+        lat_bits = math.floor(5 * precision / 2)
+        cell_height = 180 / 2 ** lat_bits
+        cell_width = 360 / 2 ** lng_bits
+
+        def cells(low: float, high: float, origin: float, size: float, bits: int) -> range:
+            first = int((low - origin) // size)
+            last = min(int((high - origin) // size), 2 ** bits - 1)
+            return range(first, last + 1)
+
+        return (
+            cells(self.min_lat, self.max_lat, -90, cell_height, lat_bits),
+            cells(self.min_lng, self.max_lng, -180, cell_width, lng_bits),
+            cell_height,
+            cell_width,
+        )
@@ -0,0 +1,75 @@
+import uuid
+from typing import Any, Dict, Iterable, List
+
+from readingdb.constants import *
+
+def checkpoint_partition_key(route_id: str) -> str:
+    return f'{Constants.CHECKPOINT_PK}#{route_id}'
+
+def ingest_route_id(bucket: str, key: str, version: str = None) -> str:
+    '''Routes ingested by the digester get an id derived from the S3
+    object they were uploaded as, so that a restarted ingestion finds
+    the checkpoints of the run it is resuming. version (e.g. the
+    object's ETag) tells apart different uploads to the same key.
+    '''
+
+    source = f's3://{bucket}/{key}'
+    if version is not None:
+        source += f'?{version}'
+
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, source))
+
+class Checkpoint():
+    '''Records how far the ingestion of a route has got: which images
+    have been uploaded, which readings have been written and which
+    readings have been added to the route's layer. Reading and layer
+    ids are derived from the route id, so repeating a step that was
+    interrupted before its checkpoint was recorded overwrites the same
+    items instead of duplicating them.
+    '''
+
+    UPLOADED = 'Uploaded'
+    WRITTEN = 'Written'
+    LINKED = 'Linked'
+    STAGES = [UPLOADED, WRITTEN, LINKED]
+
+    def __init__(self, route_id: str) -> None:
+        self.route_id = route_id
+        self.namespace = uuid.UUID(route_id)
+        self.layer_id = str(uuid.uuid5(self.namespace, Constants.LAYER_PK))
+        self.completed: Dict[str, set] = {stage: set() for stage in self.STAGES}
+
+    @classmethod
+    def from_items(cls, route_id: str, items: Iterable[Dict[str, Any]]) -> 'Checkpoint':
+        checkpoint = Checkpoint(route_id)
+        for item in items:
+            checkpoint.completed[item[Constants.STAGE]].add(item[Constants.CHECKPOINT_KEY])
+
+        return checkpoint
+
+    def reading_id(self, image_key: str) -> str:
+        return str(uuid.uuid5(self.namespace, image_key))
+
+    def is_done(self, stage: str, key: str) -> bool:
+        return key in self.completed[stage]
+
+    def remaining(self, stage: str, keys: Iterable[str]) -> List[str]:
+        return [k for k in keys if not self.is_done(stage, k)]
+
+    def mark(self, stage: str, keys: Iterable[str]) -> None:
+        self.completed[stage].update(keys)
+
+    def count(self, stage: str) -> int:
+        return len(self.completed[stage])
+
+    def item_data(self, stage: str, key: str) -> Dict[str, Any]:
+        if stage not in self.STAGES:
+            raise ValueError(f'unknown checkpoint stage {stage}, expected one of {self.STAGES}')
+
+        return {
+            Constants.PARTITION_KEY: checkpoint_partition_key(self.route_id),
+            Constants.SORT_KEY: f'{stage}#{key}',
+            Constants.ROUTE_ID: self.route_id,
+            Constants.STAGE: stage,
+            Constants.CHECKPOINT_KEY: key,
+        }
@@ -19,6 +19,7 @@ class Constants():
     
     # Database
     READING_TABLE_NAME = 'Readings2'
+    ROUTE_INDEX_NAME = 'RouteIndex'
     ORG_TABLE_NAME = 'Org'
     PAGINATION_KEY_NAME = 'PaginationKey'
     USER_TABLE_NAME = 'Annotators'
@@ -30,6 +31,12 @@ class Constants():
     ORG_PK = 'Org'
     USER_PK = 'User'
     GROUP_PK = 'Group'
+    IMAGE_READING_PK = 'ImageReading'
+    LAYER_GEOHASH_PK = 'LayerGeohash'
+    SEGMENT_PK = 'Segment'
+    TILE_PK = 'Tile'
+    CHECKPOINT_PK = 'Checkpoint'
+    SNAP_CACHE_PK = 'SnapCache'
 
     # AccessGroups
     GROUP_NAME = 'GroupName'
@@ -53,11 +60,13 @@ class Constants():
     LATITUDE = 'Latitude'
     LONGITUDE = 'Longitude'
     PLACE_ID = 'PlaceID'
+    GPS_GAP = 'GPSGap'
 
     # Image Reading Keys
     FILENAME = 'ImageFileName'
     URI = 'S3Uri'
     PRESIGNED_URL = 'PresignedURL'
+    IMAGE_KEY = 'ImageKey'
 
     # Prediction Reading Keys
     ENTITIES = 'Entities'
@@ -77,6 +86,11 @@ class Constants():
     BUCKET = 'Bucket'
     KEY = 'Key'
 
+    # Compressed Responses
+    CONTENT_ENCODING = 'ContentEncoding'
+    GZIP = 'gzip'
+    COMPRESSED_DATA = 'Data'
+
     # Entity Keys
     ENTITY_NAME = 'Name'
     CONFIDENCE = 'Confidence'
@@ -88,6 +102,32 @@ class Constants():
     XMAX = 'xmax'
     YMAX = 'ymax'
 
+    # Segment Keys
+    SEGMENTS = 'Segments'
+    SEGMENT_ID = 'SegmentID'
+    READING_COUNT = 'ReadingCount'
+    ENTITY_COUNTS = 'EntityCounts'
+    SEVERITY_SUMS = 'SeveritySums'
+    MEAN_SEVERITIES = 'MeanSeverities'
+    MAX_CONFIDENCES = 'MaxConfidences'
+    MIN_LATITUDE = 'MinLatitude'
+    MIN_LONGITUDE = 'MinLongitude'
+    MAX_LATITUDE = 'MaxLatitude'
+    MAX_LONGITUDE = 'MaxLongitude'
+
+    # Tile Keys
+    TILES = 'Tiles'
+    PRECISION = 'Precision'
+
+    # Checkpoint Keys
+    STAGE = 'Stage'
+    CHECKPOINT_KEY = 'CheckpointKey'
+
+    # Snap Cache Keys
+    SNAP_KEY = 'SnapKey'
+    SNAPPED_POINTS = 'SnappedPoints'
+    EXPIRES_AT = 'ExpiresAt'
+
     # Layer Keys
     LAYER_NAME = 'LayerName'
     LAYER_READINGS = 'LayerReadings'
@@ -111,6 +151,12 @@ class LambdaConstants():
     EVENT_OBJECT_KEY = 'Key'
     EVENT_ROUTE_NAME = 'RouteName'
     EVENT_POINTS = 'Points'
+    EVENT_COMPRESS = 'Compress'
+    EVENT_USE_SNAP_CACHE = 'UseSnapCache'
+    EVENT_MIN_LATITUDE = 'MinLatitude'
+    EVENT_MIN_LONGITUDE = 'MinLongitude'
+    EVENT_MAX_LATITUDE = 'MaxLatitude'
+    EVENT_MAX_LONGITUDE = 'MaxLongitude'
 
     # Event Types -----------------------------------------------------
 
@@ -126,6 +172,9 @@ class LambdaConstants():
     EVENT_GET_USER_ROUTES = 'GetUserRoutes'
     EVENT_GET_USER_LAYERS = 'GetUserLayers'
     EVENT_GET_READINGS = 'GetReadings'
+    EVENT_GET_BBOX_READINGS = 'GetBoundingBoxReadings'
+    EVENT_GET_SEGMENTS = 'GetSegments'
+    EVENT_GET_TILES = 'GetTiles'
     EVENT_UPDATE_ROUTE_NAME = 'UpdateRouteName'
 
     # Admin Permission Events
@@ -139,6 +188,8 @@ class LambdaConstants():
     RESPONSE_STATUS_KEY = 'Status'
     RESPONSE_BODY_KEY = 'Body'
     RESPONSE_SAVED_READINGS = 'SavedReadings'
+    RESPONSE_DELETED_READINGS = 'DeletedReadings'
+    RESPONSE_DELETED_IMAGES = 'DeletedImages'
 
     # Response Statuses
     RESPONSE_ERROR = 'Error'
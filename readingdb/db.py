@@ -1,20 +1,36 @@
+from collections import defaultdict
 import uuid
 from readingdb.format import route_sort_key
 from readingdb.utils import timestamp
 import time
-from typing import Any, Callable, Dict, List, Set, Tuple
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Set, Tuple
 
 import boto3
 from boto3.dynamodb.conditions import Key
 
 from readingdb.clean import *
-from readingdb.reading import Reading, geohash_partition_key
+from readingdb.accesscache import AccessCache
+from readingdb.checkpoint import Checkpoint, checkpoint_partition_key
+from readingdb.fanout import FanOut
+from readingdb.faultstats import preferred_readings
+from readingdb.reading import Reading, geohash_partition_key, image_keys
 from readingdb.route import Route
+from readingdb.segment import Segment, segment_partition_key
+from readingdb.snapcache import snap_cache_partition_key
+from readingdb.tile import TILE_MAX_PRECISION, TILE_MIN_PRECISION, Tile, tile_children_partition_key, tile_partition_key
 from readingdb.constants import *
 
 class DB():
     ITEM_KEY = 'Items'
     LAST_EVAL_KEY = 'LastEvaluatedKey'
+    RESPONSES_KEY = 'Responses'
+    UNPROCESSED_KEYS_KEY = 'UnprocessedKeys'
+    UNPROCESSED_ITEMS_KEY = 'UnprocessedItems'
+    BATCH_GET_LIMIT = 100
+    BATCH_WRITE_LIMIT = 25
+    BATCH_ATTEMPTS = 8
+    IMAGE_QUERY_LIMIT = 100
+    MAX_LAYER_GEOHASH_PARTITIONS = 2000
 
     def __init__(
         self, 
@@ -23,6 +39,9 @@ class DB():
         region_name='ap-southeast-2', 
         config=None,
         max_page_readings=1800,
+        max_query_workers=16,
+        access_cache_ttl=60,
+        debug=False,
     ):
         self.db = boto3.resource(
             resource_name, 
@@ -39,6 +58,20 @@ class DB():
         self.scan_paginator = self.client.get_paginator('scan')
         self.max_page_readings = max_page_readings
 
+        # Queries against separate partitions are independent of each
+        # other so they can be run concurrently over the (thread safe)
+        # client.
+        self.fan_out = FanOut(max_query_workers)
+        self.route_index_active = False
+
+        # Group and layer memberships change rarely but are read on 
+        # every request, so warm containers keep them for a short time.
+        self.access_cache = AccessCache(ttl=access_cache_ttl)
+
+        # Prints timings and other diagnostics that are too noisy to 
+        # print on every request.
+        self.debug = debug
+
         self.reading_table = self.db.Table(Constants.READING_TABLE_NAME)
         self.org_table = self.db.Table(Constants.ORG_TABLE_NAME)
 
@@ -56,36 +89,152 @@ class DB():
         decode_fn: Callable[[Dict[str, Any]], Any],
         query_key: str = None,
         query_value: str = None,
+        index_name: str = None,
+        sort_key_prefix: str = None,
     )-> Any:
+        return list(self.__iterate_table(
+            table_name,
+            decode_fn,
+            query_key,
+            query_value,
+            index_name,
+            sort_key_prefix,
+        ))
+
+    def __iterate_table(
+        self, 
+        table_name: str,
+        decode_fn: Callable[[Dict[str, Any]], Any] = None,
+        query_key: str = None,
+        query_value: str = None,
+        index_name: str = None,
+        sort_key_prefix: str = None,
+    )-> Iterator[Dict[str, Any]]:
+        '''Yields every item in a partition (or the whole table if no
+        query key is given), decoding each one as it goes. If 
+        sort_key_prefix is given only items whose sort key starts with it
+        are read. Pages are
+        only requested from DynamoDB once the previous page has been
+        consumed, so callers that stop iterating early never load the
+        remaining pages.
+        '''
+
         if query_key is not None:
-            pg = self.paginator.paginate(
-                TableName=table_name,
-                KeyConditionExpression=Key(query_key).eq(query_value)
-            )
+            condition = Key(query_key).eq(query_value)
+            if sort_key_prefix is not None:
+                condition = condition & Key(Constants.SORT_KEY).begins_with(sort_key_prefix)
+
+            query_args = {
+                'TableName': table_name,
+                'KeyConditionExpression': condition
+            }
+            if index_name is not None:
+                query_args['IndexName'] = index_name
+
+            pg = self.paginator.paginate(**query_args)
         else:
             pg = self.scan_paginator.paginate(
                 TableName=table_name,
             )
 
-        items = []
         for page in pg:
             for item in page[self.ITEM_KEY]:
-                decode_fn(item)
-                items.append(item)
+                if decode_fn is not None:
+                    decode_fn(item)
+                yield item
+
+    def batch_write(
+        self, 
+        table_name: str, 
+        puts: Iterable[Dict[str, Any]] = (), 
+        deletes: Iterable[Dict[str, Any]] = (),
+    ) -> int:
+        '''Puts and deletes (given as primary keys) many items in 
+        BatchWriteItem requests of 25, which are sent concurrently. 
+        Unprocessed items are retried with backoff, and if some are
+        still unprocessed after BATCH_ATTEMPTS requests a ValueError
+        is raised. A single batch cannot touch the same item twice, so
+        only the last write to each item is sent. Returns the number 
+        of items written.
+        '''
+
+        requests = {}
+        for item in puts:
+            requests[self.__primary_key_values(item)] = {'PutRequest': {'Item': item}}
+        for key in deletes:
+            requests[self.__primary_key_values(key)] = {'DeleteRequest': {'Key': key}}
+
+        requests = list(requests.values())
+        chunks = [
+            requests[start:start + self.BATCH_WRITE_LIMIT] 
+            for start in range(0, len(requests), self.BATCH_WRITE_LIMIT)
+        ]
+
+        return sum(self.fan_out.map(lambda chunk: self.__write_chunk(table_name, chunk), chunks))
+
+    def __write_chunk(self, table_name: str, chunk: List[Dict[str, Any]]) -> int:
+        request = {table_name: chunk}
+        attempt = 1
+
+        while True:
+            response = self.client.batch_write_item(RequestItems=request)
+
+            request = response.get(self.UNPROCESSED_ITEMS_KEY, {})
+            if len(request) == 0:
+                return len(chunk)
+
+            self.__retry_unprocessed(table_name, 'write', len(request.get(table_name, [])), attempt)
+            attempt += 1
+
+    def batch_get(self, table_name: str, keys: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        '''Gets the items with the given primary keys in BatchGetItem
+        requests of 100. Keys that have no item are left out. Unprocessed
+        keys are retried like batch_write retries unprocessed items.
+        '''
+
+        items = []
+        for start in range(0, len(keys), self.BATCH_GET_LIMIT):
+            request = {table_name: {'Keys': keys[start:start + self.BATCH_GET_LIMIT]}}
+            attempt = 1
+
+            while True:
+                response = self.db.batch_get_item(RequestItems=request)
+                items.extend(response[self.RESPONSES_KEY].get(table_name, []))
+
+                request = response.get(self.UNPROCESSED_KEYS_KEY, {})
+                if len(request) == 0:
+                    break
+
+                self.__retry_unprocessed(table_name, 'get', len(request.get(table_name, {}).get('Keys', [])), attempt)
+                attempt += 1
 
         return items
 
+    def __retry_unprocessed(self, table_name: str, operation: str, n_unprocessed: int, attempt: int) -> None:
+        if attempt >= self.BATCH_ATTEMPTS:
+            raise ValueError(f'batch {operation} on {table_name} left {n_unprocessed} items unprocessed after {attempt} attempts')
+
+        time.sleep(min(0.05 * 2 ** (attempt - 1), 2))
+
+    def __primary_key_values(self, item: Dict[str, Any]) -> Tuple[Any, Any]:
+        return (item[Constants.PARTITION_KEY], item[Constants.SORT_KEY])
+
     def all_tables(self) -> List[Any]:
         return list(self.db.tables.all())
 
     def create_reading_db(
         self, 
     ) -> Tuple[Any, Any]:
+        self.route_index_active = False
+        self.access_cache.clear()
         self.reading_table = self.__make_reading_table()
         self.org_table = self.__make_org_table()
+        self.enable_org_ttl()
         return (self.reading_table, self.org_table)
 
     def teardown_reading_db(self) -> None:
+        self.route_index_active = False
+        self.access_cache.clear()
         self.__delete_table(Constants.READING_TABLE_NAME)
         self.__delete_table(Constants.ORG_TABLE_NAME)
     
@@ -179,6 +328,25 @@ class DB():
                 },
             )
 
+    def enable_org_ttl(self) -> None:
+        '''Lets DynamoDB delete org table items (e.g. SnapCache entries)
+        once the time in their EXPIRES_AT attribute has passed. Does 
+        nothing if this is already enabled.
+        '''
+
+        self.org_table.wait_until_exists()
+        ttl = self.client.describe_time_to_live(TableName=Constants.ORG_TABLE_NAME)['TimeToLiveDescription']
+        if ttl.get('TimeToLiveStatus') in ('ENABLED', 'ENABLING') and ttl.get('AttributeName') == Constants.EXPIRES_AT:
+            return
+
+        self.client.update_time_to_live(
+            TableName=Constants.ORG_TABLE_NAME,
+            TimeToLiveSpecification={
+                'Enabled': True,
+                'AttributeName': Constants.EXPIRES_AT,
+            }
+        )
+
     def __make_org_table(self):
         return self.db.create_table(
             TableName=Constants.ORG_TABLE_NAME,
@@ -217,39 +385,78 @@ class DB():
     # -----------------------------------------------------------------
 
     def put_readings(self, readings: List[Reading]):
+        items = [r.item_data() for r in readings]
+
         with self.reading_table.batch_writer() as batch:
-            for r in readings:
-                batch.put_item(Item=r.item_data())
+            for item in items:
+                batch.put_item(Item=item)
+        
+        self.__put_image_index_items(items)
 
     def get_route_readings(self, route_id: str) -> List[Dict[str, Any]]:
+        if self.has_route_index():
+            return self.__paginate_table(
+                Constants.READING_TABLE_NAME,
+                Reading.decode,
+                Constants.ROUTE_ID,
+                route_id,
+                index_name=Constants.ROUTE_INDEX_NAME,
+            )
+
+        print(f'WARNING: {Constants.ROUTE_INDEX_NAME} is not active on {Constants.READING_TABLE_NAME}, falling back to loading every reading in the route\'s geohashes')
+        return self.__geohash_route_readings(route_id)
+
+    def __geohash_route_readings(self, route_id: str) -> List[Dict[str, Any]]:
         geohashes = self.route_geohashes(route_id)
-        all_readings = []
 
-        for geohash in geohashes:
+        def route_hash_readings(geohash: str) -> List[Dict[str, Any]]:
             hash_readings = self.__paginate_table(
                 Constants.READING_TABLE_NAME,
                 Reading.decode,
                 Constants.PARTITION_KEY,
                 geohash_partition_key(geohash, Constants.PREDICTION),
             )
-            all_readings.extend([r for r in hash_readings if r[Constants.ROUTE_ID] == route_id])
-        
+            return [r for r in hash_readings if r[Constants.ROUTE_ID] == route_id]
+
+        all_hash_readings, timings = self.fan_out.map_timed(route_hash_readings, sorted(geohashes))
+        all_readings = []
+        for hash_readings in all_hash_readings:
+            all_readings.extend(hash_readings)
+
+        if self.debug:
+            print('route readings partition timings:', self.fan_out.report(timings))
+
         return all_readings
 
     def geohash_readings(self, geohash: str, reading_type: str) -> List[Dict[str, Any]]:
-        response = self.reading_table.query(
-            KeyConditionExpression=Key(Constants.PARTITION_KEY).eq(geohash_partition_key(geohash, reading_type))
+        return list(self.iter_geohash_readings(geohash, reading_type))
+
+    def iter_geohash_readings(self, geohash: str, reading_type: str) -> Iterator[Dict[str, Any]]:
+        return self.__iterate_table(
+            Constants.READING_TABLE_NAME,
+            Reading.decode,
+            Constants.PARTITION_KEY,
+            geohash_partition_key(geohash, reading_type),
         )
-        return response[self.ITEM_KEY]
 
     def put_reading(self, reading: Reading):
-        return self.reading_table.put_item(Item=reading.item_data())
+        item = reading.item_data()
+        response = self.reading_table.put_item(Item=item)
+        self.__put_image_index_items([item])
 
-    def delete_reading_items(self, readings: List[Dict[str, str]])-> None:
-        for reading in readings:
-            self.reading_table.delete_item(
-                Key=Reading.get_key(reading)
-            )
+        return response
+
+    def delete_reading_items(self, readings: List[Dict[str, str]])-> int:
+        readings = list(readings)
+
+        deleted = self.batch_write(
+            Constants.READING_TABLE_NAME, 
+            deletes=[Reading.get_key(reading) for reading in readings]
+        )
+        
+        self.__delete_image_index_items(readings)
+
+        return deleted
 
     def __make_reading_table(self):
         return self.db.create_table(
@@ -273,7 +480,16 @@ class DB():
                     'AttributeName': Constants.SORT_KEY,
                     'AttributeType': 'S'
                 },
-
+                {
+                    'AttributeName': Constants.ROUTE_ID,
+                    'AttributeType': 'S'
+                },
+            ],
+            GlobalSecondaryIndexes=[
+                self.__route_index_spec({
+                    'ReadCapacityUnits': 500,
+                    'WriteCapacityUnits': 500
+                })
             ],
             ProvisionedThroughput={
                 'ReadCapacityUnits': 500,
@@ -281,6 +497,206 @@ class DB():
             }
         )
 
+    def __route_index_spec(self, throughput: Dict[str, int] = None) -> Dict[str, Any]:
+        # Every reading already stores its RouteID, so all the 
+        # readings for a route can be read from this index without
+        # touching readings from other routes in the same geohashes.
+        spec = {
+            'IndexName': Constants.ROUTE_INDEX_NAME,
+            'KeySchema': [
+                {
+                    'AttributeName': Constants.ROUTE_ID,
+                    'KeyType': 'HASH'
+                },
+                {
+                    'AttributeName': Constants.SORT_KEY,
+                    'KeyType': 'RANGE'
+                }
+            ],
+            'Projection': {
+                'ProjectionType': 'ALL'
+            },
+        }
+
+        if throughput is not None:
+            spec['ProvisionedThroughput'] = throughput
+
+        return spec
+
+    def has_route_index(self) -> bool:
+        if self.route_index_active:
+            return True
+
+        table = self.client.describe_table(TableName=Constants.READING_TABLE_NAME)['Table']
+        for index in table.get('GlobalSecondaryIndexes', []):
+            if index['IndexName'] == Constants.ROUTE_INDEX_NAME and index['IndexStatus'] == 'ACTIVE':
+                self.route_index_active = True
+
+        return self.route_index_active
+
+    def add_route_index(self, poll_seconds: int = 10) -> None:
+        '''Adds the RouteID index to a reading table that was created
+        before the index existed. DynamoDB backfills the index from
+        the existing readings, this blocks until the backfill is
+        finished and the index can be queried.
+        '''
+
+        if self.has_route_index():
+            return
+
+        table = self.client.describe_table(TableName=Constants.READING_TABLE_NAME)['Table']
+        existing = [i['IndexName'] for i in table.get('GlobalSecondaryIndexes', [])]
+
+        if Constants.ROUTE_INDEX_NAME not in existing:
+            throughput = None
+            billing = table.get('BillingModeSummary', {}).get('BillingMode', 'PROVISIONED')
+            if billing == 'PROVISIONED':
+                throughput = {
+                    'ReadCapacityUnits': table['ProvisionedThroughput']['ReadCapacityUnits'],
+                    'WriteCapacityUnits': table['ProvisionedThroughput']['WriteCapacityUnits'],
+                }
+
+            self.client.update_table(
+                TableName=Constants.READING_TABLE_NAME,
+                AttributeDefinitions=[
+                    {
+                        'AttributeName': Constants.ROUTE_ID,
+                        'AttributeType': 'S'
+                    },
+                    {
+                        'AttributeName': Constants.SORT_KEY,
+                        'AttributeType': 'S'
+                    },
+                ],
+                GlobalSecondaryIndexUpdates=[
+                    {'Create': self.__route_index_spec(throughput)}
+                ]
+            )
+
+        while not self.has_route_index():
+            print(f'waiting for {Constants.ROUTE_INDEX_NAME} to finish backfilling')
+            time.sleep(poll_seconds)
+
+    # -----------------------------------------------------------------
+    # -----------------------------------------------------------------
+    # -----------------------------------------------------------------
+    # --------------------------- IMAGES ------------------------------
+    # -----------------------------------------------------------------
+    # -----------------------------------------------------------------
+    # -----------------------------------------------------------------
+
+    def readings_for_images(self, route_id: str, keys: Iterable[str]) -> List[Dict[str, Any]]:
+        '''Loads the readings in a route which refer to any of the given
+        image keys (see reading.image_keys), ordered by reading id.
+
+        A route's image index items share one partition, sorted by image
+        key. Up to IMAGE_QUERY_LIMIT keys are looked up with a query 
+        each; for more than that a single query over the route's whole
+        image index partition is cheaper.
+        '''
+
+        keys = sorted(set(keys))
+        if len(keys) > self.IMAGE_QUERY_LIMIT:
+            wanted = set(keys)
+            found = [
+                identifier 
+                for identifier in self.__paginate_table(
+                    Constants.ORG_TABLE_NAME,
+                    None,
+                    Constants.PARTITION_KEY,
+                    self.__image_reading_pk(route_id),
+                )
+                if identifier[Constants.IMAGE_KEY] in wanted
+            ]
+        else:
+            found = [
+                identifier
+                for image_identifiers in self.fan_out.map(
+                    lambda image_key: self.__paginate_table(
+                        Constants.ORG_TABLE_NAME,
+                        None,
+                        Constants.PARTITION_KEY,
+                        self.__image_reading_pk(route_id),
+                        sort_key_prefix=self.__image_reading_sk_prefix(image_key),
+                    ),
+                    keys
+                )
+                for identifier in image_identifiers
+            ]
+
+        identifiers = {identifier[Constants.READING_ID]: identifier for identifier in found}
+        readings = self.__batch_get_readings(list(identifiers.values()))
+
+        return sorted(readings, key=lambda r: r[Constants.READING_ID])
+
+    def index_images(self, chunk_size: int = 1000) -> int:
+        '''Writes image index items for every reading in the reading 
+        table. Only needs to be run for readings saved before the 
+        image index existed.
+        '''
+
+        indexed = 0
+        chunk = []
+
+        for item in self.__iterate_table(Constants.READING_TABLE_NAME):
+            chunk.append(item)
+
+            if len(chunk) >= chunk_size:
+                self.__put_image_index_items(chunk)
+                indexed += len(chunk)
+                chunk = []
+                print(f'indexed images for {indexed} readings')
+        
+        self.__put_image_index_items(chunk)
+        indexed += len(chunk)
+
+        return indexed
+
+    def __batch_get_readings(self, identifiers: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        keys = [{
+            Constants.PARTITION_KEY: geohash_partition_key(
+                identifier[Constants.GEOHASH], 
+                identifier[Constants.READING_TYPE]
+            ),
+            Constants.SORT_KEY: identifier[Constants.READING_ID],
+        } for identifier in identifiers]
+
+        readings = self.batch_get(Constants.READING_TABLE_NAME, keys)
+        for item in readings:
+            Reading.decode(item)
+
+        return readings
+
+    def __put_image_index_items(self, items: List[Dict[str, Any]]) -> None:
+        self.batch_write(Constants.ORG_TABLE_NAME, puts=[
+            {
+                Constants.PARTITION_KEY: self.__image_reading_pk(item[Constants.ROUTE_ID]),
+                Constants.SORT_KEY: self.__image_reading_sk_prefix(image_key) + item[Constants.READING_ID],
+                Constants.IMAGE_KEY: image_key,
+                Constants.READING_ID: item[Constants.READING_ID],
+                Constants.GEOHASH: item[Constants.GEOHASH],
+                Constants.READING_TYPE: item[Constants.READING_TYPE],
+            }
+            for item in items
+            for image_key in image_keys(item)
+        ])
+
+    def __delete_image_index_items(self, readings: List[Dict[str, Any]]) -> None:
+        self.batch_write(Constants.ORG_TABLE_NAME, deletes=[
+            {
+                Constants.PARTITION_KEY: self.__image_reading_pk(reading[Constants.ROUTE_ID]),
+                Constants.SORT_KEY: self.__image_reading_sk_prefix(image_key) + reading[Constants.READING_ID],
+            }
+            for reading in readings
+            for image_key in image_keys(reading)
+        ])
+
+    def __image_reading_pk(self, route_id: str) -> str:
+        return f'{Constants.IMAGE_READING_PK}#{route_id}'
+
+    def __image_reading_sk_prefix(self, image_key: str) -> str:
+        return f'{image_key}#'
+
     # -----------------------------------------------------------------
     # -----------------------------------------------------------------
     # -----------------------------------------------------------------
@@ -296,22 +712,21 @@ class DB():
         name:str=None
     ) -> str:
         if readings is not None:
-            existing_readings = self.layer_readings([layer_id])
+            current_reading_ids = set([r[Constants.READING_ID] for r in readings])
             existing_reading_ids = set()
-            current_reading_ids = set()
+            removed = []
 
-            for reading in readings:
-                current_reading_ids.add(reading[Constants.READING_ID])
-
-            for reading in existing_readings:
-                reading_id = reading[Constants.READING_ID]
+            for identifier in self.__layer_reading_identifiers(layer_id):
+                reading_id = identifier[Constants.READING_ID]
                 existing_reading_ids.add(reading_id)
                 if reading_id not in current_reading_ids:
-                    self.remove_reading_from_layer(layer_id, reading)
+                    removed.append(identifier)
 
-            for reading in readings:
-                if reading[Constants.READING_ID] not in existing_reading_ids:
-                    self.add_reading_to_layer(layer_id, reading)
+            self.update_layer_readings(
+                layer_id,
+                add=[r for r in readings if r[Constants.READING_ID] not in existing_reading_ids],
+                remove=removed,
+            )
 
         item = {
             Constants.PARTITION_KEY: Constants.LAYER_PK,
@@ -325,28 +740,113 @@ class DB():
 
         return layer_id
 
-    def remove_readings_from_layer(self, layer_id: str, readings: List[Dict[str, Any]]):
-        for reading in readings:        
-            self.remove_reading_from_layer(layer_id, reading)
+    def update_layer_readings(
+        self, 
+        layer_id: str, 
+        add: Iterable[Dict[str, Any]] = (), 
+        remove: Iterable[Dict[str, Any]] = (),
+        update_aggregates: bool = True,
+    ) -> int:
+        '''Adds and removes many readings from a layer using batched,
+        concurrent writes. A reading that is both added and removed
+        ends up removed. The layer's geohash index is kept up to date
+        in the same writes, and then the layer's segments and tiles in
+        the geohashes involved, unless update_aggregates is False (see 
+        update_layer_aggregates). Every change to a layer's readings 
+        goes through here. Returns the number of memberships written.
+        '''
+
+        add = list(add)
+        remove = list(remove)
+
+        self.batch_write(
+            Constants.ORG_TABLE_NAME,
+            puts=[self.__layer_reading_item(layer_id, r) for r in add] + 
+                [self.__layer_geohash_item(layer_id, r) for r in add],
+            deletes=[self.__layer_reading_key(layer_id, r) for r in remove] + 
+                [self.__layer_geohash_key(layer_id, r) for r in remove],
+        )
+
+        if update_aggregates:
+            self.update_layer_aggregates(layer_id, [r[Constants.GEOHASH] for r in add + remove])
+
+        return len(set([r[Constants.READING_ID] for r in add + remove]))
+
+    def remove_readings_from_layer(self, layer_id: str, readings: List[Dict[str, Any]]) -> int:
+        return self.update_layer_readings(layer_id, remove=readings)
+
+    def remove_readings_from_layers(
+        self, 
+        layer_ids: Iterable[str],
+        readings: List[Dict[str, Any]], 
+    ) -> int:
+        '''Removes the given readings from whichever of the given layers
+        they belong to, e.g. before the readings themselves are deleted.
+        Only the geohash index partitions of the readings' geohashes are
+        queried for each layer. Returns the number of memberships 
+        removed.
+        '''
+
+        reading_ids = set([r[Constants.READING_ID] for r in readings])
+        geohashes = set([r[Constants.GEOHASH] for r in readings])
+        if len(reading_ids) == 0:
+            return 0
+
+        removed = 0
+        for layer_id in sorted(layer_ids):
+            members = [
+                identifier 
+                for identifier in self.identifiers_for_layer_geohashes([layer_id], geohashes)
+                if identifier[Constants.READING_ID] in reading_ids
+            ]
+
+            if len(members) > 0:
+                removed += self.remove_readings_from_layer(layer_id, members)
+
+        return removed
 
     def remove_reading_from_layer(self, layer_id: str, reading: Dict[str, Any]):
-        self.org_table.delete_item(Key={
-            Constants.PARTITION_KEY: self.__layer_reading_primary_key(layer_id),
-            Constants.SORT_KEY: reading[Constants.READING_ID]
-        })
+        self.update_layer_readings(layer_id, remove=[reading])
 
-    def add_readings_to_layer(self, layer_id:str, readings: List[Dict[str, Any]]) -> None:
-        for reading in readings:
-            self.add_reading_to_layer(layer_id, reading)
+    def add_readings_to_layer(
+        self, 
+        layer_id:str, 
+        readings: List[Dict[str, Any]], 
+        update_aggregates: bool = True
+    ) -> int:
+        return self.update_layer_readings(layer_id, add=readings, update_aggregates=update_aggregates)
 
     def add_reading_to_layer(self, layer_id: str, reading: Dict[str, Any]):
-        self.org_table.put_item(Item={
+        self.update_layer_readings(layer_id, add=[reading])
+
+    def __layer_reading_item(self, layer_id: str, reading: Dict[str, Any]) -> Dict[str, Any]:
+        return {
             Constants.PARTITION_KEY: self.__layer_reading_primary_key(layer_id),
             Constants.SORT_KEY: reading[Constants.READING_ID],
             Constants.READING_ID: reading[Constants.READING_ID],
             Constants.GEOHASH: reading[Constants.GEOHASH],
             Constants.READING_TYPE: reading[Constants.READING_TYPE],
-        })
+        }
+
+    def __layer_reading_key(self, layer_id: str, reading: Dict[str, Any]) -> Dict[str, str]:
+        return {
+            Constants.PARTITION_KEY: self.__layer_reading_primary_key(layer_id),
+            Constants.SORT_KEY: reading[Constants.READING_ID]
+        }
+
+    def __layer_geohash_item(self, layer_id: str, reading: Dict[str, Any]) -> Dict[str, Any]:
+        item = self.__layer_reading_item(layer_id, reading)
+        item[Constants.PARTITION_KEY] = self.__layer_geohash_pk(layer_id, reading[Constants.GEOHASH])
+        return item
+
+    def __layer_geohash_key(self, layer_id: str, reading: Dict[str, Any]) -> Dict[str, str]:
+        return {
+            Constants.PARTITION_KEY: self.__layer_geohash_pk(layer_id, reading[Constants.GEOHASH]),
+            Constants.SORT_KEY: reading[Constants.READING_ID]
+        }
+
+    def __layer_geohash_pk(self, layer_id: str, geohash: str) -> str:
+        return f'{Constants.LAYER_GEOHASH_PK}#{layer_id}#{geohash}'
 
     def layer_ids_for_user(self, user_id: str):
         layer_ids = []
@@ -357,40 +857,53 @@ class DB():
 
         return layer_ids
     
-    def layers_for_user(self, user_id:str) -> List[Dict[str, Any]]:
-        layers = []
-
-        group_ids = self.groups_for_user(user_id)
-        for id in group_ids:
-            layer_ids = self.layer_ids_for_group(id)
-
-            for layer_id in layer_ids:
-                layers.append(self.get_layer(layer_id))        
+    def layers_for_user(self, user_id:str, access = None) -> List[Dict[str, Any]]:
+        if access is not None:
+            layer_ids = access.layer_ids
+        else:
+            layer_ids = self.layer_ids_for_user(user_id)
 
-        return layers
+        return [self.get_layer(layer_id) for layer_id in layer_ids]
 
     def readings_for_layer_id(self, layer_id:str) -> List[Dict[str, Any]]:
         return self.layer_readings([layer_id])
 
     def layer_readings(self, layer_ids: str) -> List[Dict[str, Any]]:
-        readings = []
-
-        geohashes = set() 
-        reading_ids = set()
+        geohash_reading_ids = defaultdict(set)
 
         for layer_id in layer_ids:
-            identifiers = self.__layer_reading_identifiers(layer_id)            
-
-            for identifier in identifiers:
-                geohashes.add(identifier[Constants.GEOHASH])
-                reading_ids.add(identifier[Constants.SORT_KEY])
-
-        for geohash in geohashes:
-            geohash_readings = self.geohash_readings(geohash, Constants.PREDICTION)
-            for geohash_reading in geohash_readings:
-                if geohash_reading[Constants.READING_ID] in reading_ids:
-                    readings.append(geohash_reading)
-                    
+            for identifier in self.__layer_reading_identifiers(layer_id):
+                geohash_reading_ids[identifier[Constants.GEOHASH]].add(identifier[Constants.SORT_KEY])
+
+        return self.readings_by_geohash(geohash_reading_ids)
+
+    def readings_by_geohash(self, geohash_reading_ids: Dict[str, Set[str]]) -> List[Dict[str, Any]]:
+        '''Loads the PredictionReadings with the given ids from each
+        geohash, stopping as soon as every id in a geohash has been found.
+        Geohashes are read concurrently.
+        '''
+
+        def geohash_readings(geohash: str) -> List[Dict[str, Any]]:
+            remaining = set(geohash_reading_ids[geohash])
+            found = []
+
+            if len(remaining) == 0:
+                return found
+
+            for geohash_reading in self.iter_geohash_readings(geohash, Constants.PREDICTION):
+                if geohash_reading[Constants.READING_ID] in remaining:
+                    found.append(geohash_reading)
+                    remaining.remove(geohash_reading[Constants.READING_ID])
+
+                    if len(remaining) == 0:
+                        break
+
+            return found
+
+        readings = []
+        for found in self.fan_out.map(geohash_readings, list(geohash_reading_ids.keys())):
+            readings.extend(found)
+
         return readings
 
     def identifiers_for_layers(self, layer_ids: List[str]):
@@ -401,14 +914,78 @@ class DB():
 
         return all_identifiers
 
-    def __layer_reading_identifiers(self, layer_id: str) -> Dict[str, Any]:
-        resp = self.org_table.query(
-            KeyConditionExpression=
-                Key(Constants.PARTITION_KEY).eq(self.__layer_reading_primary_key(layer_id))
+    def identifiers_for_layer_geohashes(
+        self, 
+        layer_ids: Iterable[str], 
+        geohashes: Iterable[str]
+    ) -> List[Dict[str, Any]]:
+        '''Returns the membership identifiers of every reading in the 
+        given geohashes that belongs to any of the given layers. 
+        
+        One query is made per (layer, geohash) index partition, so the 
+        cost is #layers * #geohashes queries. Past 
+        MAX_LAYER_GEOHASH_PARTITIONS partitions each layer's whole
+        membership partition is read instead, one paginated query per 
+        layer, and filtered down to the given geohashes.
+        '''
+
+        layer_ids = set(layer_ids)
+        geohashes = set(geohashes)
+
+        identifiers = []
+        if len(layer_ids) * len(geohashes) > self.MAX_LAYER_GEOHASH_PARTITIONS:
+            for layer_identifiers in self.fan_out.map(self.__layer_reading_identifiers, sorted(layer_ids)):
+                identifiers.extend([i for i in layer_identifiers if i[Constants.GEOHASH] in geohashes])
+
+            return identifiers
+
+        partitions = sorted([
+            self.__layer_geohash_pk(layer_id, geohash)
+            for layer_id in layer_ids
+            for geohash in geohashes
+        ])
+
+        for partition in self.fan_out.map(
+            lambda pk: self.__paginate_table(Constants.ORG_TABLE_NAME, None, Constants.PARTITION_KEY, pk),
+            partitions
+        ):
+            identifiers.extend(partition)
+
+        return identifiers
+
+    def index_layer_geohashes(self, chunk_size: int = 1000) -> int:
+        '''Writes the (layer, geohash) index items for every existing
+        layer membership. Only needed once, for memberships that were 
+        written before the index existed. Returns the number of 
+        memberships indexed.
+        '''
+
+        prefix = self.__layer_reading_primary_key('')
+        indexed = 0
+        chunk = []
+
+        for item in self.__iterate_table(Constants.ORG_TABLE_NAME):
+            if not item[Constants.PARTITION_KEY].startswith(prefix):
+                continue
+
+            layer_id = item[Constants.PARTITION_KEY][len(prefix):]
+            chunk.append(self.__layer_geohash_item(layer_id, item))
+            if len(chunk) >= chunk_size:
+                indexed += self.batch_write(Constants.ORG_TABLE_NAME, puts=chunk)
+                chunk = []
+
+        indexed += self.batch_write(Constants.ORG_TABLE_NAME, puts=chunk)
+
+        return indexed
+
+    def __layer_reading_identifiers(self, layer_id: str) -> List[Dict[str, Any]]:
+        return self.__paginate_table(
+            Constants.ORG_TABLE_NAME,
+            None,
+            Constants.PARTITION_KEY,
+            self.__layer_reading_primary_key(layer_id),
         )
 
-        return resp[self.ITEM_KEY] 
-
     def get_layer(self, layer_id: str) -> Dict[str, Any]:
         response = self.org_table.query(
             KeyConditionExpression=
@@ -432,6 +1009,334 @@ class DB():
     # -----------------------------------------------------------------
     # -----------------------------------------------------------------
     # -----------------------------------------------------------------
+    # --------------------------- SEGMENTS ----------------------------
+    # -----------------------------------------------------------------
+    # -----------------------------------------------------------------
+    # -----------------------------------------------------------------
+
+    def update_layer_aggregates(self, layer_id: str, geohashes: Iterable[str]) -> int:
+        '''Recomputes a layer's segments and tiles in the given geohashes
+        from a single read of the layer's readings there. Callers that 
+        change a layer's readings in batches with update_aggregates off
+        call this once at the end. Returns the number of segments and 
+        tiles written.
+        '''
+
+        geohashes = sorted(set(geohashes))
+        if len(geohashes) == 0:
+            return 0
+
+        geohash_readings = self.__layer_geohash_readings(layer_id, geohashes)
+
+        return self.__write_segments(layer_id, geohashes, geohash_readings) + \
+            self.__write_tile_pyramid(layer_id, geohashes, geohash_readings)
+
+    def update_segments(self, layer_id: str, geohashes: Iterable[str]) -> int:
+        '''Recomputes the segments of a layer in each of the given 
+        geohashes from the layer's current readings there. Segments
+        left without any readings are deleted. Returns the number of
+        segments written.
+        '''
+
+        geohashes = sorted(set(geohashes))
+        if len(geohashes) == 0:
+            return 0
+
+        return self.__write_segments(layer_id, geohashes, self.__layer_geohash_readings(layer_id, geohashes))
+
+    def __write_segments(
+        self, 
+        layer_id: str, 
+        geohashes: List[str], 
+        geohash_readings: Dict[str, List[Dict[str, Any]]]
+    ) -> int:
+        existing = self.fan_out.map(
+            lambda geohash: self.__paginate_table(
+                Constants.ORG_TABLE_NAME,
+                None,
+                Constants.PARTITION_KEY,
+                segment_partition_key(layer_id, geohash),
+            ),
+            geohashes
+        )
+
+        puts = []
+        deletes = []
+        for geohash, existing_items in zip(geohashes, existing):
+            segments = Segment.from_readings(geohash_readings[geohash])
+            puts.extend([s.item_data(layer_id) for s in segments])
+
+            segment_ids = set([s.id for s in segments])
+            deletes.extend([
+                {
+                    Constants.PARTITION_KEY: item[Constants.PARTITION_KEY],
+                    Constants.SORT_KEY: item[Constants.SORT_KEY],
+                }
+                for item in existing_items if item[Constants.SORT_KEY] not in segment_ids
+            ])
+
+        self.batch_write(Constants.ORG_TABLE_NAME, puts=puts, deletes=deletes)
+
+        return len(puts)
+
+    def __layer_geohash_readings(self, layer_id: str, geohashes: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        geohash_reading_ids = {geohash: set() for geohash in geohashes}
+        for identifier in self.identifiers_for_layer_geohashes([layer_id], geohashes):
+            geohash_reading_ids[identifier[Constants.GEOHASH]].add(identifier[Constants.READING_ID])
+
+        geohash_readings = defaultdict(list)
+        for reading in self.readings_by_geohash(geohash_reading_ids):
+            geohash_readings[reading[Constants.GEOHASH]].append(reading)
+
+        return geohash_readings
+
+    def segments_for_layer_geohashes(
+        self, 
+        layer_ids: Iterable[str], 
+        geohashes: Iterable[str]
+    ) -> List[Segment]:
+        '''Returns the stored segments of the given layers in the given
+        geohashes. A segment that crosses several geohashes or appears 
+        in several layers is returned once per (layer, geohash).
+        '''
+
+        partitions = sorted(set([
+            segment_partition_key(layer_id, geohash)
+            for layer_id in set(layer_ids)
+            for geohash in set(geohashes)
+        ]))
+
+        segments = []
+        for partition in self.fan_out.map(
+            lambda pk: self.__paginate_table(Constants.ORG_TABLE_NAME, None, Constants.PARTITION_KEY, pk),
+            partitions
+        ):
+            segments.extend([Segment.from_item(item) for item in partition])
+
+        return segments
+
+    def index_segments(self) -> int:
+        '''Computes the segments of every existing layer. Only needed 
+        once, for readings that were saved before segments existed.
+        Returns the number of segments written.
+        '''
+
+        written = 0
+        for layer in self.__paginate_table(Constants.ORG_TABLE_NAME, None, Constants.PARTITION_KEY, Constants.LAYER_PK):
+            layer_id = self.__layer_id_from_layer_data(layer)
+            geohashes = set([
+                identifier[Constants.GEOHASH] 
+                for identifier in self.__layer_reading_identifiers(layer_id)
+            ])
+            written += self.update_segments(layer_id, geohashes)
+
+        return written
+
+    # -----------------------------------------------------------------
+    # -----------------------------------------------------------------
+    # -----------------------------------------------------------------
+    # ---------------------------- TILES ------------------------------
+    # -----------------------------------------------------------------
+    # -----------------------------------------------------------------
+    # -----------------------------------------------------------------
+
+    def update_tiles(self, layer_id: str, geohashes: Iterable[str]) -> int:
+        '''Recomputes every tile in a layer's pyramid that contains one of
+        the given geohashes (of GEOHASH_PRECISION). The finest tiles are 
+        rebuilt from the layer's current readings in their geohash and 
+        each coarser tile from the tiles inside it. Tiles left without
+        any readings are deleted. Returns the number of tiles written.
+        '''
+
+        level = sorted(set(geohashes))
+        if len(level) == 0:
+            return 0
+
+        return self.__write_tile_pyramid(layer_id, level, self.__layer_geohash_readings(layer_id, level))
+
+    def __write_tile_pyramid(
+        self, 
+        layer_id: str, 
+        level: List[str], 
+        geohash_readings: Dict[str, List[Dict[str, Any]]]
+    ) -> int:
+        computed = {geohash: self.__readings_tile(geohash, geohash_readings[geohash]) for geohash in level}
+        written = self.__write_tiles(layer_id, computed)
+
+        for precision in range(TILE_MAX_PRECISION - 1, TILE_MIN_PRECISION - 1, -1):
+            parents = sorted(set([geohash[:precision] for geohash in computed]))
+            stored_children = self.fan_out.map(
+                lambda parent: self.__paginate_table(
+                    Constants.ORG_TABLE_NAME,
+                    None,
+                    Constants.PARTITION_KEY,
+                    tile_children_partition_key(layer_id, parent),
+                ),
+                parents
+            )
+
+            # Children computed in the previous step are used as they are
+            # rather than read back, since they might not be visible yet.
+            computed_children = defaultdict(list)
+            for geohash, tile in computed.items():
+                if tile is not None:
+                    computed_children[geohash[:precision]].append(tile)
+
+            next_computed = {}
+            for parent, items in zip(parents, stored_children):
+                tile = Tile(parent, layer_id)
+                for item in items:
+                    if item[Constants.GEOHASH] not in computed:
+                        tile.merge(Tile.from_item(item))
+                for child in computed_children[parent]:
+                    tile.merge(child)
+
+                next_computed[parent] = tile if tile.reading_count > 0 else None
+
+            written += self.__write_tiles(layer_id, next_computed)
+            computed = next_computed
+
+        return written
+
+    def tiles_for_layer_geohashes(
+        self, 
+        layer_ids: Iterable[str], 
+        geohashes: Iterable[str]
+    ) -> List[Tile]:
+        '''Returns the stored tiles of the given layers for the given 
+        geohashes, which may be of any precision in the pyramid. A tile
+        is returned once per layer that has readings inside it.
+        '''
+
+        wanted = defaultdict(set)
+        for layer_id in set(layer_ids):
+            for geohash in geohashes:
+                wanted[tile_partition_key(layer_id, geohash)].add(geohash)
+
+        partitions = sorted(wanted)
+        tiles = []
+        for pk, items in zip(partitions, self.fan_out.map(
+            lambda pk: self.__paginate_table(Constants.ORG_TABLE_NAME, None, Constants.PARTITION_KEY, pk),
+            partitions
+        )):
+            tiles.extend([Tile.from_item(item) for item in items if item[Constants.GEOHASH] in wanted[pk]])
+
+        return tiles
+
+    def index_tiles(self) -> int:
+        '''Builds the tile pyramid of every existing layer. Only needed 
+        once, for readings that were saved before tiles existed. Returns
+        the number of tiles written.
+        '''
+
+        written = 0
+        for layer in self.__paginate_table(Constants.ORG_TABLE_NAME, None, Constants.PARTITION_KEY, Constants.LAYER_PK):
+            layer_id = self.__layer_id_from_layer_data(layer)
+            geohashes = set([
+                identifier[Constants.GEOHASH] 
+                for identifier in self.__layer_reading_identifiers(layer_id)
+            ])
+            written += self.update_tiles(layer_id, geohashes)
+
+        return written
+
+    def __readings_tile(self, geohash: str, readings: List[Dict[str, Any]]) -> Tile:
+        tile = Tile(geohash)
+        for reading in preferred_readings(readings):
+            tile.add(reading)
+
+        return tile if tile.reading_count > 0 else None
+
+    def __write_tiles(self, layer_id: str, tiles: Dict[str, Tile]) -> int:
+        puts = [tile.item_data(layer_id) for tile in tiles.values() if tile is not None]
+        deletes = [
+            {
+                Constants.PARTITION_KEY: tile_partition_key(layer_id, geohash),
+                Constants.SORT_KEY: geohash,
+            }
+            for geohash, tile in tiles.items() if tile is None
+        ]
+        self.batch_write(Constants.ORG_TABLE_NAME, puts=puts, deletes=deletes)
+
+        return len(puts)
+
+    # -----------------------------------------------------------------
+    # -----------------------------------------------------------------
+    # -----------------------------------------------------------------
+    # ------------------------- CHECKPOINTS ---------------------------
+    # -----------------------------------------------------------------
+    # -----------------------------------------------------------------
+    # -----------------------------------------------------------------
+
+    def get_checkpoint(self, route_id: str) -> Checkpoint:
+        '''Loads the ingestion checkpoints of a route. Routes with no
+        checkpoints get an empty Checkpoint.
+        '''
+
+        return Checkpoint.from_items(route_id, self.__checkpoint_items(route_id))
+
+    def add_checkpoints(self, checkpoint: Checkpoint, stage: str, keys: Iterable[str]) -> int:
+        '''Records that stage has been completed for each of keys, both
+        in DynamoDB and in checkpoint. Returns the number of new 
+        checkpoints written.
+        '''
+
+        keys = checkpoint.remaining(stage, set(keys))
+        self.batch_write(
+            Constants.ORG_TABLE_NAME, 
+            puts=[checkpoint.item_data(stage, k) for k in keys]
+        )
+        checkpoint.mark(stage, keys)
+
+        return len(keys)
+
+    def delete_checkpoint(self, route_id: str) -> int:
+        keys = [
+            {
+                Constants.PARTITION_KEY: item[Constants.PARTITION_KEY],
+                Constants.SORT_KEY: item[Constants.SORT_KEY],
+            }
+            for item in self.__checkpoint_items(route_id)
+        ]
+        self.batch_write(Constants.ORG_TABLE_NAME, deletes=keys)
+
+        return len(keys)
+
+    def __checkpoint_items(self, route_id: str) -> List[Dict[str, Any]]:
+        return self.__paginate_table(
+            Constants.ORG_TABLE_NAME, 
+            None, 
+            Constants.PARTITION_KEY, 
+            checkpoint_partition_key(route_id)
+        )
+
+    # -----------------------------------------------------------------
+    # -----------------------------------------------------------------
+    # -----------------------------------------------------------------
+    # ------------------------- SNAP CACHE ----------------------------
+    # -----------------------------------------------------------------
+    # -----------------------------------------------------------------
+    # -----------------------------------------------------------------
+
+    def get_snap_cache_items(self, keys: Iterable[str]) -> List[Dict[str, Any]]:
+        '''Returns the stored SnapCache entries for keys. Keys that have 
+        no entry are left out. Expired entries may still be returned 
+        until DynamoDB's TTL gets around to deleting them.
+        '''
+
+        keys = [{
+            Constants.PARTITION_KEY: snap_cache_partition_key(key),
+            Constants.SORT_KEY: key,
+        } for key in keys]
+
+        return self.batch_get(Constants.ORG_TABLE_NAME, keys)
+
+    def put_snap_cache_items(self, items: List[Dict[str, Any]]) -> int:
+        return self.batch_write(Constants.ORG_TABLE_NAME, puts=items)
+
+    # -----------------------------------------------------------------
+    # -----------------------------------------------------------------
+    # -----------------------------------------------------------------
     # ---------------------------- GROUPS -----------------------------
     # -----------------------------------------------------------------
     # -----------------------------------------------------------------
@@ -466,24 +1371,28 @@ class DB():
             Constants.PARTITION_KEY: self.__user_group_pk(user_id),
             Constants.SORT_KEY: self.__group_key(group_id),
         })
+        self.access_cache.invalidate_user(user_id)
 
     def user_remove_group(self, user_id: str, group_id: str) -> None:
         self.org_table.delete_item(Key={
             Constants.PARTITION_KEY: self.__user_group_pk(user_id),
             Constants.SORT_KEY: self.__group_key(group_id)
         })
+        self.access_cache.invalidate_user(user_id)
 
     def group_add_layer(self, group_id: str, layer_id: str) -> None:
         self.org_table.put_item(Item={
             Constants.PARTITION_KEY: self.__group_key(group_id),
             Constants.SORT_KEY: self.__layer_group_pk(layer_id),
         })
+        self.access_cache.invalidate_group(group_id)
 
     def group_remove_layer(self, group_id: str, layer_id: str) -> None:
         self.org_table.delete_item(Key={
             Constants.PARTITION_KEY: self.__group_key(group_id),
             Constants.SORT_KEY: self.__layer_group_pk(layer_id),
         })
+        self.access_cache.invalidate_group(group_id)
 
 
     def groups_for_user(self, user_id: str) -> List[str]:
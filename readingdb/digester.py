@@ -1,15 +1,19 @@
 from readingdb.rutils import RUtils
+from readingdb.checkpoint import Checkpoint, ingest_route_id
 from readingdb.geolocator import Geolocator
 from typing import List
 from readingdb.mlapi import MLAPI
 from readingdb.endpoints import SQS_URL
 from readingdb.route import Route
 import boto3
+import hashlib
 import zipfile
 from io import BytesIO
 
-from readingdb.readingspec import ReadingSpec
-from readingdb.routespec import RouteSpec
+from readingdb.pipeline import Pipeline
+from readingdb.s3zip import S3Zip
+from readingdb.snapcache import SnapCache
+from readingdb.uploadpool import UploadPool
 from readingdb.constants import *
 from readingdb.format import *
 from readingdb.api import API
@@ -17,15 +21,42 @@ from readingdb.api import API
 class Digester():
     IMG_EXT = 'jpg'
     TXT_EXT = 'txt'
+    GPS_FILENAME = 'GPS.txt'
     OBJ_BODY_KEY = 'Body'
+    ZIP_BUFFER_SIZE = 1024 * 1024
+    PIPELINE_QUEUE_SIZE = 256
+    INTERPOLATE_BATCH_SIZE = 50
+    SAVE_BATCH_SIZE = 100
+    CHECKPOINT_BATCH_SIZE = 25
+    # Predictions interpolated across a longer GPS dropout are flagged.
+    MAX_GPS_GAP_MILLIS = 10000
+
+    def __init__(
+        self, 
+        url:str, 
+        sqs_url: str=SQS_URL, 
+        api=None, 
+        *args, 
+        upload_workers: int = 16,
+        upload_attempts: int = 5,
+        snap_cache: bool = True,
+        **kwargs
+    ) -> None:
+        '''With snap_cache set, roads are snapped through a SnapCache 
+        kept in the org table, which only pays for each stretch of road 
+        once but can place a point where another point in the same ~11m 
+        cell heading the same way was snapped, rather than exactly where
+        the Roads API would snap it now.
+        '''
 
-    def __init__(self, url:str, sqs_url: str=SQS_URL, api=None, *args, **kwargs) -> None:
         self.s3_resource = boto3.resource('s3')
         if api is None:
             self.api: API = API(url, *args, **kwargs)
         else:
             self.api = api
         self.mlapi = MLAPI(sqs_url)
+        self.uploader = UploadPool(max_workers=upload_workers, attempts=upload_attempts)
+        self.snap_cache = snap_cache
 
     def process(
         self, 
@@ -33,20 +64,41 @@ class Digester():
         key: str, 
         group_id: str,
         name: str = None,
-        snap_to_roads=False
+        snap_to_roads=False,
+        stream=False,
     ) -> Route: 
+        '''Saves the route in a zip archive uploaded to S3. With stream
+        set the archive is read in place with ranged GETs instead of
+        being downloaded into memory first, and each upload thread reads
+        members through its own reader.
+        '''
+
         zip_obj = self.s3_resource.Object(bucket_name=bucket, key=key)
         print('metadata', zip_obj.metadata)
         user_id = zip_obj.metadata[Constants.USER_ID.lower()]
-        buffer = BytesIO(zip_obj.get()[self.OBJ_BODY_KEY].read())
-        z = zipfile.ZipFile(buffer)
 
-        def upload(filename, bucket, s3_filename):
-            self.s3_resource.meta.client.upload_fileobj(
-                z.open(filename),
-                Bucket=bucket,
-                Key=s3_filename
+        if stream:
+            z = S3Zip(
+                self.s3_resource.meta.client, 
+                bucket, 
+                key, 
+                zip_obj.content_length, 
+                self.ZIP_BUFFER_SIZE
             )
+        else:
+            buffer = BytesIO(zip_obj.get()[self.OBJ_BODY_KEY].read())
+            z = zipfile.ZipFile(buffer)
+
+        # Several upload threads open members at once. A ZipFile serializes
+        # their reads, which is cheap for the in-memory archive, while an
+        # S3Zip gives every thread its own reader.
+        def upload(filename, bucket, s3_filename):
+            with z.open(filename) as f:
+                self.s3_resource.meta.client.upload_fileobj(
+                    f,
+                    Bucket=bucket,
+                    Key=s3_filename
+                )
 
         def read_gps_file(filename):
             with z.open(filename) as f:
@@ -63,8 +115,10 @@ class Digester():
             bucket, 
             z.namelist(), 
             name,
-            snap_to_roads=snap_to_roads
+            snap_to_roads=snap_to_roads,
+            version=zip_obj.e_tag
         )
+        z.close()
         self.s3_resource.Object(bucket, key).delete()
         self.mlapi.add_message_to_queue(user_id, route.id)
 
@@ -83,7 +137,12 @@ class Digester():
             pass
 
         s3_bucket = self.s3_resource.Bucket(bucket)
-        bucket_objects = [o.key for o in s3_bucket.objects.filter(Prefix=key)]
+        bucket_objects = list(s3_bucket.objects.filter(Prefix=key))
+
+        # The upload is versioned by its GPS file, since every upload 
+        # has exactly one.
+        gps_objects = [o for o in bucket_objects if self.__is_gps_file(o.key)]
+        version = gps_objects[0].e_tag if len(gps_objects) > 0 else None
 
         def read_gps_file(filename):
             obj = s3_bucket.Object(filename)
@@ -98,9 +157,10 @@ class Digester():
             group_id,
             key, 
             bucket, 
-            bucket_objects,
+            [o.key for o in bucket_objects],
             name,
             snap_to_roads,
+            version=version,
         )
 
     def process_local(
@@ -128,6 +188,15 @@ class Digester():
 
             return lines
 
+        # Local files are versioned by the md5 of their GPS file, which 
+        # is what S3 would use as its ETag.
+        version = None
+        for filename in filenames:
+            if self.__is_gps_file(filename):
+                with open(filename, 'rb') as f:
+                    version = hashlib.md5(f.read()).hexdigest()
+                break
+
         return self.__process_names(
             upload, 
             read_gps_file, 
@@ -138,6 +207,7 @@ class Digester():
             filenames, 
             name,
             snap_to_roads,
+            version=version,
         )
 
     def __process_names(
@@ -150,8 +220,15 @@ class Digester():
         bucket: str, 
         filenames: List[str], 
         name: str = None,
-        snap_to_roads=False
+        snap_to_roads=False,
+        version: str = None
     ):
+        '''Saves the images in filenames, and the GPS file among them, as
+        a new route. The route's id is derived from bucket, key and 
+        version, so processing the same upload again after a failure 
+        resumes from the checkpoints the failed run left behind.
+        '''
+
         points, img_readings, filename_map = self.get_readings(
             filenames,
             key,
@@ -159,33 +236,84 @@ class Digester():
             read_gps_file,
         )
 
-        g = Geolocator()
+        g = Geolocator(
+            max_gap_millis=self.MAX_GPS_GAP_MILLIS, 
+            snap_cache=SnapCache(self.api) if self.snap_cache else None
+        )
         if snap_to_roads:
-            pred_readings = g.generate_predictions(points, img_readings)
-        else:
-            pred_readings = g.interpolated(points, img_readings)
-        print('finished generating prediction readings')
+            img_readings = g.wanted_img_readings(points, img_readings)
+            points = g.geolocate(points)
+        lr = g.line_route(points)
+
+        route_id = ingest_route_id(bucket, key, version)
+        checkpoint = self.api.get_checkpoint(route_id)
+        layer_id = self.api.new_route_layer(route_id, checkpoint.layer_id)
+        print(f'ingesting route {route_id}, already uploaded {checkpoint.count(Checkpoint.UPLOADED)} images and written {checkpoint.count(Checkpoint.WRITTEN)} readings')
+
+        # ---- PIPELINE ----
+        # Images are interpolated, uploaded and written to the database
+        # in batches as they flow through the pipeline, so uploads to S3
+        # and writes to DynamoDB overlap instead of running one after 
+        # the other. Only the checkpoint and save stages touch DynamoDB, 
+        # each on a single thread, since boto3 Table resources are not 
+        # thread safe. Each step is checkpointed once it has completed,
+        # so a restarted ingestion skips work that is already done.
 
-        for r in pred_readings:
+        def interpolate(batch):
+            pred_readings = g.interpolated_on(lr, batch)
+            for r in pred_readings:
+                r[Constants.READING_ID] = checkpoint.reading_id(RUtils.get_uri(r)[Constants.KEY])
+
+            return pred_readings
+
+        def upload_image(r):
             uri = RUtils.get_uri(r)
-            print('uploading', uri)
-            upload(filename_map[uri[Constants.KEY]], uri[Constants.BUCKET], uri[Constants.KEY])
-
-        routeSpec = RouteSpec(
-            [ReadingSpec(
-                Constants.PREDICTION, 
-                ReadingSpec.S3_FILES_FORMAT,
-                pred_readings
-            )], 
+            if not checkpoint.is_done(Checkpoint.UPLOADED, uri[Constants.KEY]):
+                self.uploader.upload(upload, (filename_map[uri[Constants.KEY]], uri[Constants.BUCKET], uri[Constants.KEY]))
+            return r
+
+        def record_uploads(batch):
+            self.api.add_checkpoints(checkpoint, Checkpoint.UPLOADED, [RUtils.get_uri(r)[Constants.KEY] for r in batch])
+            return batch
+
+        def save(batch):
+            return self.api.save_route_readings(route_id, Constants.PREDICTION, batch, layer_id, checkpoint)
+
+        pipeline = Pipeline(queue_size=self.PIPELINE_QUEUE_SIZE)
+        pipeline.stage('interpolate', interpolate, batch_size=self.INTERPOLATE_BATCH_SIZE)
+        pipeline.stage('upload', upload_image, workers=self.uploader.max_workers)
+        pipeline.stage('checkpoint uploads', record_uploads, batch_size=self.CHECKPOINT_BATCH_SIZE)
+        pipeline.stage('save', save, batch_size=self.SAVE_BATCH_SIZE)
+
+        n_images = len([
+            r for r in img_readings 
+            if lr.contains(RUtils.get_ts(r)) and not checkpoint.is_done(Checkpoint.UPLOADED, RUtils.get_uri(r)[Constants.KEY])
+        ])
+        print(f'uploading and saving {n_images} images')
+        self.uploader.begin(n_images)
+
+        saved = pipeline.run(img_readings)
+        print('pipeline report:', pipeline.report())
+        print('upload report:', self.uploader.report())
+        print('snap report:', g.report())
+
+        saved.sort(key=lambda r: r.timestamp)
+        route = self.api.finish_route(
+            route_id, 
+            user_id, 
+            group_id, 
+            layer_id, 
+            {Constants.PREDICTION: saved}, 
             name
         )
-
-        print('saving readings to route database')
-        route = self.api.save_route(routeSpec, user_id, group_id)
         self.api.group_add_layer(group_id, route.layer_id)
+        self.api.delete_checkpoint(route_id)
 
         return route
 
+    def __is_gps_file(self, filename: str) -> bool:
+        return filename.split('/')[-1] == self.GPS_FILENAME
+
     def get_readings(
         self, 
         filenames: List[str],
@@ -206,7 +334,7 @@ class Digester():
 
             if extension == self.IMG_EXT:               
                 img_readings.append(entry_from_file(bucket, s3_filename))
-            elif file_portion == "GPS.txt":
+            elif file_portion == self.GPS_FILENAME:
                 points.extend(txt_to_points(read_gps_file(filename)))
                 print(points)
             else:
@@ -0,0 +1,78 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+class FanOut():
+    '''Runs the same query against many partitions at once using a bounded
+    pool of threads. boto3 clients (unlike resources) are thread safe, so
+    the query function passed in should only make use of a client.
+
+    Every call shares one pool of max_workers threads, so one instance 
+    can be shared by concurrent callers without running more than 
+    max_workers queries at once. A map called from inside one of the 
+    pool's threads (a nested map) runs in that thread, one partition at
+    a time, rather than waiting on the pool it is already part of.
+    '''
+
+    def __init__(self, max_workers: int = 16) -> None:
+        if max_workers < 1:
+            raise ValueError(f'max_workers must be at least 1, got {max_workers}')
+
+        self.max_workers = max_workers
+        self.__pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.__local = threading.local()
+
+    def map(self, fn: Callable[[Any], Any], partitions: Iterable[Any]) -> List[Any]:
+        '''Calls fn once for each partition and returns the results in the
+        same order as the partitions were given.
+        '''
+
+        return self.__run(fn, list(partitions))
+
+    def map_timed(self, fn: Callable[[str], Any], partitions: Iterable[str]) -> Tuple[List[Any], Dict[str, float]]:
+        '''Like map, but also returns the time taken (in seconds) by the 
+        call for each partition.
+        '''
+
+        partitions = list(partitions)
+        timings: Dict[str, float] = {}
+
+        if len(partitions) == 0:
+            return [], timings
+
+        def timed(partition: str) -> Any:
+            start = time.perf_counter()
+            result = fn(partition)
+            timings[partition] = time.perf_counter() - start
+            return result
+
+        return self.__run(timed, partitions), timings
+
+    def __run(self, fn: Callable[[Any], Any], partitions: List[Any]) -> List[Any]:
+        if len(partitions) <= 1 or getattr(self.__local, 'in_pool', False):
+            return [fn(p) for p in partitions]
+
+        def in_pool(partition: Any) -> Any:
+            self.__local.in_pool = True
+            return fn(partition)
+
+        return list(self.__pool.map(in_pool, partitions))
+
+    def report(self, timings: Dict[str, float]) -> Dict[str, Any]:
+        '''Summarizes the timings returned by one call to map_timed.'''
+
+        if len(timings) == 0:
+            return {}
+
+        durations = sorted(timings.values())
+        slowest = max(timings, key=timings.get)
+
+        return {
+            'partitions': len(durations),
+            'workers': min(self.max_workers, len(durations)),
+            'total': sum(durations),
+            'median': durations[len(durations) // 2],
+            'max': durations[-1],
+            'slowest': slowest,
+        }
@@ -0,0 +1,92 @@
+from typing import Any, Dict, Iterable, List
+
+from readingdb.clean import encode_as_float, decode_float
+from readingdb.constants import *
+from readingdb.reading import image_keys
+
+def preferred_readings(
+    readings: Iterable[Dict[str, Any]],
+    preference: List[str] = ANNOTATOR_PREFERENCE
+) -> List[Dict[str, Any]]:
+    '''Like the route readings API, keeps only one prediction for each
+    image: the one whose annotator comes first in the preference, with
+    the faux annotator last of all.
+    '''
+
+    def precedence(r: Dict[str, Any]) -> int:
+        annotator = r[Constants.ANNOTATOR_ID]
+        if annotator == FAUX_ANNOTATOR_ID:
+            return len(preference) + 1
+        if annotator not in preference:
+            return len(preference)
+        return preference.index(annotator)
+
+    preferred: Dict[str, Dict[str, Any]] = {}
+    for r in readings:
+        keys = image_keys(r)
+        image = keys[-1] if len(keys) > 0 else r[Constants.READING_ID]
+        if image not in preferred or precedence(r) < precedence(preferred[image]):
+            preferred[image] = r
+
+    return list(preferred.values())
+
+class FaultStats():
+    '''Fault statistics over a collection of decoded PredictionReadings:
+    how many readings there are, how many of them each entity is present
+    in, the severities of those entities and the highest confidence seen
+    for each entity. Stats can be merged, so aggregates over large areas
+    can be built from aggregates over small ones.
+    '''
+
+    def __init__(self) -> None:
+        self.reading_count: int = 0
+        self.entity_counts: Dict[str, int] = {}
+        self.severity_sums: Dict[str, float] = {}
+        self.max_confidences: Dict[str, float] = {}
+
+    def add(self, reading: Dict[str, Any]) -> None:
+        self.reading_count += 1
+
+        for e in reading[Constants.READING][Constants.ENTITIES]:
+            name = e[Constants.ENTITY_NAME]
+            confidence = float(e[Constants.CONFIDENCE])
+            self.max_confidences[name] = max(self.max_confidences.get(name, confidence), confidence)
+
+            if e[Constants.PRESENT]:
+                self.entity_counts[name] = self.entity_counts.get(name, 0) + 1
+                self.severity_sums[name] = self.severity_sums.get(name, 0.0) + float(e.get(Constants.SEVERITY, 1.0))
+
+    def merge(self, other: 'FaultStats') -> None:
+        self.reading_count += other.reading_count
+
+        for name, count in other.entity_counts.items():
+            self.entity_counts[name] = self.entity_counts.get(name, 0) + count
+        for name, severity in other.severity_sums.items():
+            self.severity_sums[name] = self.severity_sums.get(name, 0.0) + severity
+        for name, confidence in other.max_confidences.items():
+            self.max_confidences[name] = max(self.max_confidences.get(name, confidence), confidence)
+
+    def stats_item_data(self) -> Dict[str, Any]:
+        return {
+            Constants.READING_COUNT: self.reading_count,
+            Constants.ENTITY_COUNTS: dict(self.entity_counts),
+            Constants.SEVERITY_SUMS: {k: encode_as_float(v) for k, v in self.severity_sums.items()},
+            Constants.MAX_CONFIDENCES: {k: encode_as_float(v) for k, v in self.max_confidences.items()},
+        }
+
+    def load_stats_item(self, item: Dict[str, Any]) -> None:
+        self.reading_count = int(item[Constants.READING_COUNT])
+        self.entity_counts = {k: int(v) for k, v in item[Constants.ENTITY_COUNTS].items()}
+        self.severity_sums = {k: decode_float(v) for k, v in item[Constants.SEVERITY_SUMS].items()}
+        self.max_confidences = {k: decode_float(v) for k, v in item[Constants.MAX_CONFIDENCES].items()}
+
+    def stats_json(self) -> Dict[str, Any]:
+        return {
+            Constants.READING_COUNT: self.reading_count,
+            Constants.ENTITY_COUNTS: dict(self.entity_counts),
+            Constants.MEAN_SEVERITIES: {
+                name: self.severity_sums[name] / count
+                for name, count in self.entity_counts.items()
+            },
+            Constants.MAX_CONFIDENCES: dict(self.max_confidences),
+        }
@@ -1,25 +1,104 @@
+import bisect
+import threading
 import time
 import json
 import copy
+import operator
 
 import haversine as hs
+import numpy as np
 import readingdb.constants as C
 from haversine import Unit
-from readingdb.lineroute import LineRoute
+from readingdb.lineroute import LineRoute, linear_interp
 from readingdb.rutils import RUtils
 from readingdb.roadpoint import RoadPoint
 from readingdb.constants import Constants, FAUX_ANNOTATOR_ID 
 import googlemaps
-from typing import Any, Dict, List, Tuple
+from googlemaps.exceptions import ApiError, HTTPError, TransportError
+from googlemaps.exceptions import Timeout as GoogleMapsTimeout
+from operator import itemgetter
+from readingdb.fanout import FanOut
+from readingdb.ratelimiter import RateLimiter
+from readingdb.snapcache import SnapCache
+from typing import Any, Callable, Dict, List, Tuple
+
+# The mean earth radius used by haversine.haversine.
+EARTH_RADIUS_METERS = 6371008.8
+
+def haversine_meters(lat1, lng1, lat2, lng2) -> np.ndarray:
+    '''NumPy version of haversine.haversine in meters, using the same 
+    formula. Arguments are arrays (or scalars) of degrees.
+    '''
+
+    lat1 = np.radians(lat1)
+    lng1 = np.radians(lng1)
+    lat2 = np.radians(lat2)
+    lng2 = np.radians(lng2)
+    d = np.sin((lat2 - lat1) * 0.5) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) * 0.5) ** 2
+
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(d))
 
 class Geolocator():
-    def __init__(self, overlap: int = 15) -> None:
+    STATIONARY_METERS = 8
+    STATIONARY_MILLIS = 5000
+    STATIONARY_BUFFER = 10
+    STATIONARY_LOOKAHEAD = 2
+    MOTION_CHUNK_SIZE = 64
+    MAX_MOTION_CHUNK_SIZE = 4096
+
+    # Roads API statuses worth retrying, on top of timeouts, connection
+    # errors and 5xx/429 responses.
+    RETRYABLE_STATUSES = ['OVER_QUERY_LIMIT', 'RESOURCE_EXHAUSTED', 'UNKNOWN_ERROR']
+
+    def __init__(
+        self, 
+        overlap: int = 15, 
+        interp_alg=linear_interp, 
+        max_gap_millis: int = None,
+        snap_workers: int = 8,
+        snap_per_second: float = 20,
+        snap_attempts: int = 4,
+        snap_backoff: float = 0.5,
+        snap_max_backoff: float = 8.0,
+        sleep: Callable[[float], None] = time.sleep,
+        snap_cache: SnapCache = None,
+    ) -> None:
+        '''interp_alg is how image positions are interpolated between GPS
+        fixes (see lineroute.py and numpyinterp.py). If max_gap_millis is
+        given, predictions interpolated across a longer GPS dropout are 
+        flagged with GPS_GAP.
+
+        geolocate sends up to snap_workers snap_to_roads requests at 
+        once, starting no more than snap_per_second of them a second. 
+        Requests that fail with a transient error are retried with 
+        exponential backoff, up to snap_attempts attempts in all. If a 
+        snap_cache is given, windows of points it has already seen are
+        not requested again.
+        '''
+
+        if snap_attempts < 1:
+            raise ValueError(f'snap_attempts must be at least 1, got {snap_attempts}')
+
         with open('google/credentials.json') as f:
             credentials = json.load(f)
 
         self.gmaps = googlemaps.Client(key=credentials['key'])
         self.overlap = overlap
         self.max_points = 100
+        self.interp_alg = interp_alg
+        self.max_gap_millis = max_gap_millis
+        self.snap_workers = snap_workers
+        self.snap_attempts = snap_attempts
+        self.snap_backoff = snap_backoff
+        self.snap_max_backoff = snap_max_backoff
+        self.sleep = sleep
+        self.snap_limiter = RateLimiter(snap_per_second)
+        self.snap_fanout = FanOut(snap_workers)
+        self.snap_requests = 0
+        self.snap_retries = 0
+        self.snap_cache = snap_cache
+
+        self.__lock = threading.Lock()
 
     # ------------------------------------------------------------------------
     # ------------------------------------------------------------------------
@@ -30,35 +109,99 @@ class Geolocator():
     # ------------------------------------------------------------------------
 
     def filter_stationary(self, readings: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        keep = [readings[0]]
-        dropMillis = 5000
-        gpsErrMeters = 8
-        lastMotion = readings[0]
+        '''Drops readings taken while the vehicle was stationary. Every 
+        reading more than STATIONARY_METERS from the last reading that 
+        moved is kept, as are readings within STATIONARY_MILLIS of it. Of
+        the other stationary readings only the last STATIONARY_BUFFER 
+        before the vehicle moves again are kept.
+        '''
+
+        if len(readings) == 0:
+            return []
 
-        buffer = []
-        
-        readings = sorted(readings, key=lambda r: r[Constants.TIMESTAMP])
-
-        for r in readings[1:]:
-            if self.__meters_dist(r, lastMotion) > gpsErrMeters:
-                keep.extend(buffer)
-                buffer = []
-                keep.append(r)
-                lastMotion = r
-            elif self.__milli_diff(r, lastMotion) < dropMillis:
-                keep.append(r)
+        timestamps = list(map(itemgetter(Constants.TIMESTAMP), readings))
+        if any(map(operator.gt, timestamps, timestamps[1:])):
+            readings = sorted(readings, key=itemgetter(Constants.TIMESTAMP))
+            timestamps = list(map(itemgetter(Constants.TIMESTAMP), readings))
+
+        n = len(readings)
+        data = list(map(itemgetter(Constants.READING), readings))
+        lats = np.fromiter(map(itemgetter(Constants.LATITUDE), data), dtype=np.float64, count=n)
+        lngs = np.fromiter(map(itemgetter(Constants.LONGITUDE), data), dtype=np.float64, count=n)
+
+        # Readings within STATIONARY_METERS of the reading after them. 
+        # Every other reading moved away from the one before it, so runs
+        # of them are kept without any more distance checks. For these 
+        # the next few readings are checked up front as well, since 
+        # while driving the vehicle has almost always moved by then.
+        still = np.flatnonzero(haversine_meters(lats[:-1], lngs[:-1], lats[1:], lngs[1:]) <= self.STATIONARY_METERS)
+        lookahead = []
+        for step in range(2, self.STATIONARY_LOOKAHEAD + 2):
+            check = still[still + step < n]
+            moved = haversine_meters(lats[check], lngs[check], lats[check + step], lngs[check + step]) > self.STATIONARY_METERS
+            lookahead.append(moved.tolist() + [False] * (len(still) - len(check)))
+        still = still.tolist()
+
+        # Ranges of readings to keep, as (start, end) pairs.
+        keep = [(0, 1)]
+        last_motion = 0
+        i = 0
+        while True:
+            i = bisect.bisect_left(still, last_motion, i)
+            if i == len(still):
+                keep.append((last_motion + 1, n))
+                break
+
+            keep.append((last_motion + 1, still[i] + 1))
+            last_motion = still[i]
+
+            for step, moved in enumerate(lookahead, start=2):
+                if moved[i]:
+                    moved = last_motion + step
+                    break
             else:
-                buffer.append(r)
+                moved = self.__next_motion(lats, lngs, last_motion, last_motion + self.STATIONARY_LOOKAHEAD + 2)
+
+            end = moved if moved is not None else n
+            recent_end = bisect.bisect_left(timestamps, timestamps[last_motion] + self.STATIONARY_MILLIS, last_motion + 1, end)
+
+            keep.append((last_motion + 1, recent_end))
+            if moved is None:
+                break
+
+            keep.append((max(recent_end, moved - self.STATIONARY_BUFFER), moved + 1))
+            last_motion = moved
+
+        kept = []
+        for start, end in keep:
+            kept.extend(readings[start:end])
+
+        return kept
 
-                if len(buffer) > 10:
-                    buffer.pop(0)
+    def __next_motion(self, lats: np.ndarray, lngs: np.ndarray, origin: int, start: int) -> int:
+        '''Returns the index of the first point from start onwards that is
+        more than STATIONARY_METERS from origin, or None. Distances are 
+        computed a growing chunk at a time so that long stops cost a few
+        vectorized calls rather than one call per reading.
+        '''
 
-        return keep
+        size = self.MOTION_CHUNK_SIZE
+        while start < len(lats):
+            end = min(len(lats), start + size)
+            dists = haversine_meters(lats[origin], lngs[origin], lats[start:end], lngs[start:end])
+            moved = np.flatnonzero(dists > self.STATIONARY_METERS)
+            if len(moved) > 0:
+                return start + int(moved[0])
+
+            start = end
+            size = min(size * 2, self.MAX_MOTION_CHUNK_SIZE)
+
+        return None
 
     def wanted_img_readings(
         self,
-        pos_readings: List[Dict[str, Any]], 
-        img_readings: List[Dict[str, Any]] 
+        pos_readings: List[Dict[str, Any]],
+        img_readings: List[Dict[str, Any]]
     ):
         interpolated = self.interpolated(pos_readings, img_readings)
         filtered = self.filter_stationary(interpolated)
@@ -67,22 +210,9 @@ class Geolocator():
 
         for f in filtered:
             wanted_images.add(f[Constants.READING][Constants.URI][Constants.KEY])
-        
-        return [i for i in img_readings if i[Constants.READING][Constants.URI][Constants.KEY] in wanted_images]
-
-    def __milli_diff(self, r1: Dict[str, Any], r2: Dict[str, Any]) -> int:
-        return r1[Constants.TIMESTAMP] - r2[Constants.TIMESTAMP] 
-
-    def __meters_dist(self, r1: Dict[str, Any], r2: Dict[str, Any]) -> int:
-        p1 = self.__to_point(r1)
-        p2 = self.__to_point(r2)
 
-        return hs.haversine(p1, p2, unit=Unit.METERS)
+        return [i for i in img_readings if i[Constants.READING][Constants.URI][Constants.KEY] in wanted_images]
 
-    def __to_point(self, r1: Dict[str, Any]) -> Tuple[float, float]:
-        reading = r1[Constants.READING]
-        return (reading[Constants.LATITUDE], reading[Constants.LONGITUDE])
-        
     # ------------------------------------------------------------------------
     # ------------------------------------------------------------------------
     # ------------------------------------------------------------------------
@@ -98,20 +228,26 @@ class Geolocator():
         if len(pos_readings) < self.overlap:
             return pos_readings
 
-        all_final_readings = []
-
+        windows = []
         start_idx = 0
         while start_idx < len(pos_readings):
             end_idx = start_idx + self.max_points
             overlap = self.overlap if end_idx < len(pos_readings) else 0
-            next_readings = pos_readings[start_idx:end_idx]
+            windows.append(start_idx)
+            start_idx += self.max_points - overlap
 
-            snapped = self.__geolocate_subset(next_readings, replacement)
+        all_road_points = self.__snapped_windows([self.__to_latlng(r) for r in pos_readings], windows)
+        all_snapped = [
+            self.__geolocate_subset(pos_readings[start_idx:start_idx + self.max_points], road_points, replacement)
+            for start_idx, road_points in zip(windows, all_road_points)
+        ]
+
+        all_final_readings = []
+        for start_idx, snapped in zip(windows, all_snapped):
             if replacement:
                 all_final_readings.extend(self.__filter_duplicates(all_final_readings, snapped))
             else:
                 all_final_readings.extend(snapped[min(self.overlap, start_idx):])
-            start_idx += self.max_points - overlap
 
         return all_final_readings
 
@@ -127,14 +263,35 @@ class Geolocator():
                 to_add.append(p)
         return to_add
 
-    def __geolocate_subset(self, pos_readings: List[Dict[str, Any]], replace=False):
-        if replace:
-            return [r.to_point() for r in  self.__snapped_points(pos_readings)]
-        return self.__snap_readings(pos_readings)
+    def __snapped_windows(self, path: List[Tuple[float, float]], windows: List[int]) -> List[List[RoadPoint]]:
+        '''Snaps the window of path starting at each index in windows. 
+        Windows are snapped independently of each other, so they can all
+        be requested at once and stitched together in order after. 
+        Windows that the snap cache can answer are not requested at all.
+        '''
+
+        paths = [path[start_idx:start_idx + self.max_points] for start_idx in windows]
+
+        if self.snap_cache is None:
+            all_snapped = self.snap_fanout.map(lambda i: self.__snap_path(paths[i]), range(len(paths)))
+        else:
+            keys = self.snap_cache.keys(path)
+            window_keys = [keys[start_idx:start_idx + self.max_points] for start_idx in windows]
+            all_snapped = self.snap_cache.get(window_keys)
 
-    def __snap_readings(self, pos_readings: List[Dict[str, Any]]):
-        road_points = self.__snapped_points(pos_readings)
+            misses = [i for i, snapped in enumerate(all_snapped) if snapped is None]
+            for i, snapped in zip(misses, self.snap_fanout.map(lambda i: self.__snap_path(paths[i]), misses)):
+                all_snapped[i] = snapped
+                self.snap_cache.put(window_keys[i], snapped)
 
+        return [[RoadPoint(p) for p in snapped] for snapped in all_snapped]
+
+    def __geolocate_subset(self, pos_readings: List[Dict[str, Any]], road_points: List[RoadPoint], replace=False):
+        if replace:
+            return [r.to_point() for r in road_points]
+        return self.__snap_readings(pos_readings, road_points)
+
+    def __snap_readings(self, pos_readings: List[Dict[str, Any]], road_points: List[RoadPoint]):
         final_readings = []
         for p in road_points:
             if p.has_idx:
@@ -150,11 +307,48 @@ class Geolocator():
         repositioned[Constants.READING][Constants.PLACE_ID] = p.placeID
         return repositioned
 
-    def __snapped_points(self, readings: List[Dict[str, Any]]):
-        return [RoadPoint(p) for p in self.gmaps.snap_to_roads(
-            [self.__to_latlng(p) for p in readings],
-            interpolate=True
-        )]
+    def __snap_path(self, path: List[Tuple[float, float]]) -> List[Dict[str, Any]]:
+        attempt = 1
+        while True:
+            self.snap_limiter.acquire()
+            with self.__lock:
+                self.snap_requests += 1
+            try:
+                return self.gmaps.snap_to_roads(path, interpolate=True)
+            except (ApiError, TransportError) as e:
+                if attempt >= self.snap_attempts or not self.__retryable(e):
+                    raise
+
+                with self.__lock:
+                    self.snap_retries += 1
+
+                print(f'snapping {len(path)} points failed on attempt {attempt} of {self.snap_attempts}, retrying: {e}')
+                self.sleep(min(self.snap_backoff * 2 ** (attempt - 1), self.snap_max_backoff))
+                attempt += 1
+
+    def report(self) -> Dict[str, Any]:
+        '''Counts the snap_to_roads requests made so far, how many of them
+        were retries and how long they waited on the rate limit, along 
+        with the snap cache's hit rates if there is one.
+        '''
+
+        report = {
+            'requests': self.snap_requests,
+            'retries': self.snap_retries,
+            'rate_limited_seconds': self.snap_limiter.waited,
+        }
+        if self.snap_cache is not None:
+            report['cache'] = self.snap_cache.report()
+
+        return report
+
+    def __retryable(self, e: Exception) -> bool:
+        if isinstance(e, ApiError):
+            return e.status in self.RETRYABLE_STATUSES
+        if isinstance(e, HTTPError):
+            return e.status_code >= 500 or e.status_code == 429
+
+        return isinstance(e, (GoogleMapsTimeout, TransportError))
 
     def __to_latlng(self, reading: Dict[str, Any]) -> Tuple[float, float]:
         if Constants.READING in reading:
@@ -186,24 +380,40 @@ class Geolocator():
         pos_readings: List[Dict[str, Any]], 
         img_readings: List[Dict[str, Any]]
     ) -> List[Dict[str, Any]]:
-        lr = LineRoute.from_readings(pos_readings)
-        pred_readings = []
-        for r in img_readings:
-            ts = RUtils.get_ts(r)
-            if lr.contains(ts):
-                point = lr.point_at(ts)
-                pred_readings.append(self.__prediction_reading(r, point))
+        return self.interpolated_on(self.line_route(pos_readings), img_readings)
+
+    def line_route(self, pos_readings: List[Dict[str, Any]]) -> LineRoute:
+        return LineRoute.from_readings(pos_readings, self.interp_alg, self.max_gap_millis)
+
+    def interpolated_on(
+        self, 
+        lr: LineRoute, 
+        img_readings: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        '''Like interpolated, but reuses a LineRoute that was already built,
+        so that a route's images can be interpolated a batch at a time.
+        '''
+
+        img_readings = [r for r in img_readings if lr.contains(RUtils.get_ts(r))]
+        points = lr.points_at([RUtils.get_ts(r) for r in img_readings])
 
-        return pred_readings
+        return [self.__prediction_reading(r, point) for r, point in zip(img_readings, points)]
 
     def __prediction_reading(self, img_reading: Dict[str, Any], point: Dict[str, Any]) -> Dict[str, Any]:
-        pred_reading = copy.deepcopy(img_reading)
+        # Every nested value that is changed below is replaced rather 
+        # than mutated, so copying the top two levels is enough.
+        pred_reading = dict(img_reading)
+        pred_reading[Constants.READING] = dict(img_reading[Constants.READING])
         pred_reading[Constants.READING_TYPE] = Constants.PREDICTION
         pred_reading[Constants.READING][Constants.ENTITIES] = []
         pred_reading[Constants.ANNOTATION_TIMESTAMP] = int(time.time() * 1000)
         pred_reading[Constants.ANNOTATOR_ID] = FAUX_ANNOTATOR_ID
         pred_reading[Constants.READING][Constants.LATITUDE] = point.lat
         pred_reading[Constants.READING][Constants.LONGITUDE] = point.lng
+        if point.place_id:
+            pred_reading[Constants.READING][Constants.PLACE_ID] = point.place_id
+        if point.gap:
+            pred_reading[Constants.READING][Constants.GPS_GAP] = True
 
         if Constants.URI in img_reading[Constants.READING]:
             pred_reading[Constants.READING][Constants.URI] = RUtils.get_uri(img_reading)
@@ -45,6 +45,9 @@ event_handler = EventHandler(
         LambdaConstants.EVENT_GET_USER_ROUTES : get_user_routes,
         LambdaConstants.EVENT_GET_USER_LAYERS : get_user_layers,
         LambdaConstants.EVENT_GET_READINGS : get_readings,
+        LambdaConstants.EVENT_GET_BBOX_READINGS : get_bbox_readings,
+        LambdaConstants.EVENT_GET_SEGMENTS : get_segments,
+        LambdaConstants.EVENT_GET_TILES : get_tiles,
         LambdaConstants.EVENT_PROCESS_UPLOADED_ROUTE : process_uploaded_route,
         LambdaConstants.EVENT_UPLOAD_NEW_ROUTE : event_upload_new_route,
         LambdaConstants.EVENT_SAVE_PREDICTIONS : event_save_predictions,
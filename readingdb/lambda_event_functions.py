@@ -1,5 +1,6 @@
 import logging
 from readingdb.geolocator import Geolocator
+from readingdb.snapcache import SnapCache
 from readingdb.digester import Digester
 from typing import Dict, Any
 
@@ -45,6 +46,21 @@ def get_key(event, key):
 
     return event[key], None
 
+def get_bounds(event):
+    bounds = []
+    for key in [
+        LambdaConstants.EVENT_MIN_LATITUDE,
+        LambdaConstants.EVENT_MIN_LONGITUDE,
+        LambdaConstants.EVENT_MAX_LATITUDE,
+        LambdaConstants.EVENT_MAX_LONGITUDE,
+    ]:
+        value, err_resp = get_key(event, key)
+        if err_resp:
+            return None, err_resp
+        bounds.append(value)
+
+    return bounds, None
+
 def arg_check(*args,**kwargs_to_check):
     outputs = []
     for a in args:
@@ -69,12 +85,13 @@ def get_route(event: Dict[str,Any], **kwargs):
         return err_resp
 
     api, user_data = arg_check('api', 'user_data', **kwargs)
+    access = api.access_context(user_data.user_sub)
 
-    route = api.get_route(route_id)
+    route = api.get_route(route_id, access)
     if route is None:
         return error_response(f'Route {route_id} does not exist')
 
-    if not api.can_access_route(user_data.user_sub, route_id):
+    if not access.can_access_route(route_id):
         return unauthorized_route_response(user_data.user_sub, route_id)
 
     return success_response(route)
@@ -85,21 +102,27 @@ def delete_route(event: Dict[str,Any], **kwargs):
         return err_resp
 
     api, user_data = arg_check('api', 'user_data', **kwargs)
+    access = api.access_context(user_data.user_sub)
 
-    if not api.can_access_route(user_data.user_sub, route_id):
+    if not access.can_access_route(route_id):
         return unauthorized_route_response(user_data.user_sub, route_id)
 
-    api.delete_route(route_id)
-    return success_response('')
+    deleted_readings, deleted_images = api.delete_route(route_id)
+    return success_response({
+        LambdaConstants.RESPONSE_DELETED_READINGS: deleted_readings,
+        LambdaConstants.RESPONSE_DELETED_IMAGES: deleted_images,
+    })
 
 def get_user_routes(event, **kwargs):
     api, user_data = arg_check('api', 'user_data', **kwargs)
-    routes = api.routes_for_user(user_data.user_sub)
+    access = api.access_context(user_data.user_sub)
+    routes = api.routes_for_user(user_data.user_sub, access)
     return success_response(routes)
 
 def get_user_layers(event, **kwargs):
     api, user_data = arg_check('api', 'user_data', **kwargs)
-    layers = api.layers_for_user(user_data.user_sub)
+    access = api.access_context(user_data.user_sub)
+    layers = api.layers_for_user(user_data.user_sub, access)
     return success_response(layers)
 
 def get_readings(event, **kwargs):
@@ -107,6 +130,7 @@ def get_readings(event, **kwargs):
     geohashes, missing_geohash = get_key(event, Constants.GEOHASH)
 
     api, user_data = arg_check('api', 'user_data', **kwargs)
+    access = api.access_context(user_data.user_sub)
 
     if missing_route_id and missing_geohash:
         return error_response(f'Bad Format Error: event {LambdaConstants.EVENT_GET_READINGS} requires one of {Constants.ROUTE_ID}, {Constants.GEOHASH}')
@@ -121,7 +145,7 @@ def get_readings(event, **kwargs):
         elif not isinstance(geohashes,str):
             return error_response(f'Type Error: event GetReadings by {Constants.GEOHASH} must pass a string or list of strings')
 
-        readings = api.get_geohash_readings_by_user(geohashes, user_data.user_sub)
+        readings = api.get_geohash_readings_by_user(geohashes, user_data.user_sub, access)
 
         return success_response({Constants.READING_NAME: readings})
     elif not missing_route_id:
@@ -129,7 +153,7 @@ def get_readings(event, **kwargs):
         if missing:
             pred_only = True
 
-        if not api.can_access_route(user_data.user_sub, route_id):
+        if not access.can_access_route(route_id):
             return unauthorized_route_response(user_data.user_sub, route_id)
 
         if LambdaConstants.EVENT_BUCKET_KEY in event:
@@ -143,15 +167,71 @@ def get_readings(event, **kwargs):
         else:
             annotator_preference += ANNOTATOR_PREFERENCE
 
+        compress, missing = get_key(event, LambdaConstants.EVENT_COMPRESS)
+        if missing:
+            compress = False
+        elif not isinstance(compress, bool):
+            return error_response(f'Type Error: event {LambdaConstants.EVENT_GET_READINGS} {LambdaConstants.EVENT_COMPRESS} must be a boolean')
+
         readings = api.all_route_readings(
             route_id,
             key,
             predictions_only=pred_only,
-            annotator_preference=annotator_preference
+            annotator_preference=annotator_preference,
+            compress=compress,
         )
 
         return success_response({Constants.READING_NAME: readings})
         
+def get_bbox_readings(event, **kwargs):
+    bounds, err_resp = get_bounds(event)
+    if err_resp:
+        return err_resp
+
+    api, user_data = arg_check('api', 'user_data', **kwargs)
+    access = api.access_context(user_data.user_sub)
+
+    try:
+        readings = api.readings_in_bbox(*bounds, user_data.user_sub, access)
+    except (TypeError, ValueError) as e:
+        return error_response(f'Bad Format Error: event {LambdaConstants.EVENT_GET_BBOX_READINGS}: {e}')
+
+    return success_response({Constants.READING_NAME: readings})
+
+def get_tiles(event, **kwargs):
+    bounds, err_resp = get_bounds(event)
+    if err_resp:
+        return err_resp
+
+    precision, err_resp = get_key(event, Constants.PRECISION)
+    if err_resp:
+        return err_resp
+
+    api, user_data = arg_check('api', 'user_data', **kwargs)
+    access = api.access_context(user_data.user_sub)
+
+    try:
+        tiles = api.tiles_in_bbox(*bounds, precision, user_data.user_sub, access)
+    except (TypeError, ValueError) as e:
+        return error_response(f'Bad Format Error: event {LambdaConstants.EVENT_GET_TILES}: {e}')
+
+    return success_response({Constants.TILES: tiles})
+
+def get_segments(event, **kwargs):
+    geohashes, err_resp = get_key(event, Constants.GEOHASH)
+    if err_resp:
+        return err_resp
+
+    api, user_data = arg_check('api', 'user_data', **kwargs)
+    access = api.access_context(user_data.user_sub)
+
+    try:
+        segments = api.segments_by_user(geohashes, user_data.user_sub, access)
+    except (TypeError, ValueError) as e:
+        return error_response(f'Bad Format Error: event {LambdaConstants.EVENT_GET_SEGMENTS}: {e}')
+
+    return success_response({Constants.SEGMENTS: segments})
+
 def process_uploaded_route(event, **kwargs):
     # Event Format:
     # Type: 'ProcessUpload',
@@ -256,7 +336,8 @@ def event_update_route_name(event, **kwargs):
     if err_resp:
         return err_resp 
 
-    if not api.can_access_route(user_data.user_sub, route_id):
+    access = api.access_context(user_data.user_sub)
+    if not access.can_access_route(route_id):
         return unauthorized_route_response(user_data.user_sub, route_id)
 
     api.update_route_name(route_id, name)
@@ -309,7 +390,16 @@ def event_road_snap(event, **kwargs):
     if len(points) < 2:
         return error_response(f'Not Enough Points Given ({len(points)})')
 
-    geolocator = Geolocator()
+    # Cached snaps can come from other points in the same ~11m cell, so
+    # callers who need every point snapped live can turn the cache off.
+    use_snap_cache, missing = get_key(event, LambdaConstants.EVENT_USE_SNAP_CACHE)
+    if missing:
+        use_snap_cache = True
+    elif not isinstance(use_snap_cache, bool):
+        return error_response(f'Type Error: event {LambdaConstants.EVENT_ROAD_SNAP} {LambdaConstants.EVENT_USE_SNAP_CACHE} must be a boolean')
+
+    api, = arg_check('api', **kwargs)
+    geolocator = Geolocator(snap_cache=SnapCache(api) if use_snap_cache else None)
     return success_response({
         LambdaConstants.EVENT_POINTS: geolocator.geolocate(points, replacement=True)
     })
\ No newline at end of file
@@ -1,7 +1,14 @@
+import bisect
+import math
 from readingdb.rutils import RUtils
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Tuple
 from readingdb.constants import Constants
 
+# Below this angle (radians, about 6mm on the earth's surface) 
+# slerp_interp falls back to linear interpolation, which is exact 
+# enough and avoids dividing by sin(angle) ~ 0.
+SLERP_MIN_ANGLE = 1e-9
+
 def interpolate_lat(p1, a1, p2, a2) -> float:
     return p1.lat * a1 + p2.lat * a2    
 
@@ -15,6 +22,7 @@ class LinePoint():
             RUtils.get_ts(entry),
             RUtils.get_lat(entry),
             RUtils.get_lng(entry),
+            entry[Constants.READING].get(Constants.PLACE_ID),
         )
     
     @classmethod
@@ -23,12 +31,19 @@ class LinePoint():
             RUtils.get_ts(entry),
             entry[Constants.LATITUDE],
             entry[Constants.LONGITUDE],
+            entry.get(Constants.PLACE_ID),
         )
 
-    def __init__(self, timestamp: int, lat: float, lng: float) -> None:
+    def __init__(self, timestamp: int, lat: float, lng: float, place_id: str = None, gap: bool = False) -> None:
+        '''gap is set on interpolated points whose surrounding GPS fixes
+        are further apart than the route's max_gap_millis.
+        '''
+
         self.timestamp = timestamp
         self.lat = lat
         self.lng = lng
+        self.place_id = place_id
+        self.gap = gap
     
     def __eq__(self, other)-> bool:
         return self.timestamp == other.timestamp and\
@@ -53,17 +68,64 @@ def linear_interp(prev: LinePoint, post: LinePoint, timestamp) -> LinePoint:
             prev_closeness, 
             post, 
             post_closeness
-        )
+        ),
+        prev.place_id if prev_closeness >= post_closeness else post.place_id
     )
 
+def to_unit_vector(lat: float, lng: float) -> Tuple[float, float, float]:
+    lat = math.radians(lat)
+    lng = math.radians(lng)
+
+    return (math.cos(lat) * math.cos(lng), math.cos(lat) * math.sin(lng), math.sin(lat))
+
+def from_unit_vector(x: float, y: float, z: float) -> Tuple[float, float]:
+    return math.degrees(math.atan2(z, math.hypot(x, y))), math.degrees(math.atan2(y, x))
+
+def slerp_interp(prev: LinePoint, post: LinePoint, timestamp) -> LinePoint:
+    '''Interpolates along the great circle between prev and post instead 
+    of along a straight line in lat/lng, which matters when GPS drops 
+    out and the fixes either side of a gap are far apart.
+    '''
+
+    time_dist = post.timestamp - prev.timestamp
+    post_closeness = (timestamp - prev.timestamp) / time_dist
+    prev_closeness = 1 - post_closeness
+    place_id = prev.place_id if prev_closeness >= post_closeness else post.place_id
+
+    if post_closeness == 0:
+        return LinePoint(timestamp, prev.lat, prev.lng, place_id)
+    if post_closeness == 1:
+        return LinePoint(timestamp, post.lat, post.lng, place_id)
+
+    a = to_unit_vector(prev.lat, prev.lng)
+    b = to_unit_vector(post.lat, post.lng)
+    cross = (a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0])
+    angle = math.atan2(math.sqrt(sum(c * c for c in cross)), sum(i * j for i, j in zip(a, b)))
+
+    if angle < SLERP_MIN_ANGLE:
+        return linear_interp(prev, post, timestamp)
+
+    a_weight = math.sin(prev_closeness * angle) / math.sin(angle)
+    b_weight = math.sin(post_closeness * angle) / math.sin(angle)
+    lat, lng = from_unit_vector(*[i * a_weight + j * b_weight for i, j in zip(a, b)])
+
+    return LinePoint(timestamp, lat, lng, place_id)
+
 class LineRoute():
     @classmethod
-    def from_readings(self, points: List[Dict[str, Any]], interp_alg=linear_interp):
-        return LineRoute([LinePoint.from_reading(p) for p in points], interp_alg)
+    def from_readings(self, points: List[Dict[str, Any]], interp_alg=linear_interp, max_gap_millis: int = None):
+        return LineRoute([LinePoint.from_reading(p) for p in points], interp_alg, max_gap_millis)
+
+    def __init__(self, points: List[LinePoint], interp_alg=linear_interp, max_gap_millis: int = None):
+        '''points must be in timestamp order. If max_gap_millis is given,
+        points interpolated between GPS fixes more than max_gap_millis 
+        apart are flagged with gap.
+        '''
 
-    def __init__(self, points: List[LinePoint], interp_alg=linear_interp):
         self.points = points
         self.interp_alg=interp_alg
+        self.max_gap_millis = max_gap_millis
+        self.timestamps = [p.timestamp for p in points]
 
     def contains(self, unix_time) -> bool:
         return not self.starts_after(unix_time) and not self.ends_before(unix_time)
@@ -75,21 +137,56 @@ class LineRoute():
         return unix_time < self.points[0].timestamp
     
     def point_at(self, unix_time: int) -> LinePoint:
+        if not self.contains(unix_time):
+            return self.__clamped(unix_time)
+
+        return self.__interp_before(bisect.bisect_left(self.timestamps, unix_time, 1), unix_time)
+
+    def points_at(self, unix_times: List[int]) -> List[LinePoint]:
+        '''Returns the point at each of unix_times, like point_at, but 
+        finds them all in a single pass along the route, so it is fastest
+        when unix_times are already sorted. interp_algs which can 
+        interpolate many points at once (see NumpyInterp) do so here.
+        '''
+
+        if hasattr(self.interp_alg, 'points_at'):
+            return self.interp_alg.points_at(self, unix_times)
+
+        points = [None] * len(unix_times)
+        idx = 1
+        for i in sorted(range(len(unix_times)), key=unix_times.__getitem__):
+            unix_time = unix_times[i]
+            if not self.contains(unix_time):
+                points[i] = self.__clamped(unix_time)
+                continue
+
+            while idx < len(self.timestamps) and self.timestamps[idx] < unix_time:
+                idx += 1
+
+            points[i] = self.__interp_before(idx, unix_time)
+
+        return points
+
+    def __interp_before(self, idx: int, unix_time: int) -> LinePoint:
+        '''Interpolates between the points either side of idx, the index
+        of the first point after the route's start that is not before 
+        unix_time.
+        '''
+
+        prev_point = self.points[idx - 1]
+        next_point = self.points[idx] if idx < len(self.points) else None
+        point = self.interp_alg(prev_point, next_point, unix_time)
+        point.gap = self.is_gap(prev_point, next_point)
+
+        return point
+
+    def is_gap(self, prev: LinePoint, post: LinePoint) -> bool:
+        return self.max_gap_millis is not None and post.timestamp - prev.timestamp > self.max_gap_millis
+
+    def __clamped(self, unix_time: int) -> LinePoint:
         if self.ends_before(unix_time):
             print(f"WARNING: cannot get position at a time {unix_time} from after the route finished {self.points[-1]}")
             return self.points[-1]
-        if self.starts_after(unix_time):
-            print(f"WARNING: cannot get position at {unix_time} a time from before the route began {self.points[0]}")
-            return self.points[0]
-            
-        prev_point = self.points[0]
-        next_point = None
-        
-        for p in self.points[1:]:
-            if p.timestamp >= unix_time:
-                next_point = p
-                break
-            else:
-                prev_point = p
-        
-        return self.interp_alg(prev_point, next_point, unix_time)
\ No newline at end of file
+
+        print(f"WARNING: cannot get position at {unix_time} a time from before the route began {self.points[0]}")
+        return self.points[0]
@@ -0,0 +1,126 @@
+import weakref
+from typing import List
+
+import numpy as np
+
+from readingdb.lineroute import SLERP_MIN_ANGLE, LinePoint, LineRoute, linear_interp, slerp_interp
+
+class NumpyInterp():
+    '''An interp_alg for LineRoute which keeps the route's timestamps,
+    latitudes and longitudes in NumPy arrays and interpolates every
+    point passed to LineRoute.points_at at once. Linear points are
+    computed with the same float operations as linear_interp, so the
+    two give identical results. With spherical set, points follow the
+    great circle between fixes like slerp_interp.
+
+    Requires numpy, which is only needed if this backend is selected.
+    '''
+
+    def __init__(self, spherical: bool = False) -> None:
+        self.spherical = spherical
+        self.interp_alg = slerp_interp if spherical else linear_interp
+        self.arrays = weakref.WeakKeyDictionary()
+
+    def __call__(self, prev: LinePoint, post: LinePoint, timestamp) -> LinePoint:
+        return self.interp_alg(prev, post, timestamp)
+
+    def points_at(self, lr: LineRoute, unix_times: List[int]) -> List[LinePoint]:
+        if len(unix_times) == 0:
+            return []
+
+        timestamps, lats, lngs = self.__arrays(lr)
+        unix_times = np.asarray(unix_times)
+
+        inside = (unix_times >= timestamps[0]) & (unix_times <= timestamps[-1])
+        post = np.searchsorted(timestamps[1:], unix_times, side='left') + 1
+        post = np.minimum(post, len(timestamps) - 1)
+        prev = post - 1
+
+        time_dist = timestamps[post] - timestamps[prev]
+        if lr.max_gap_millis is not None:
+            gaps = time_dist > lr.max_gap_millis
+        else:
+            gaps = np.zeros(len(unix_times), dtype=bool)
+
+        # point_at clamps times outside the route and linear_interp
+        # raises on points with equal timestamps, so leave both to them.
+        fallback = ~inside | (time_dist == 0)
+        time_dist = np.where(fallback, 1, time_dist)
+
+        post_closeness = (unix_times - timestamps[prev]) / time_dist
+        prev_closeness = 1 - post_closeness
+        interp_lats = lats[prev] * prev_closeness + lats[post] * post_closeness
+        interp_lngs = lngs[prev] * prev_closeness + lngs[post] * post_closeness
+        nearest = np.where(prev_closeness >= post_closeness, prev, post)
+
+        if self.spherical:
+            interp_lats, interp_lngs = self.__slerp(
+                lats,
+                lngs,
+                prev,
+                post,
+                prev_closeness,
+                post_closeness,
+                interp_lats,
+                interp_lngs
+            )
+
+        points = []
+        for i, unix_time in enumerate(unix_times.tolist()):
+            if fallback[i]:
+                points.append(lr.point_at(unix_time))
+            else:
+                points.append(LinePoint(
+                    unix_time,
+                    float(interp_lats[i]),
+                    float(interp_lngs[i]),
+                    lr.points[nearest[i]].place_id,
+                    bool(gaps[i]),
+                ))
+
+        return points
+
+    def __slerp(self, lats, lngs, prev, post, prev_closeness, post_closeness, linear_lats, linear_lngs):
+        a = self.__unit_vectors(lats[prev], lngs[prev])
+        b = self.__unit_vectors(lats[post], lngs[post])
+        angle = np.arctan2(
+            np.linalg.norm(np.cross(a, b), axis=1),
+            np.einsum('ij,ij->i', a, b)
+        )
+
+        # Like slerp_interp, nearly identical fixes are interpolated
+        # linearly to avoid dividing by sin(angle) ~ 0.
+        linear = angle < SLERP_MIN_ANGLE
+        angle = np.where(linear, 1.0, angle)
+        a_weight = np.sin(prev_closeness * angle) / np.sin(angle)
+        b_weight = np.sin(post_closeness * angle) / np.sin(angle)
+        v = a * a_weight[:, None] + b * b_weight[:, None]
+
+        interp_lats = np.degrees(np.arctan2(v[:, 2], np.hypot(v[:, 0], v[:, 1])))
+        interp_lngs = np.degrees(np.arctan2(v[:, 1], v[:, 0]))
+
+        interp_lats = np.where(linear, linear_lats, interp_lats)
+        interp_lngs = np.where(linear, linear_lngs, interp_lngs)
+        interp_lats = np.where(post_closeness == 0, lats[prev], np.where(post_closeness == 1, lats[post], interp_lats))
+        interp_lngs = np.where(post_closeness == 0, lngs[prev], np.where(post_closeness == 1, lngs[post], interp_lngs))
+
+        return interp_lats, interp_lngs
+
+    def __unit_vectors(self, lats, lngs):
+        lats = np.radians(lats)
+        lngs = np.radians(lngs)
+
+        return np.stack([np.cos(lats) * np.cos(lngs), np.cos(lats) * np.sin(lngs), np.sin(lats)], axis=1)
+
+    def __arrays(self, lr: LineRoute):
+        if lr not in self.arrays:
+            self.arrays[lr] = (
+                np.asarray(lr.timestamps),
+                np.asarray([p.lat for p in lr.points], dtype=np.float64),
+                np.asarray([p.lng for p in lr.points], dtype=np.float64),
+            )
+
+        return self.arrays[lr]
+
+numpy_interp = NumpyInterp()
+numpy_slerp_interp = NumpyInterp(spherical=True)
@@ -0,0 +1,192 @@
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List
+
+class Stage():
+    def __init__(self, name: str, fn: Callable[[Any], Any], workers: int, batch_size: int) -> None:
+        if workers < 1:
+            raise ValueError(f'stage {name} needs at least 1 worker, got {workers}')
+        if batch_size < 1:
+            raise ValueError(f'stage {name} needs a batch size of at least 1, got {batch_size}')
+
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.batch_size = batch_size
+
+        self.items_in = 0
+        self.items_out = 0
+        self.busy_seconds = 0.0
+
+class Pipeline():
+    '''Streams items through a chain of stages. Every stage runs on its
+    own threads and hands its output to the next stage through a bounded
+    queue, so all stages work at the same time and a slow stage holds
+    back the stages before it instead of letting work pile up in memory.
+
+    A stage with a batch_size of 1 is called with one item at a time and
+    returns one item, or None to drop it. A stage with a larger
+    batch_size is called with a list of up to batch_size items and
+    returns a list. If any stage raises, the whole pipeline stops and
+    run raises the same exception.
+    '''
+
+    POLL_SECONDS = 0.1
+    DONE = object()
+
+    def __init__(self, queue_size: int = 256) -> None:
+        self.queue_size = queue_size
+        self.stages: List[Stage] = []
+
+    def stage(
+        self,
+        name: str,
+        fn: Callable[[Any], Any],
+        workers: int = 1,
+        batch_size: int = 1
+    ) -> 'Pipeline':
+        self.stages.append(Stage(name, fn, workers, batch_size))
+        return self
+
+    def run(self, items: Iterable[Any]) -> List[Any]:
+        '''Feeds items through every stage and returns what the last stage
+        produced. Items pass through stages with more than one worker in
+        no particular order.
+        '''
+
+        if len(self.stages) == 0:
+            return list(items)
+
+        self.__failed = threading.Event()
+        self.__errors: List[BaseException] = []
+        self.__lock = threading.Lock()
+        self.__start = time.perf_counter()
+
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        results = []
+
+        threads = [threading.Thread(target=self.__feed, args=(items, queues[0]), daemon=True)]
+        for i, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self.__work,
+                    args=(stage, queues[i], queues[i + 1], remaining),
+                    daemon=True
+                ))
+
+        for t in threads:
+            t.start()
+
+        while True:
+            item = self.__get(queues[-1])
+            if item is self.DONE:
+                break
+            results.append(item)
+
+        for t in threads:
+            t.join()
+
+        if len(self.__errors) > 0:
+            raise self.__errors[0]
+
+        return results
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            'seconds': time.perf_counter() - self.__start,
+            'stages': {
+                stage.name: {
+                    'in': stage.items_in,
+                    'out': stage.items_out,
+                    'workers': stage.workers,
+                    'busy_seconds': stage.busy_seconds,
+                } for stage in self.stages
+            }
+        }
+
+    def __feed(self, items: Iterable[Any], out_queue: queue.Queue) -> None:
+        try:
+            for item in items:
+                if not self.__put(out_queue, item):
+                    return
+        except BaseException as e:
+            self.__fail(e)
+        finally:
+            self.__put(out_queue, self.DONE)
+
+    def __work(
+        self,
+        stage: Stage,
+        in_queue: queue.Queue,
+        out_queue: queue.Queue,
+        remaining: List[int]
+    ) -> None:
+        batch = []
+        try:
+            while True:
+                item = self.__get(in_queue)
+                if item is self.DONE:
+                    # Let the other workers of this stage see the end too.
+                    self.__put(in_queue, self.DONE)
+                    break
+
+                batch.append(item)
+                if len(batch) >= stage.batch_size:
+                    self.__process(stage, batch, out_queue)
+                    batch = []
+
+            if len(batch) > 0:
+                self.__process(stage, batch, out_queue)
+        except BaseException as e:
+            self.__fail(e)
+        finally:
+            with self.__lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+
+            if last:
+                self.__put(out_queue, self.DONE)
+
+    def __process(self, stage: Stage, batch: List[Any], out_queue: queue.Queue) -> None:
+        start = time.perf_counter()
+        if stage.batch_size == 1:
+            output = stage.fn(batch[0])
+            output = [] if output is None else [output]
+        else:
+            output = stage.fn(batch)
+        elapsed = time.perf_counter() - start
+
+        with self.__lock:
+            stage.items_in += len(batch)
+            stage.items_out += len(output)
+            stage.busy_seconds += elapsed
+
+        for item in output:
+            if not self.__put(out_queue, item):
+                return
+
+    def __put(self, q: queue.Queue, item: Any) -> bool:
+        while True:
+            if self.__failed.is_set() and item is not self.DONE:
+                return False
+            try:
+                q.put(item, timeout=self.POLL_SECONDS)
+                return True
+            except queue.Full:
+                if self.__failed.is_set():
+                    return False
+
+    def __get(self, q: queue.Queue) -> Any:
+        while True:
+            try:
+                return q.get(timeout=self.POLL_SECONDS)
+            except queue.Empty:
+                if self.__failed.is_set():
+                    return self.DONE
+
+    def __fail(self, e: BaseException) -> None:
+        with self.__lock:
+            self.__errors.append(e)
+        self.__failed.set()
@@ -0,0 +1,227 @@
+import base64
+import hashlib
+import hmac
+import math
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qsl, quote, urlsplit, urlunsplit
+
+import boto3
+
+class Presigner():
+    '''Generates presigned GET urls for S3 objects and remembers them for as
+    long as they remain usable.
+
+    A url stops working when the credentials it was signed with expire, 
+    so with temporary (e.g. STS) credentials a url's lifetime ends at the
+    credentials' expiry if that comes first. Credentials that have a 
+    session token but no known expiry are assumed to last 
+    temporary_lifetime seconds. A cached url is reused until less than 
+    min_remaining seconds, or min_remaining_fraction of the lifetime it
+    was signed with if that is shorter, are left. So every url handed 
+    out from the cache is valid for at least that long, and urls signed
+    with short lived credentials are still reused for a while.
+
+    Urls that are missing from the cache are signed together: botocore
+    signs one "probe" url per bucket and the rest of the bucket's keys are
+    signed with the same credentials and expiry directly, which skips
+    botocore's per-request serialization and event machinery. The direct
+    path is only used if it reproduces the probe url exactly, otherwise
+    every key falls back to generate_presigned_url. credentials should be
+    the ones s3_client signs with, e.g. from the boto3 Session the client
+    was created from, which is where they are taken from by default.
+    '''
+
+    QUERY_PARAMS = {'AWSAccessKeyId', 'Signature', 'Expires', 'x-amz-security-token'}
+
+    def __init__(
+        self,
+        s3_client,
+        expires_in: int = 259200,
+        min_remaining: int = 86400,
+        max_entries: int = 200000,
+        clock: Callable[[], float] = time.time,
+        credentials=None,
+        temporary_lifetime: int = 3600,
+        min_remaining_fraction: float = 0.5,
+    ) -> None:
+        if min_remaining >= expires_in:
+            raise ValueError(f'min_remaining ({min_remaining}) must be less than expires_in ({expires_in})')
+        if not 0 < min_remaining_fraction < 1:
+            raise ValueError(f'min_remaining_fraction must be between 0 and 1, got {min_remaining_fraction}')
+
+        self.s3_client = s3_client
+        self.expires_in = expires_in
+        self.min_remaining = min_remaining
+        self.max_entries = max_entries
+        self.clock = clock
+        self.credentials = credentials if credentials is not None else boto3.Session().get_credentials()
+        self.temporary_lifetime = temporary_lifetime
+        self.min_remaining_fraction = min_remaining_fraction
+
+        self.hits = 0
+        self.misses = 0
+        self.__cache: OrderedDict = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.__cache)
+
+    def url(self, bucket: str, key: str) -> str:
+        return self.urls([(bucket, key)])[0]
+
+    def urls(self, objects: Iterable[Tuple[str, str]]) -> List[str]:
+        '''Returns a presigned url for each (bucket, key) pair, in the order
+        given.
+        '''
+
+        objects = list(objects)
+        now = self.clock()
+        found: Dict[Tuple[str, str], str] = {}
+        missing = defaultdict(list)
+
+        with self.__lock:
+            for obj in OrderedDict.fromkeys(objects):
+                entry = self.__cache.get(obj)
+                if entry is not None and now < entry[1]:
+                    self.__cache.move_to_end(obj)
+                    found[obj] = entry[0]
+                    self.hits += 1
+                else:
+                    missing[obj[0]].append(obj[1])
+                    self.misses += 1
+
+        signed = {}
+        if len(missing) > 0:
+            frozen = self.credentials.get_frozen_credentials() if self.credentials is not None else None
+            expires_at = min(int(now) + self.expires_in, self.__credentials_expiry(frozen, now))
+            reuse_until = expires_at - min(self.min_remaining, self.min_remaining_fraction * (expires_at - now))
+            for bucket, keys in missing.items():
+                signed.update(self.__sign_bucket(bucket, keys, reuse_until, frozen))
+
+        if len(signed) > 0:
+            with self.__lock:
+                for obj, entry in signed.items():
+                    self.__cache[obj] = entry
+                    self.__cache.move_to_end(obj)
+                    found[obj] = entry[0]
+
+                while len(self.__cache) > self.max_entries:
+                    self.__cache.popitem(last=False)
+
+        return [found[obj] for obj in objects]
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __sign_bucket(
+        self,
+        bucket: str,
+        keys: List[str],
+        reuse_until: float,
+        credentials,
+    ) -> Dict[Tuple[str, str], Tuple[str, float]]:
+        probe = self.__botocore_url(bucket, keys[0])
+        signed = {(bucket, keys[0]): (probe, reuse_until)}
+
+        sign = None
+        if len(keys) > 1 and credentials is not None:
+            sign = self.__direct_signer(bucket, keys[0], probe, credentials)
+
+        for key in keys[1:]:
+            url = sign(key) if sign is not None else self.__botocore_url(bucket, key)
+            signed[(bucket, key)] = (url, reuse_until)
+
+        return signed
+
+    def __botocore_url(self, bucket: str, key: str) -> str:
+        return self.s3_client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': bucket, 'Key': key},
+            ExpiresIn=self.expires_in
+        )
+
+    def __credentials_expiry(self, credentials, now: float) -> float:
+        '''Returns the time at which urls signed now with credentials (as 
+        returned by get_frozen_credentials) stop working.
+        '''
+
+        if credentials is None or not credentials.token:
+            return math.inf
+
+        refresh_needed = getattr(self.credentials, 'refresh_needed', None)
+        if refresh_needed is None:
+            return now + self.temporary_lifetime
+
+        # Refreshable credentials only say whether they expire within a 
+        # given number of seconds, so search for the time remaining.
+        if not refresh_needed(self.expires_in):
+            return math.inf
+
+        low, high = 0, self.expires_in
+        while low < high:
+            mid = (low + high + 1) // 2
+            if refresh_needed(mid):
+                high = mid - 1
+            else:
+                low = mid
+
+        return now + low
+
+    def __direct_signer(self, bucket: str, probe_key: str, probe: str, credentials) -> Optional[Callable[[str], str]]:
+        '''Returns a function which signs keys in the given bucket the same
+        way botocore signed the probe url (S3 query string authentication),
+        or None if the probe url was signed some other way or with other
+        credentials.
+        '''
+
+        split = urlsplit(probe)
+        params = parse_qsl(split.query, keep_blank_values=True)
+        names = [n for n, _ in params]
+        if len(set(names)) != len(names) or not set(names) <= self.QUERY_PARAMS:
+            return None
+        if 'Signature' not in names or 'Expires' not in names:
+            return None
+
+        path_prefix = self.__path_prefix(bucket, probe_key, split.path)
+        if path_prefix is None:
+            return None
+
+        values = dict(params)
+        secret = credentials.secret_key.encode('utf-8')
+        token_line = ''
+        if credentials.token:
+            token_line = f'x-amz-security-token:{credentials.token}\n'
+        string_prefix = f'GET\n\n\n{values["Expires"]}\n{token_line}/{bucket}/'
+
+        def sign(key: str) -> str:
+            encoded_key = quote(key, safe='/~')
+            string_to_sign = string_prefix + encoded_key
+            digest = hmac.new(secret, string_to_sign.encode('utf-8'), hashlib.sha1).digest()
+            signature = base64.b64encode(digest).decode('utf-8')
+            query = '&'.join(
+                f'{n}={quote(signature if n == "Signature" else v, safe="-_.~")}'
+                for n, v in params
+            )
+
+            return urlunsplit((split.scheme, split.netloc, path_prefix + encoded_key, query, ''))
+
+        if sign(probe_key) != probe:
+            return None
+
+        return sign
+
+    def __path_prefix(self, bucket: str, key: str, path: str) -> Optional[str]:
+        encoded_key = quote(key, safe='/~')
+
+        if path == f'/{bucket}/{encoded_key}':
+            return f'/{bucket}/'
+        if path == f'/{encoded_key}':
+            return '/'
+
+        return None
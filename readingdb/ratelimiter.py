@@ -0,0 +1,37 @@
+import threading
+import time
+from typing import Callable
+
+class RateLimiter():
+    '''Spaces out calls made from many threads so that no more than
+    per_second of them start in any second. Each caller reserves the
+    next free slot under a lock and then waits for it outside the lock,
+    so waiting callers do not hold each other up.
+    '''
+
+    def __init__(
+        self,
+        per_second: float,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        if per_second <= 0:
+            raise ValueError(f'per_second must be positive, got {per_second}')
+
+        self.interval = 1 / per_second
+        self.clock = clock
+        self.sleep = sleep
+        self.waited = 0.0
+
+        self.__lock = threading.Lock()
+        self.__next_slot = None
+
+    def acquire(self) -> None:
+        with self.__lock:
+            now = self.clock()
+            slot = now if self.__next_slot is None else max(now, self.__next_slot)
+            self.__next_slot = slot + self.interval
+            self.waited += slot - now
+
+        if slot > now:
+            self.sleep(slot - now)
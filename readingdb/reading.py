@@ -20,6 +20,21 @@ def reading_partition_key(lat: str, lng: str, reading_type: str) -> str:
 def geohash_partition_key(geohash: str, reading_type: str) -> str:
     return f'{geohash}#{reading_type}' 
 
+def image_keys(reading: Dict[str, Any]) -> List[str]:
+    '''Two readings refer to the same image if they share a filename or
+    an S3 location, so each reading has up to two image keys.
+    '''
+    data = reading[Constants.READING]
+    keys = []
+
+    if Constants.FILENAME in data:
+        keys.append(f'{Constants.FILENAME}#{data[Constants.FILENAME]}')
+    if Constants.URI in data:
+        uri = data[Constants.URI]
+        keys.append(f'{Constants.URI}#{uri[Constants.BUCKET]}/{uri[Constants.KEY]}')
+
+    return keys
+
 #TODO: ask louka about the route id and if that is a necessary attribute
 class Reading():
     def __init__(
@@ -34,6 +49,8 @@ class Reading():
         annotation_timestamp: int,
         annotator_id: str,
         uri: str = None,
+        place_id: str = None,
+        gps_gap: bool = False,
     ):
         self.id: str = id
         self.route_id: str = route_id
@@ -47,6 +64,8 @@ class Reading():
         self.entites: List[Entity] = entities
         self.annotator_id = annotator_id
         self.annotation_timestamp = annotation_timestamp
+        self.place_id = place_id
+        self.gps_gap = gps_gap
         
         self.data: Dict = {
             Constants.LATITUDE: lat,
@@ -99,6 +118,11 @@ class Reading():
         }
         self.__add_file_data(data[Constants.READING])
 
+        if self.place_id:
+            data[Constants.READING][Constants.PLACE_ID] = self.place_id
+        if self.gps_gap:
+            data[Constants.READING][Constants.GPS_GAP] = True
+
         encoded_entities = []
         for e in self.entites:
             encoded_entities.append(e.encode())
@@ -168,7 +192,9 @@ def json_to_reading(reading_type: str, reading: Dict[str, Any]) -> Reading:
             entities,
             annotation_timestamp=reading[Constants.ANNOTATION_TIMESTAMP],
             annotator_id=reading[Constants.ANNOTATOR_ID],
-            uri=get_uri(reading_data)
+            uri=get_uri(reading_data),
+            place_id=reading_data.get(Constants.PLACE_ID),
+            gps_gap=reading_data.get(Constants.GPS_GAP, False)
         )
     else:
         raise ValueError(f'unrecognized reading type {reading_type} for reading {reading}')
\ No newline at end of file
@@ -0,0 +1,132 @@
+import io
+import threading
+import zipfile
+from typing import IO, List
+
+class S3RangeReader(io.RawIOBase):
+    '''A read-only, seekable file over an S3 object which only downloads
+    the byte ranges that are actually read, using ranged GETs. Wrap it in
+    an io.BufferedReader (see open_s3_zip) so that the many small reads
+    made while parsing a zip's headers are served by a few requests.
+    '''
+
+    def __init__(self, s3_client, bucket: str, key: str, size: int = None) -> None:
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.size = size if size is not None else s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+
+        self.position = 0
+        self.requests = 0
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f'invalid whence {whence}')
+
+        if position < 0:
+            raise ValueError(f'cannot seek to negative position {position}')
+
+        self.position = position
+        return position
+
+    def readinto(self, b) -> int:
+        if self.position >= self.size or len(b) == 0:
+            return 0
+
+        end = min(self.position + len(b), self.size) - 1
+        body = self.s3_client.get_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Range=f'bytes={self.position}-{end}',
+        )['Body'].read()
+
+        n = len(body)
+        b[:n] = body
+        self.position += n
+        self.requests += 1
+        self.bytes_read += n
+
+        return n
+
+def open_s3_zip(
+    s3_client,
+    bucket: str,
+    key: str,
+    size: int = None,
+    buffer_size: int = 1024 * 1024
+) -> zipfile.ZipFile:
+    '''Opens a zip archive stored in S3 without downloading it. The
+    central directory is read with ranged GETs and members are fetched
+    as they are read, so memory use depends on buffer_size rather than
+    on the size of the archive.
+    '''
+
+    reader = S3RangeReader(s3_client, bucket, key, size)
+    return zipfile.ZipFile(io.BufferedReader(reader, buffer_size=buffer_size))
+
+class S3Zip():
+    '''A zip archive stored in S3 whose members can be read from many
+    threads at once. A ZipFile funnels every member read through a lock
+    on its single underlying file, so each thread that reads from an 
+    S3Zip gets its own ZipFile over its own S3RangeReader (see 
+    open_s3_zip) and threads download members in parallel. Every thread
+    reads the archive's central directory once.
+    '''
+
+    def __init__(
+        self, 
+        s3_client, 
+        bucket: str, 
+        key: str, 
+        size: int = None, 
+        buffer_size: int = 1024 * 1024
+    ) -> None:
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.size = size if size is not None else s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+        self.buffer_size = buffer_size
+
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+        self.__opened: List[zipfile.ZipFile] = []
+
+    def namelist(self) -> List[str]:
+        return self.zip_file().namelist()
+
+    def open(self, name: str) -> IO[bytes]:
+        return self.zip_file().open(name)
+
+    def zip_file(self) -> zipfile.ZipFile:
+        '''Returns the calling thread's ZipFile over the archive.'''
+
+        z = getattr(self.__local, 'zip_file', None)
+        if z is None:
+            z = open_s3_zip(self.s3_client, self.bucket, self.key, self.size, self.buffer_size)
+            self.__local.zip_file = z
+            with self.__lock:
+                self.__opened.append(z)
+
+        return z
+
+    def close(self) -> None:
+        with self.__lock:
+            for z in self.__opened:
+                z.close()
+            self.__opened = []
@@ -0,0 +1,124 @@
+from typing import Any, Dict, Iterable, List
+
+from readingdb.clean import encode_as_float, decode_float
+from readingdb.constants import *
+from readingdb.faultstats import FaultStats, preferred_readings
+
+def segment_partition_key(layer_id: str, geohash: str) -> str:
+    return f'{Constants.SEGMENT_PK}#{layer_id}#{geohash}'
+
+def segment_id(reading: Dict[str, Any]) -> str:
+    '''Readings that were snapped to a road carry the Google placeId of
+    the road segment they were snapped to. Readings that were never
+    snapped are grouped by geohash instead.
+    '''
+
+    data = reading[Constants.READING]
+    if data.get(Constants.PLACE_ID):
+        return data[Constants.PLACE_ID]
+
+    return f'{Constants.GEOHASH}#{reading[Constants.GEOHASH]}'
+
+class Segment(FaultStats):
+    '''Aggregated fault data for the PredictionReadings on a single road
+    segment (see design/segments.md). Segments are stored once per
+    (layer, geohash, segment) so that they can be recomputed one geohash
+    at a time, and merged back together when they are queried. Only 
+    segments of the same layer can be merged, since a reading can be in
+    more than one layer.
+    '''
+
+    def __init__(self, id: str, geohashes: Iterable[str] = (), layer_id: str = None) -> None:
+        super().__init__()
+        self.id: str = id
+        self.layer_id: str = layer_id
+        self.geohashes = set(geohashes)
+        self.min_lat: float = None
+        self.min_lng: float = None
+        self.max_lat: float = None
+        self.max_lng: float = None
+
+    @classmethod
+    def from_readings(
+        cls,
+        readings: Iterable[Dict[str, Any]],
+        preference: List[str] = ANNOTATOR_PREFERENCE
+    ) -> List['Segment']:
+        '''Groups decoded PredictionReadings into segments, counting only
+        one prediction for each image.
+        '''
+
+        segments: Dict[str, Segment] = {}
+        for r in preferred_readings(readings, preference):
+            id = segment_id(r)
+            if id not in segments:
+                segments[id] = Segment(id)
+            segments[id].add(r)
+
+        return sorted(segments.values(), key=lambda s: s.id)
+
+    @classmethod
+    def from_item(cls, item: Dict[str, Any]) -> 'Segment':
+        segment = Segment(item[Constants.SEGMENT_ID], [item[Constants.GEOHASH]], item[Constants.LAYER_ID])
+        segment.load_stats_item(item)
+        segment.min_lat = decode_float(item[Constants.MIN_LATITUDE])
+        segment.min_lng = decode_float(item[Constants.MIN_LONGITUDE])
+        segment.max_lat = decode_float(item[Constants.MAX_LATITUDE])
+        segment.max_lng = decode_float(item[Constants.MAX_LONGITUDE])
+
+        return segment
+
+    def add(self, reading: Dict[str, Any]) -> None:
+        super().add(reading)
+        self.geohashes.add(reading[Constants.GEOHASH])
+
+        data = reading[Constants.READING]
+        self.__extend(
+            float(data[Constants.LATITUDE]),
+            float(data[Constants.LONGITUDE]),
+            float(data[Constants.LATITUDE]),
+            float(data[Constants.LONGITUDE]),
+        )
+
+    def merge(self, other: 'Segment') -> None:
+        super().merge(other)
+        self.geohashes.update(other.geohashes)
+
+        if other.reading_count > 0:
+            self.__extend(other.min_lat, other.min_lng, other.max_lat, other.max_lng)
+
+    def item_data(self, layer_id: str) -> Dict[str, Any]:
+        if len(self.geohashes) != 1:
+            raise ValueError(f'only segments covering a single geohash can be stored, segment {self.id} covers {self.geohashes}')
+
+        geohash = next(iter(self.geohashes))
+
+        return {
+            Constants.PARTITION_KEY: segment_partition_key(layer_id, geohash),
+            Constants.SORT_KEY: self.id,
+            Constants.SEGMENT_ID: self.id,
+            Constants.LAYER_ID: layer_id,
+            Constants.GEOHASH: geohash,
+            **self.stats_item_data(),
+            Constants.MIN_LATITUDE: encode_as_float(self.min_lat),
+            Constants.MIN_LONGITUDE: encode_as_float(self.min_lng),
+            Constants.MAX_LATITUDE: encode_as_float(self.max_lat),
+            Constants.MAX_LONGITUDE: encode_as_float(self.max_lng),
+        }
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            Constants.SEGMENT_ID: self.id,
+            Constants.ROUTE_HASHES: sorted(self.geohashes),
+            **self.stats_json(),
+            Constants.MIN_LATITUDE: self.min_lat,
+            Constants.MIN_LONGITUDE: self.min_lng,
+            Constants.MAX_LATITUDE: self.max_lat,
+            Constants.MAX_LONGITUDE: self.max_lng,
+        }
+
+    def __extend(self, min_lat: float, min_lng: float, max_lat: float, max_lng: float) -> None:
+        self.min_lat = min_lat if self.min_lat is None else min(self.min_lat, min_lat)
+        self.min_lng = min_lng if self.min_lng is None else min(self.min_lng, min_lng)
+        self.max_lat = max_lat if self.max_lat is None else max(self.max_lat, max_lat)
+        self.max_lng = max_lng if self.max_lng is None else max(self.max_lng, max_lng)
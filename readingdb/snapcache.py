@@ -0,0 +1,208 @@
+import math
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from readingdb.clean import decode_float, encode_as_float
+from readingdb.constants import *
+from readingdb.roadpoint import RoadPoint
+
+def snap_cache_partition_key(key: str) -> str:
+    return f'{Constants.SNAP_CACHE_PK}#{key}'
+
+class SnapCache():
+    '''Remembers what the Roads API snapped each GPS point to, so that
+    roads which are driven again and again are only paid for once.
+    Points are keyed by their latitude and longitude rounded down to
+    decimals places plus the direction of travel (one of
+    heading_sectors), so that points on either side of a divided road
+    are kept apart. Each entry holds the point's snapped location and
+    placeId, along with any points the API interpolated between it and
+    the next point, and expires ttl seconds after it was written.
+
+    Snapping depends on the points around each point, so a window of
+    points is only served from the cache when every one of its points
+    is cached. A window that leaves a cell and comes back to it has two
+    different snaps for the same key, so such keys are never cached and
+    such windows are never served. Entries are kept in the org table of
+    db, or in memory if no db is given.
+    '''
+
+    DAY_SECONDS = 24 * 60 * 60
+
+    def __init__(
+        self,
+        db=None,
+        ttl: float = 30 * DAY_SECONDS,
+        decimals: int = 4,
+        heading_sectors: int = 8,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.db = db
+        self.ttl = ttl
+        self.decimals = decimals
+        self.heading_sectors = heading_sectors
+        self.clock = clock
+
+        self.windows = 0
+        self.window_hits = 0
+        self.points = 0
+        self.point_hits = 0
+        self.__entries: Dict[str, Dict[str, Any]] = {}
+
+    def keys(self, path: List[Tuple[float, float]]) -> List[str]:
+        '''Returns the cache key of each (lat, lng) in path. The direction
+        of travel at each point is taken from the points either side of
+        it.
+        '''
+
+        scale = 10 ** self.decimals
+        keys = []
+        for i, (lat, lng) in enumerate(path):
+            prev_lat, prev_lng = path[max(i - 1, 0)]
+            next_lat, next_lng = path[min(i + 1, len(path) - 1)]
+            heading = self.__heading_sector(prev_lat, prev_lng, next_lat, next_lng)
+            keys.append(f'{math.floor(lat * scale)}:{math.floor(lng * scale)}:{heading}')
+
+        return keys
+
+    def get(self, windows: List[List[str]]) -> List[Optional[List[Dict[str, Any]]]]:
+        '''Returns, for each window of keys, the points snap_to_roads
+        would return for it if every key is cached, or None.
+        '''
+
+        wanted = sorted(set(key for keys in windows for key in keys))
+        if self.db is None:
+            items = [self.__entries[key] for key in wanted if key in self.__entries]
+        else:
+            items = self.db.get_snap_cache_items(wanted)
+
+        now = self.clock()
+        entries = {
+            item[Constants.SNAP_KEY]: [self.__decode_point(p) for p in item[Constants.SNAPPED_POINTS]]
+            for item in items if item[Constants.EXPIRES_AT] > now
+        }
+
+        snapped = []
+        for keys in windows:
+            hits = sum(1 for key in keys if key in entries)
+            self.windows += 1
+            self.points += len(keys)
+            self.point_hits += hits
+
+            if hits < len(keys) or len(self.__revisited(keys)) > 0:
+                snapped.append(None)
+                continue
+
+            self.window_hits += 1
+            points = []
+            for i, key in enumerate(keys):
+                for p in entries[key]:
+                    if RoadPoint.Idx in p:
+                        points.append({**p, RoadPoint.Idx: i})
+                    # Interpolated points lead on to the next cell, so a
+                    # run of points in the same cell only needs them once.
+                    elif i + 1 == len(keys) or keys[i + 1] != key:
+                        points.append(p)
+            snapped.append(points)
+
+        return snapped
+
+    def put(self, keys: List[str], snapped: List[Dict[str, Any]]) -> int:
+        '''Caches the points snap_to_roads returned for the points with
+        the given keys. Returns the number of entries written.
+        '''
+
+        # Points interpolated before the first of the window's own points
+        # lead on from a point outside the window, which the window 
+        # before this one covers, so they are not cached.
+        owned = [[] for _ in keys]
+        owner = None
+        for p in snapped:
+            if RoadPoint.Idx in p:
+                owner = p[RoadPoint.Idx]
+                p = {**p, RoadPoint.Idx: 0}
+            if owner is not None:
+                owned[owner].append(p)
+
+        # A run of points in the same cell is cached as its last point, 
+        # which owns the points interpolated on to the next cell.
+        revisited = self.__revisited(keys)
+        expires_at = int(self.clock() + self.ttl)
+        items = [
+            self.item_data(key, points, expires_at) 
+            for key, points in dict(zip(keys, owned)).items() 
+            if key not in revisited
+        ]
+
+        if self.db is None:
+            self.__entries.update({item[Constants.SNAP_KEY]: item for item in items})
+        else:
+            self.db.put_snap_cache_items(items)
+
+        return len(items)
+
+    def item_data(self, key: str, points: List[Dict[str, Any]], expires_at: int) -> Dict[str, Any]:
+        return {
+            Constants.PARTITION_KEY: snap_cache_partition_key(key),
+            Constants.SORT_KEY: key,
+            Constants.SNAP_KEY: key,
+            Constants.SNAPPED_POINTS: [self.__encode_point(p) for p in points],
+            Constants.EXPIRES_AT: expires_at,
+        }
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            'windows': self.windows,
+            'window_hits': self.window_hits,
+            'hit_rate': self.window_hits / self.windows if self.windows > 0 else 0.0,
+            'points': self.points,
+            'point_hits': self.point_hits,
+            'point_hit_rate': self.point_hits / self.points if self.points > 0 else 0.0,
+        }
+
+    def __revisited(self, keys: List[str]) -> Set[str]:
+        '''Returns the keys that appear in more than one run of keys.'''
+
+        seen = set()
+        revisited = set()
+        for i, key in enumerate(keys):
+            if i > 0 and keys[i - 1] == key:
+                continue
+            if key in seen:
+                revisited.add(key)
+            seen.add(key)
+
+        return revisited
+
+    def __heading_sector(self, lat1: float, lng1: float, lat2: float, lng2: float) -> str:
+        d_lat = lat2 - lat1
+        d_lng = (lng2 - lng1) * math.cos(math.radians(lat1))
+        if d_lat == 0 and d_lng == 0:
+            return '-'
+
+        width = 360 / self.heading_sectors
+        bearing = math.degrees(math.atan2(d_lng, d_lat)) % 360
+
+        return str(int(((bearing + width / 2) % 360) // width))
+
+    def __encode_point(self, p: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            **p,
+            RoadPoint.Location: {
+                RoadPoint.Latitude: encode_as_float(p[RoadPoint.Location][RoadPoint.Latitude]),
+                RoadPoint.Longitude: encode_as_float(p[RoadPoint.Location][RoadPoint.Longitude]),
+            },
+        }
+
+    def __decode_point(self, p: Dict[str, Any]) -> Dict[str, Any]:
+        decoded = {
+            **p,
+            RoadPoint.Location: {
+                RoadPoint.Latitude: decode_float(p[RoadPoint.Location][RoadPoint.Latitude]),
+                RoadPoint.Longitude: decode_float(p[RoadPoint.Location][RoadPoint.Longitude]),
+            },
+        }
+        if RoadPoint.Idx in decoded:
+            decoded[RoadPoint.Idx] = int(decoded[RoadPoint.Idx])
+
+        return decoded
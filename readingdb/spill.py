@@ -0,0 +1,156 @@
+import json
+from typing import Any, Dict, Iterable, Iterator, List
+
+def json_list_chunks(items: Iterable[Any]) -> Iterator[bytes]:
+    '''Encodes a list as JSON one element at a time. Joining the chunks
+    gives exactly the same bytes as json.dumps(list(items)).encode().
+    '''
+
+    yield b'['
+    separator = b''
+    for item in items:
+        yield separator + json.dumps(item).encode('utf-8')
+        separator = b', '
+    yield b']'
+
+class SpillWriter():
+    '''Binary writer that keeps everything written to it in memory until
+    more than size_limit bytes have been written. After that the output
+    is streamed to bucket/key in S3 as a multipart upload and at most
+    roughly part_size bytes are held in memory at once.
+
+    Use it as a context manager: leaving the block completes the upload
+    (or aborts it if an exception was raised).
+    '''
+
+    MIN_PART_SIZE = 5 * 1024 * 1024
+
+    def __init__(
+        self,
+        s3_client,
+        bucket: str,
+        key: str,
+        size_limit: int,
+        part_size: int = 8 * 1024 * 1024,
+        content_type: str = 'application/json',
+        content_encoding: str = None,
+    ) -> None:
+        if part_size < self.MIN_PART_SIZE:
+            raise ValueError(f'part_size must be at least {self.MIN_PART_SIZE} bytes, got {part_size}')
+
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.size_limit = size_limit
+        self.part_size = part_size
+        self.content_type = content_type
+        self.content_encoding = content_encoding
+
+        self.size = 0
+        self.spilled = False
+        self.closed = False
+        self.__buffer = bytearray()
+        self.__upload_id = None
+        self.__parts: List[Dict[str, Any]] = []
+
+    def __enter__(self) -> 'SpillWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:
+        if self.closed:
+            raise ValueError('write to closed SpillWriter')
+
+        self.__buffer += data
+        self.size += len(data)
+
+        if not self.spilled and self.size > self.size_limit:
+            self.spilled = True
+
+        if self.spilled:
+            while len(self.__buffer) >= self.part_size:
+                self.__upload_part(bytes(self.__buffer[:self.part_size]))
+                del self.__buffer[:self.part_size]
+
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def getvalue(self) -> bytes:
+        if self.spilled:
+            raise ValueError(f'output was spilled to s3://{self.bucket}/{self.key}')
+
+        return bytes(self.__buffer)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+
+        if not self.spilled:
+            return
+
+        if self.__upload_id is None:
+            self.s3_client.put_object(
+                Body=bytes(self.__buffer),
+                Bucket=self.bucket,
+                Key=self.key,
+                **self.__object_args()
+            )
+        else:
+            if len(self.__buffer) > 0:
+                self.__upload_part(bytes(self.__buffer))
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.__upload_id,
+                MultipartUpload={'Parts': self.__parts},
+            )
+
+        self.__buffer = bytearray()
+
+    def abort(self) -> None:
+        self.closed = True
+        self.__buffer = bytearray()
+
+        if self.__upload_id is not None:
+            self.s3_client.abort_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.__upload_id,
+            )
+            self.__upload_id = None
+
+    def __object_args(self) -> Dict[str, str]:
+        args = {'ContentType': self.content_type}
+        if self.content_encoding is not None:
+            args['ContentEncoding'] = self.content_encoding
+
+        return args
+
+    def __upload_part(self, body: bytes) -> None:
+        if self.__upload_id is None:
+            self.__upload_id = self.s3_client.create_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                **self.__object_args()
+            )['UploadId']
+
+        part_number = len(self.__parts) + 1
+        resp = self.s3_client.upload_part(
+            Body=body,
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.__upload_id,
+            PartNumber=part_number,
+        )
+        self.__parts.append({'ETag': resp['ETag'], 'PartNumber': part_number})
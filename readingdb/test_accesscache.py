@@ -0,0 +1,63 @@
+import unittest
+
+from readingdb.accesscache import AccessCache
+
+class TestAccessCache(unittest.TestCase):
+    def setUp(self):
+        self.now = [100.0]
+        self.cache = AccessCache(ttl=10, clock=lambda: self.now[0])
+
+    def test_expires_entries(self):
+        self.cache.set_user_groups('user-1', ['group-1'])
+        self.cache.set_group_layers('group-1', ['layer-1', 'layer-2'])
+
+        self.now[0] += 9
+        self.assertEqual(['group-1'], self.cache.user_groups('user-1'))
+        self.assertEqual(['layer-1', 'layer-2'], self.cache.group_layers('group-1'))
+
+        self.now[0] += 1
+        self.assertIsNone(self.cache.user_groups('user-1'))
+        self.assertIsNone(self.cache.group_layers('group-1'))
+        self.assertEqual(0, len(self.cache))
+
+    def test_invalidates_entries(self):
+        self.cache.set_user_groups('user-1', ['group-1'])
+        self.cache.set_user_groups('user-2', ['group-1'])
+        self.cache.set_group_layers('group-1', ['layer-1'])
+
+        self.cache.invalidate_user('user-1')
+        self.assertIsNone(self.cache.user_groups('user-1'))
+        self.assertEqual(['group-1'], self.cache.user_groups('user-2'))
+
+        self.cache.invalidate_group('group-1')
+        self.assertIsNone(self.cache.group_layers('group-1'))
+
+        self.cache.clear()
+        self.assertIsNone(self.cache.user_groups('user-2'))
+
+    def test_returns_copies(self):
+        groups = ['group-1']
+        self.cache.set_user_groups('user-1', groups)
+        groups.append('group-2')
+        self.cache.user_groups('user-1').append('group-3')
+
+        self.assertEqual(['group-1'], self.cache.user_groups('user-1'))
+
+    def test_stays_bounded(self):
+        cache = AccessCache(ttl=10, max_entries=3, clock=lambda: self.now[0])
+        for i in range(3):
+            cache.set_user_groups(f'user-{i}', [])
+
+        self.now[0] += 20
+        cache.set_user_groups('user-3', [])
+        self.assertEqual(1, len(cache))
+
+        for i in range(4, 8):
+            cache.set_user_groups(f'user-{i}', [])
+        self.assertLessEqual(len(cache), 3)
+        self.assertEqual([], cache.user_groups('user-7'))
+
+    def test_disabled_with_no_ttl(self):
+        cache = AccessCache(ttl=0)
+        cache.set_user_groups('user-1', ['group-1'])
+        self.assertIsNone(cache.user_groups('user-1'))
@@ -1,3 +1,6 @@
+from collections import defaultdict
+import base64
+import gzip
 import json
 import os
 from pathlib import Path
@@ -7,6 +10,7 @@ from readingdb.reading import Reading, get_geohash, json_to_reading
 import uuid
 from readingdb.endpoints import TEST_BUCKET, TEST_DYNAMO_ENDPOINT
 from readingdb.route import Route
+from readingdb.s3uri import S3Uri
 from readingdb.constants import *
 from readingdb.routestatus import RouteStatus
 from readingdb.constants import Constants
@@ -138,6 +142,45 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(uri['Bucket'], self.tmp_bucket)
         self.assertEqual(uri['Key'], 'kingofkings.json')
 
+    def test_compresses_route_readings(self):
+        route_id = '103'
+        group_id = '9a9a9a9a'
+        
+        with open(self.current_dir + '/test_data/sydney_entries.json', 'r') as f:
+            entities = json.load(f)
+
+        geohashes = set()
+        finalized = []
+        for e in entities[:60]:
+            e[Constants.READING_ID] = str(uuid.uuid1())
+            e[Constants.ROUTE_ID] = route_id
+            r: Reading = json_to_reading('PredictionReading', e)
+            finalized.append(r)
+            geohashes.add(r.geohash)
+
+        self.api.put_route(Route('3', group_id, route_id, 123617823, geohashes=geohashes))
+        self.api.put_readings(finalized)
+
+        readings = self.api.all_route_readings(route_id)
+        compressed = self.api.all_route_readings(route_id, compress=True)
+        self.assertEqual(Constants.GZIP, compressed[Constants.CONTENT_ENCODING])
+        data = base64.b64decode(compressed[Constants.COMPRESSED_DATA])
+        self.assertEqual(readings, json.loads(gzip.decompress(data)))
+        self.assertLess(len(compressed[Constants.COMPRESSED_DATA]), len(json.dumps(readings)) / 3)
+
+        self.api.size_limit = 400
+        uri = self.api.all_route_readings(route_id, key='kingofkings.json.gz', compress=True)
+        self.assertEqual(uri[Constants.BUCKET], self.tmp_bucket)
+        self.assertEqual(uri[Constants.KEY], 'kingofkings.json.gz')
+        self.assertEqual(uri[Constants.CONTENT_ENCODING], Constants.GZIP)
+
+        obj = boto3.client('s3', region_name=self.region_name).get_object(
+            Bucket=self.tmp_bucket, 
+            Key='kingofkings.json.gz'
+        )
+        self.assertEqual(Constants.GZIP, obj['ContentEncoding'])
+        self.assertEqual(readings, json.loads(gzip.decompress(obj['Body'].read())))
+
     def test_can_return_readings_via_geohash(self):
         route_id = '103'
         group_id = 'a9a9a9a9'
@@ -197,6 +240,236 @@ class TestAPI(unittest.TestCase):
         with self.assertRaises(TypeError):
             self.api.get_geohash_readings_by_user(1,user_id)
 
+    def test_aggregates_segments(self):
+        group_id = 'a9a9a9a9'
+        user_id = 'a9a9a9a9s99ss'
+        layer_id = 'a9a99aa9aa9a99a'
+
+        with open(self.current_dir + '/test_data/sydney_route_very_short.json', 'r') as j:
+            route_spec = RouteSpec.from_json(json.load(j))
+        with open(self.current_dir + '/test_data/sydney_entries_very_short.json', 'r') as f:
+            entries = json.load(f)
+
+        route = self.api.save_route(route_spec, user_id, group_id, layer_id)
+        self.assertEqual(0, len(self.api.segments_by_user(['r3gqu8', 'r3gqu2'], user_id)))
+
+        org_name = "aws"
+        self.api.put_org(org_name)
+        self.api.put_user(org_name, user_id)
+        self.api.user_add_group(user_id, group_id)
+        self.api.group_add_layer(group_id, layer_id)
+
+        # segments are counted per geohash, so each image is counted once
+        # in every geohash it has a prediction in.
+        n_images = len(set([
+            (get_geohash(e[Constants.READING][Constants.LATITUDE], e[Constants.READING][Constants.LONGITUDE]), e[Constants.READING][Constants.FILENAME])
+            for e in entries
+        ]))
+        segments = self.api.segments_by_user(['r3gqu8', 'r3gqu2'], user_id)
+        self.assertEqual(['Geohash#r3gqu2', 'Geohash#r3gqu8'], [s[Constants.SEGMENT_ID] for s in segments])
+        self.assertEqual(n_images, sum([s[Constants.READING_COUNT] for s in segments]))
+        self.assertEqual({'LatCrack': 1, 'Pothole': 1, 'CrocodileCrack': 1}, segments[1][Constants.ENTITY_COUNTS])
+
+        filename_counts = defaultdict(int)
+        for e in entries:
+            filename_counts[e[Constants.READING][Constants.FILENAME]] += 1
+        snapped = [e for e in entries if filename_counts[e[Constants.READING][Constants.FILENAME]] == 1][:5]
+        for e in snapped:
+            e[Constants.READING][Constants.PLACE_ID] = 'place-x'
+        self.api.save_predictions(snapped, route.id, user_id, layer_id=layer_id)
+
+        segments = self.api.segments_by_user(['r3gqu8', 'r3gqu2'], user_id)
+        self.assertEqual('place-x', segments[-1][Constants.SEGMENT_ID])
+        self.assertEqual(5, segments[-1][Constants.READING_COUNT])
+        self.assertEqual(n_images, sum([s[Constants.READING_COUNT] for s in segments]))
+
+        self.assertEqual(1, len(self.api.segments_by_user('r3gqu2', user_id)))
+        self.assertEqual(0, len(self.api.segments_by_user('r3gqu8', '2e2ee2mm')))
+
+        with self.assertRaises(ValueError):
+            self.api.segments_by_user([], user_id)
+        with self.assertRaises(TypeError):
+            self.api.segments_by_user(1, user_id)
+
+    def test_deleting_route_updates_segments(self):
+        group_id = 'a9a9a9a9'
+        user_id = 'a9a9a9a9s99ss'
+        layer_id = 'a9a99aa9aa9a99a'
+
+        self.api.put_org('aws')
+        self.api.put_user('aws', user_id)
+        self.api.user_add_group(user_id, group_id)
+        self.api.group_add_layer(group_id, layer_id)
+
+        with open(self.current_dir + '/test_data/sydney_route_very_short.json', 'r') as j:
+            route_spec = RouteSpec.from_json(json.load(j))
+        route = self.api.save_route(route_spec, user_id, group_id, layer_id)
+        segments = self.api.segments_by_user(['r3gqu8', 'r3gqu2'], user_id)
+        n_readings = sum([s[Constants.READING_COUNT] for s in segments])
+
+        self.assertGreater(n_readings, 0)
+
+        # Segments count each image once, so a second route over the same
+        # images leaves the counts as they are.
+        other_route = self.api.save_route(route_spec, user_id, group_id, layer_id)
+
+        self.api.delete_route(route.id)
+        segments = self.api.segments_by_user(['r3gqu8', 'r3gqu2'], user_id)
+        self.assertEqual(2, len(segments))
+        self.assertEqual(n_readings, sum([s[Constants.READING_COUNT] for s in segments]))
+
+        self.api.delete_route(other_route.id)
+        self.assertEqual(0, len(self.api.segments_by_user(['r3gqu8', 'r3gqu2'], user_id)))
+        self.assertEqual(0, len(self.api.readings_for_layer_id(layer_id)))
+
+    def test_returns_tiles_in_viewport(self):
+        group_id = 'a9a9a9a9'
+        user_id = 'a9a9a9a9s99ss'
+        layer_id = 'a9a99aa9aa9a99a'
+
+        self.api.put_org('aws')
+        self.api.put_user('aws', user_id)
+        self.api.user_add_group(user_id, group_id)
+        self.api.group_add_layer(group_id, layer_id)
+
+        with open(self.current_dir + '/test_data/sydney_route_very_short.json', 'r') as j:
+            route_spec = RouteSpec.from_json(json.load(j))
+        self.api.save_route(route_spec, user_id, group_id, layer_id)
+
+        readings = self.api.geohash_readings('r3gqu8', Constants.PREDICTION) + \
+            self.api.geohash_readings('r3gqu2', Constants.PREDICTION)
+        lats = [r[Constants.READING][Constants.LATITUDE] for r in readings]
+        lngs = [r[Constants.READING][Constants.LONGITUDE] for r in readings]
+        bounds = (min(lats), min(lngs), max(lats), max(lngs))
+
+        tiles = self.api.tiles_in_bbox(*bounds, 6, user_id)
+        self.assertEqual(['r3gqu2', 'r3gqu8'], [t[Constants.GEOHASH] for t in tiles])
+
+        tiles = self.api.tiles_in_bbox(*bounds, 3, user_id)
+        self.assertEqual(['r3g'], [t[Constants.GEOHASH] for t in tiles])
+        self.assertEqual(
+            sum([t[Constants.READING_COUNT] for t in self.api.tiles_in_bbox(*bounds, 6, user_id)]), 
+            tiles[0][Constants.READING_COUNT]
+        )
+        self.assertEqual(1, tiles[0][Constants.ENTITY_COUNTS]['Pothole'])
+
+        self.assertEqual(0, len(self.api.tiles_in_bbox(10, 10, 11, 11, 4, user_id)))
+
+        with self.assertRaises(ValueError):
+            self.api.tiles_in_bbox(*bounds, 7, user_id)
+        with self.assertRaises(ValueError):
+            self.api.tiles_in_bbox(-40, 140, -30, 155, 6, user_id)
+        with self.assertRaises(TypeError):
+            self.api.tiles_in_bbox(*bounds, '6', user_id)
+
+    def test_hides_tiles_from_other_orgs(self):
+        self.api.put_org('aws')
+        self.api.put_user('aws', 'a9a9a9a9s99ss')
+        self.api.user_add_group('a9a9a9a9s99ss', 'a9a9a9a9')
+        self.api.group_add_layer('a9a9a9a9', 'a9a99aa9aa9a99a')
+
+        self.api.put_org('gcp')
+        self.api.put_user('gcp', 'b8b8b8b8s88ss')
+        self.api.user_add_group('b8b8b8b8s88ss', 'b8b8b8b8')
+        self.api.group_add_layer('b8b8b8b8', 'b8b88bb8bb8b88b')
+
+        with open(self.current_dir + '/test_data/sydney_route_very_short.json', 'r') as j:
+            route_spec = RouteSpec.from_json(json.load(j))
+        self.api.save_route(route_spec, 'a9a9a9a9s99ss', 'a9a9a9a9', 'a9a99aa9aa9a99a')
+
+        bounds = (-34.0, 151.0, -33.8, 151.3)
+        self.assertEqual(['r3g'], [t[Constants.GEOHASH] for t in self.api.tiles_in_bbox(*bounds, 3, 'a9a9a9a9s99ss')])
+        self.assertEqual(0, len(self.api.tiles_in_bbox(*bounds, 3, 'b8b8b8b8s88ss')))
+        self.assertEqual(0, len(self.api.tiles_in_bbox(*bounds, 3, 'unknown-user')))
+
+    def test_returns_aggregates_per_layer(self):
+        group_id = 'a9a9a9a9'
+        user_id = 'a9a9a9a9s99ss'
+        layer_id = 'a9a99aa9aa9a99a'
+        curated_layer_id = 'c7c77cc7cc7c77c'
+
+        self.api.put_org('aws')
+        self.api.put_user('aws', user_id)
+        self.api.user_add_group(user_id, group_id)
+        self.api.group_add_layer(group_id, layer_id)
+        self.api.group_add_layer(group_id, curated_layer_id)
+
+        with open(self.current_dir + '/test_data/sydney_route_very_short.json', 'r') as j:
+            route_spec = RouteSpec.from_json(json.load(j))
+        self.api.save_route(route_spec, user_id, group_id, layer_id)
+
+        readings = self.api.geohash_readings('r3gqu8', Constants.PREDICTION) + \
+            self.api.geohash_readings('r3gqu2', Constants.PREDICTION)
+        self.api.add_readings_to_layer(curated_layer_id, readings)
+
+        segments = self.api.segments_by_user(['r3gqu8', 'r3gqu2'], user_id)
+        self.assertEqual(
+            [
+                ('Geohash#r3gqu2', layer_id), ('Geohash#r3gqu2', curated_layer_id),
+                ('Geohash#r3gqu8', layer_id), ('Geohash#r3gqu8', curated_layer_id),
+            ],
+            [(s[Constants.SEGMENT_ID], s[Constants.LAYER_ID]) for s in segments]
+        )
+        for layer in [layer_id, curated_layer_id]:
+            self.assertEqual(
+                [s[Constants.READING_COUNT] for s in segments if s[Constants.LAYER_ID] == layer_id],
+                [s[Constants.READING_COUNT] for s in segments if s[Constants.LAYER_ID] == layer],
+            )
+
+        bounds = (-34.0, 151.0, -33.8, 151.3)
+        tiles = self.api.tiles_in_bbox(*bounds, 3, user_id)
+        self.assertEqual([('r3g', layer_id), ('r3g', curated_layer_id)], [(t[Constants.GEOHASH], t[Constants.LAYER_ID]) for t in tiles])
+        self.assertEqual(tiles[0][Constants.READING_COUNT], tiles[1][Constants.READING_COUNT])
+        self.assertEqual(tiles[0][Constants.ENTITY_COUNTS], tiles[1][Constants.ENTITY_COUNTS])
+
+    def test_returns_readings_in_bbox(self):
+        group_id = 'a9a9a9a9'
+        user_id = 'a9a9a9a9s99ss'
+        layer_id = 'a9a99aa9aa9a99a'
+
+        with open(self.current_dir + '/test_data/sydney_route_very_short.json', 'r') as j:
+            route_spec_data = json.load(j)
+
+        route_spec = RouteSpec.from_json(route_spec_data)
+        self.api.save_route(route_spec, user_id, group_id, layer_id)
+
+        org_name = "aws"
+        self.api.put_org(org_name)
+        self.api.put_user(org_name, user_id)
+        self.api.user_add_group(user_id, group_id)
+        self.api.group_add_layer(group_id, layer_id)
+
+        all_readings = self.api.get_geohash_readings_by_user(['r3gqu2', 'r3gqu8'], user_id)
+        lats = sorted(float(r[Constants.READING][Constants.LATITUDE]) for r in all_readings)
+        lngs = sorted(float(r[Constants.READING][Constants.LONGITUDE]) for r in all_readings)
+
+        readings = self.api.readings_in_bbox(lats[0], lngs[0], lats[-1], lngs[-1], user_id)
+        self.assertEqual(
+            sorted(r[Constants.READING_ID] for r in all_readings),
+            sorted(r[Constants.READING_ID] for r in readings),
+        )
+        self.assertIn(Constants.PRESIGNED_URL, readings[0][Constants.READING])
+
+        mid_lat = lats[len(lats) // 2]
+        expected = [
+            r[Constants.READING_ID] for r in all_readings 
+            if float(r[Constants.READING][Constants.LATITUDE]) <= mid_lat
+        ]
+        readings = self.api.readings_in_bbox(lats[0], lngs[0], mid_lat, lngs[-1], user_id)
+        self.assertGreater(len(readings), 0)
+        self.assertLess(len(readings), len(all_readings))
+        self.assertEqual(sorted(expected), sorted(r[Constants.READING_ID] for r in readings))
+
+        readings = self.api.readings_in_bbox(lats[0], lngs[0], lats[-1], lngs[-1], '2e2ee2mm')
+        self.assertEqual(0, len(readings))
+
+        with self.assertRaises(ValueError):
+            self.api.readings_in_bbox(lats[-1], lngs[0], lats[0], lngs[-1], user_id)
+        with self.assertRaises(ValueError):
+            self.api.readings_in_bbox(-34, 150, -33, 152, user_id)
+        with self.assertRaises(TypeError):
+            self.api.readings_in_bbox('-34', 150, -33, 152, user_id)
+
     # -----------------------------------------------------------------
     # -----------------------------------------------------------------
     # -----------------------------------------------------------------
@@ -249,6 +522,45 @@ class TestAPI(unittest.TestCase):
         route = api.save_route(route_spec, user_id, group_id2, layer_id)
         self.assertFalse(api.can_access_route(user_id, route.id))
 
+    def test_access_context_loads_memberships_once(self):
+        user_id = 'aghsghavgas'
+        group_id = '10101010'
+        layer_id = 's9s9s9s9s9'
+        org_name = 'fds'
+        api = API(TEST_DYNAMO_ENDPOINT, bucket=self.bucket_name)
+
+        api.put_org(org_name)
+        api.put_user(org_name, user_id)
+        api.user_add_group(user_id, group_id)
+        api.group_add_layer(group_id, layer_id)
+
+        with open(self.current_dir + '/test_data/ftg_route.json', 'r') as j:
+            route_spec_data = json.load(j)
+        route = api.save_route(RouteSpec.from_json(route_spec_data), user_id, group_id, layer_id)
+
+        access = api.access_context(user_id)
+        with mock.patch.object(api.org_table, 'query', wraps=api.org_table.query) as query:
+            self.assertTrue(access.can_access_route(route.id))
+            self.assertEqual(route.id, api.get_route(route.id, access)[Constants.ROUTE_ID])
+            self.assertTrue(access.can_access_route(route.id))
+            self.assertEqual(set([layer_id]), set(access.layer_ids))
+            self.assertEqual(set([layer_id]), set(access.layer_ids))
+            self.assertEqual(4, query.call_count)
+
+            query.reset_mock()
+            self.assertTrue(api.access_context(user_id).can_access_route(route.id))
+            self.assertEqual(1, query.call_count)
+
+        self.assertEqual([route.id], [r[Constants.ROUTE_ID] for r in api.routes_for_user(user_id, access)])
+        self.assertEqual([route.id], [r[Constants.ROUTE_ID] for r in api.routes_for_user(user_id)])
+
+        api.group_add_layer(group_id, 'another-layer')
+        self.assertEqual(set([layer_id, 'another-layer']), set(api.access_context(user_id).layer_ids))
+
+        api.user_remove_group(user_id, group_id)
+        self.assertFalse(api.can_access_route(user_id, route.id))
+        self.assertEqual([], api.routes_for_user(user_id))
+
     def test_updates_route_name(self):
         user_id = 'aghsghavgas'
         group_id = '10101010'
@@ -714,6 +1026,20 @@ class TestAPI(unittest.TestCase):
             'mocks/route_1621394080578.zip'
         ]))
 
+    def test_only_streams_new_routes_when_asked(self):
+        def command():
+            overrides = ecs.run_task.call_args.kwargs['overrides']
+            return overrides['containerOverrides'][0]['command']
+
+        with mock.patch.object(self.api, 'ecs') as ecs:
+            ecs.run_task.return_value = {API.ECS_TASKS_KEY: [{}]}
+
+            self.api.save_new_route('uploads', 'route.zip', 'route name')
+            self.assertEqual(['python', 'farg.py', 'uploads', 'route.zip', self.api.region_name, 'route name'], command())
+
+            self.api.save_new_route('uploads', 'route.zip', 'route name', stream=True)
+            self.assertEqual('--stream', command()[-1])
+
     def test_deletes_route(self):
         org_name = 'fds'
         user_id = 'aghsghavgas'
@@ -789,6 +1115,40 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(0, len(api.all_route_readings(route3.id)))
         self.assertEqual(4, len(self.__get_bucket_objects(bucket)))
 
+    def test_batch_deletes_route_images(self):
+        route_id = 'big-route'
+        s3 = boto3.client('s3', region_name=self.region_name)
+        existing = s3.list_objects_v2(Bucket=self.bucket_name)['KeyCount']
+
+        readings = []
+        for i in range(1100):
+            key = f'{route_id}/img-{i % 1050}.jpg'
+            if i < 1050:
+                s3.put_object(Bucket=self.bucket_name, Key=key, Body=b'jpg')
+            readings.append(Reading(
+                f'reading-{i}',
+                route_id,
+                123617823,
+                Constants.PREDICTION,
+                -33.96788819,
+                151.0181246 + i * 0.0001,
+                f'img-{i % 1050}.jpg',
+                [],
+                123617823,
+                DEFAULT_ANNOTATOR_ID,
+                uri=S3Uri(self.bucket_name, key),
+            ))
+        self.api.put_readings(readings)
+        self.api.put_route(Route('3', 'group', route_id, 123617823))
+
+        with mock.patch.object(self.api.s3_client, 'delete_objects', wraps=self.api.s3_client.delete_objects) as delete:
+            self.assertEqual((1100, 1050), self.api.delete_route(route_id))
+            self.assertEqual(2, delete.call_count)
+
+        self.assertEqual(existing, s3.list_objects_v2(Bucket=self.bucket_name)['KeyCount'])
+        self.assertEqual(0, len(self.api.get_route_readings(route_id)))
+        self.assertIsNone(self.api.get_route(route_id))
+
     def __get_bucket_objects(self, bucket: str) -> List[str]:
         bucket_objects = []
         for my_bucket_object in bucket.objects.all():
@@ -0,0 +1,59 @@
+import random
+import unittest
+
+import pygeohash as pgh
+
+from readingdb.bbox import BBox
+from readingdb.constants import *
+
+class TestBBox(unittest.TestCase):
+    def test_covers_box_exactly(self):
+        rng = random.Random(7)
+        for _ in range(50):
+            lat = rng.uniform(-80, 80)
+            lng = rng.uniform(-170, 170)
+            box = BBox(lat, lng, lat + rng.uniform(0, 0.05), lng + rng.uniform(0, 0.05))
+            cover = box.geohash_cover()
+
+            self.assertEqual(len(cover), len(set(cover)))
+            self.assertEqual(box.cover_size(), len(cover))
+
+            for _ in range(200):
+                point_lat = rng.uniform(box.min_lat, box.max_lat)
+                point_lng = rng.uniform(box.min_lng, box.max_lng)
+                self.assertIn(pgh.encode(point_lat, point_lng, GEOHASH_PRECISION), cover)
+
+            for geohash in cover:
+                _, _, lat_err, lng_err = pgh.decode_exactly(geohash)
+                center_lat, center_lng = pgh.decode_exactly(geohash)[:2]
+                self.assertLessEqual(center_lat - lat_err, box.max_lat)
+                self.assertGreaterEqual(center_lat + lat_err, box.min_lat)
+                self.assertLessEqual(center_lng - lng_err, box.max_lng)
+                self.assertGreaterEqual(center_lng + lng_err, box.min_lng)
+
+    def test_covers_world(self):
+        box = BBox(-90, -180, 90, 180)
+        self.assertEqual(32, len(set(box.geohash_cover(1))))
+
+        point = BBox(-33.9678, 151.0181, -33.9678, 151.0181)
+        self.assertEqual([pgh.encode(-33.9678, 151.0181, GEOHASH_PRECISION)], point.geohash_cover())
+
+    def test_contains(self):
+        box = BBox(-34, 151, -33, 152)
+        self.assertTrue(box.contains(-34, 151))
+        self.assertTrue(box.contains(-33.5, 151.5))
+        self.assertFalse(box.contains(-32.9, 151.5))
+        self.assertTrue(box.contains_reading({Constants.READING: {
+            Constants.LATITUDE: '-33.2',
+            Constants.LONGITUDE: '151.1',
+        }}))
+
+    def test_validates_bounds(self):
+        with self.assertRaises(ValueError):
+            BBox(-33, 151, -34, 152)
+        with self.assertRaises(ValueError):
+            BBox(-34, 151, -33, 181)
+        with self.assertRaises(TypeError):
+            BBox('-34', 151, -33, 152)
+        with self.assertRaises(TypeError):
+            BBox(True, 151, -33, 152)
@@ -0,0 +1,42 @@
+import unittest
+
+from readingdb.checkpoint import Checkpoint, checkpoint_partition_key, ingest_route_id
+from readingdb.constants import *
+
+class TestCheckpoint(unittest.TestCase):
+    def test_derives_ids_from_source(self):
+        route_id = ingest_route_id('bucket', 'mocks/route_1', '"etag"')
+        self.assertEqual(route_id, ingest_route_id('bucket', 'mocks/route_1', '"etag"'))
+        self.assertNotEqual(route_id, ingest_route_id('bucket', 'mocks/route_1', '"other"'))
+        self.assertNotEqual(route_id, ingest_route_id('bucket', 'mocks/route_2', '"etag"'))
+        self.assertNotEqual(route_id, ingest_route_id('bucket', 'mocks/route_1'))
+
+        checkpoint = Checkpoint(route_id)
+        self.assertEqual(checkpoint.layer_id, Checkpoint(route_id).layer_id)
+        self.assertEqual(checkpoint.reading_id('route_1/a.jpg'), Checkpoint(route_id).reading_id('route_1/a.jpg'))
+        self.assertNotEqual(checkpoint.reading_id('route_1/a.jpg'), checkpoint.reading_id('route_1/b.jpg'))
+        self.assertNotEqual(checkpoint.reading_id('route_1/a.jpg'), Checkpoint(ingest_route_id('b', 'k')).reading_id('route_1/a.jpg'))
+
+    def test_round_trips(self):
+        route_id = ingest_route_id('bucket', 'mocks/route_1')
+        checkpoint = Checkpoint(route_id)
+        checkpoint.mark(Checkpoint.UPLOADED, ['route_1/a.jpg', 'route_1/b.jpg'])
+        checkpoint.mark(Checkpoint.WRITTEN, ['reading-a'])
+
+        items = [
+            checkpoint.item_data(stage, key)
+            for stage in Checkpoint.STAGES
+            for key in checkpoint.completed[stage]
+        ]
+        self.assertTrue(all(i[Constants.PARTITION_KEY] == checkpoint_partition_key(route_id) for i in items))
+        self.assertEqual(3, len(set(i[Constants.SORT_KEY] for i in items)))
+
+        restored = Checkpoint.from_items(route_id, items)
+        self.assertTrue(restored.is_done(Checkpoint.UPLOADED, 'route_1/b.jpg'))
+        self.assertFalse(restored.is_done(Checkpoint.WRITTEN, 'route_1/b.jpg'))
+        self.assertEqual(['reading-b'], restored.remaining(Checkpoint.WRITTEN, ['reading-a', 'reading-b']))
+        self.assertEqual(0, restored.count(Checkpoint.LINKED))
+
+    def test_rejects_unknown_stages(self):
+        with self.assertRaises(ValueError):
+            Checkpoint(ingest_route_id('bucket', 'key')).item_data('Unzipped', 'key')
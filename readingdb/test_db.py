@@ -9,9 +9,13 @@ import uuid
 from unittest import mock
 
 from readingdb.db import DB
+from readingdb.checkpoint import Checkpoint, ingest_route_id
+from readingdb.snapcache import SnapCache
 from readingdb.constants import *
-from readingdb.reading import Reading, json_to_reading
+from readingdb.reading import Reading, image_keys, json_to_reading
+from readingdb.s3uri import S3Uri
 from readingdb.route import Route
+import pygeohash as pgh
 
 class TestDB(unittest.TestCase):
     def setUp(self):
@@ -27,6 +31,22 @@ class TestDB(unittest.TestCase):
     def tearDown(self):
         self.__cleanup()
 
+    def __make_unindexed_reading_table(self):
+        # Reading tables created before the RouteID index was added
+        self.db.db.Table(Constants.READING_TABLE_NAME).delete()
+        self.db.db.create_table(
+            TableName=Constants.READING_TABLE_NAME,
+            KeySchema=[
+                {'AttributeName': Constants.PARTITION_KEY, 'KeyType': 'HASH'},
+                {'AttributeName': Constants.SORT_KEY, 'KeyType': 'RANGE'}
+            ],
+            AttributeDefinitions=[
+                {'AttributeName': Constants.PARTITION_KEY, 'AttributeType': 'S'},
+                {'AttributeName': Constants.SORT_KEY, 'AttributeType': 'S'},
+            ],
+            ProvisionedThroughput={'ReadCapacityUnits': 500, 'WriteCapacityUnits': 500}
+        )
+
     # -----------------------------------------------------------------
     # -----------------------------------------------------------------
     # -----------------------------------------------------------------
@@ -142,6 +162,420 @@ class TestDB(unittest.TestCase):
         readings = self.db.get_route_readings(route_id)
         self.assertEqual(3383, len(readings))
 
+    def test_streams_geohash_readings_across_pages(self):
+        route_id = '103'
+        layer_id = '919191919'
+
+        with open(self.current_dir +  '/test_data/sydney_entries.json', 'r') as f:
+            entities = json.load(f)
+
+        prediction_readings = []
+        for e in entities[:320]:
+            e[Constants.READING_ID] = str(uuid.uuid1())
+            e[Constants.ROUTE_ID] = route_id
+            prediction_readings.append(json_to_reading('PredictionReading', e))
+        self.db.put_readings(prediction_readings)
+
+        paginate = self.db.paginator.paginate
+        pages = []
+        def small_pages(**kwargs):
+            for page in paginate(PaginationConfig={'PageSize': 25}, **kwargs):
+                pages.append(page)
+                yield page
+
+        with mock.patch.object(self.db.paginator, 'paginate', side_effect=small_pages):
+            readings = self.db.geohash_readings('r3gqu8', Constants.PREDICTION)
+            self.assertEqual(288, len(readings))
+            self.assertEqual(12, len(pages))
+            self.assertIsInstance(readings[0][Constants.READING][Constants.LATITUDE], float)
+            self.assertIsInstance(readings[0][Constants.TIMESTAMP], int)
+
+            pages.clear()
+            first = next(self.db.iter_geohash_readings('r3gqu8', Constants.PREDICTION))
+            self.assertEqual('r3gqu8', first[Constants.GEOHASH])
+            self.assertEqual(1, len(pages))
+
+            r3gqu8_readings = [r for r in prediction_readings if r.geohash == 'r3gqu8']
+            pages.clear()
+            self.db.add_readings_to_layer(layer_id, [r.query_data() for r in r3gqu8_readings[:3]])
+            layer_readings = self.db.readings_for_layer_id(layer_id)
+            self.assertEqual(set([r.id for r in r3gqu8_readings[:3]]), set([r[Constants.READING_ID] for r in layer_readings]))
+            self.assertLess(len(pages), 12)
+
+    def test_finds_route_readings_by_image(self):
+        readings = []
+        for rid in ['route-a', 'route-b']:
+            for i in range(6):
+                readings.append(Reading(
+                    f'{rid}-{i}',
+                    rid,
+                    123617823,
+                    Constants.PREDICTION,
+                    -33.96788819,
+                    151.0181246,
+                    f'img-{i % 3}.jpg',
+                    [],
+                    123617823,
+                    DEFAULT_ANNOTATOR_ID,
+                    uri=S3Uri('somebucket', f'{rid}/img-{i}.jpg'),
+                ))
+        self.db.put_readings(readings)
+
+        found = self.db.readings_for_images('route-a', image_keys({Constants.READING: {Constants.FILENAME: 'img-1.jpg'}}))
+        self.assertEqual(['route-a-1', 'route-a-4'], [r[Constants.READING_ID] for r in found])
+        self.assertEqual(-33.96788819, found[0][Constants.READING][Constants.LATITUDE])
+
+        # Above IMAGE_QUERY_LIMIT keys the whole route's index is read in
+        # one query instead of a query per key.
+        many_keys = ['ImageFileName#img-1.jpg', 'ImageFileName#img-2.jpg', 'ImageFileName#missing.jpg']
+        per_key = self.db.readings_for_images('route-a', many_keys)
+        self.db.IMAGE_QUERY_LIMIT = 2
+        with mock.patch.object(self.db.fan_out, 'map', side_effect=AssertionError('queried per key')):
+            self.assertEqual(per_key, self.db.readings_for_images('route-a', many_keys))
+        self.assertEqual(['route-a-1', 'route-a-2', 'route-a-4', 'route-a-5'], [r[Constants.READING_ID] for r in per_key])
+        self.db.IMAGE_QUERY_LIMIT = DB.IMAGE_QUERY_LIMIT
+
+        found = self.db.readings_for_images('route-b', image_keys({Constants.READING: {
+            Constants.URI: {Constants.BUCKET: 'somebucket', Constants.KEY: 'route-b/img-5.jpg'}
+        }}))
+        self.assertEqual(['route-b-5'], [r[Constants.READING_ID] for r in found])
+        self.assertEqual(0, len(self.db.readings_for_images('route-b', ['ImageFileName#missing.jpg'])))
+
+        self.db.delete_reading_items(found)
+        self.assertEqual(['route-b-2'], [r[Constants.READING_ID] for r in self.db.readings_for_images(
+            'route-b',
+            image_keys(found[0])
+        )])
+        index_items = [
+            item for item in self.db.org_table.scan()[DB.ITEM_KEY] 
+            if item[Constants.PARTITION_KEY].startswith(Constants.IMAGE_READING_PK)
+        ]
+        self.assertEqual(22, len(index_items))
+
+        for item in index_items:
+            self.db.org_table.delete_item(Key={
+                Constants.PARTITION_KEY: item[Constants.PARTITION_KEY],
+                Constants.SORT_KEY: item[Constants.SORT_KEY],
+            })
+        self.assertEqual(0, len(self.db.readings_for_images('route-a', ['ImageFileName#img-1.jpg'])))
+        self.assertEqual(11, self.db.index_images(chunk_size=4))
+        self.assertEqual(2, len(self.db.readings_for_images('route-a', ['ImageFileName#img-1.jpg'])))
+
+    def test_batch_deletes_reading_items(self):
+        readings = [
+            Reading(
+                f'reading-{i}',
+                'route-a',
+                123617823,
+                Constants.PREDICTION,
+                -33.96788819 + i * 0.001,
+                151.0181246,
+                f'img-{i}.jpg',
+                [],
+                123617823,
+                DEFAULT_ANNOTATOR_ID,
+            ) for i in range(130)
+        ]
+        self.db.put_readings(readings)
+        items = self.db.get_route_readings('route-a')
+        self.assertEqual(130, len(items))
+
+        with mock.patch.object(self.db.client, 'batch_write_item', wraps=self.db.client.batch_write_item) as write:
+            self.assertEqual(130, self.db.delete_reading_items(items))
+            reading_writes = [
+                c for c in write.call_args_list 
+                if Constants.READING_TABLE_NAME in c.kwargs['RequestItems']
+            ]
+            self.assertEqual(6, len(reading_writes))
+
+        self.assertEqual(0, len(self.db.get_route_readings('route-a')))
+        self.assertEqual(0, len(self.db.org_table.scan()[DB.ITEM_KEY]))
+        self.assertEqual(0, self.db.delete_reading_items([]))
+
+    def test_maintains_tile_pyramid(self):
+        def reading(i, geohash, pothole, severity=1.0):
+            lat, lng = pgh.decode(geohash)
+            return Reading(
+                f'reading-{i}',
+                'route-a',
+                123617823,
+                Constants.PREDICTION,
+                lat,
+                lng,
+                f'img-{i}.jpg',
+                [Entity('Pothole', 0.5 + i / 100, pothole, severity)],
+                123617823,
+                DEFAULT_ANNOTATOR_ID,
+            )
+
+        readings = [
+            reading(0, 'r3gqu2', True, 2.0),
+            reading(1, 'r3gqu2', True, 4.0),
+            reading(2, 'r3gqu8', False),
+            reading(3, 'r3gqv0', True, 3.0),
+        ]
+        self.db.put_readings(readings)
+        self.db.put_layer('layer-a', [r.query_data() for r in readings])
+        self.db.put_layer('layer-b', [readings[0].query_data()])
+        self.assertEqual(3 + 2 + 1 + 1, self.db.update_tiles('layer-a', ['r3gqu2', 'r3gqu8', 'r3gqv0']))
+        self.assertEqual(4, self.db.update_tiles('layer-b', ['r3gqu2']))
+
+        tiles = {t.geohash: t.to_json() for t in self.db.tiles_for_layer_geohashes(['layer-a'], ['r3gqu2', 'r3gqu8', 'r3gqu', 'r3gq', 'r3g', 'r3gqu0'])}
+        self.assertEqual(['r3g', 'r3gq', 'r3gqu', 'r3gqu2', 'r3gqu8'], sorted(tiles))
+        self.assertEqual(2, tiles['r3gqu2'][Constants.ENTITY_COUNTS]['Pothole'])
+        self.assertEqual(0, tiles['r3gqu2'][Constants.ENTITY_COUNTS]['LatCrack'])
+        self.assertEqual(3.0, tiles['r3gqu2'][Constants.MEAN_SEVERITIES]['Pothole'])
+        self.assertEqual(3, tiles['r3gqu'][Constants.READING_COUNT])
+        self.assertEqual(0.52, tiles['r3gqu'][Constants.MAX_CONFIDENCES]['Pothole'])
+        self.assertEqual(4, tiles['r3gq'][Constants.READING_COUNT])
+        self.assertEqual(3, tiles['r3g'][Constants.ENTITY_COUNTS]['Pothole'])
+        self.assertEqual(3.0, tiles['r3g'][Constants.MEAN_SEVERITIES]['Pothole'])
+        self.assertEqual(0.53, tiles['r3g'][Constants.MAX_CONFIDENCES]['Pothole'])
+
+        tiles = self.db.tiles_for_layer_geohashes(['layer-b'], ['r3gqu2', 'r3gqu8', 'r3g'])
+        self.assertEqual([('r3g', 1), ('r3gqu2', 1)], sorted([(t.geohash, t.reading_count) for t in tiles]))
+        self.assertEqual(0, len(self.db.tiles_for_layer_geohashes(['layer-c'], ['r3gqu2', 'r3g'])))
+
+        self.db.remove_readings_from_layer('layer-a', [r.query_data() for r in readings[1::2]])
+
+        tiles = {t.geohash: t.to_json() for t in self.db.tiles_for_layer_geohashes(['layer-a'], ['r3gqu2', 'r3gqv0', 'r3gqu', 'r3g'])}
+        self.assertEqual(['r3g', 'r3gqu', 'r3gqu2'], sorted(tiles))
+        self.assertEqual(2.0, tiles['r3gqu2'][Constants.MEAN_SEVERITIES]['Pothole'])
+        self.assertEqual(0.52, tiles['r3g'][Constants.MAX_CONFIDENCES]['Pothole'])
+        self.assertEqual(2, tiles['r3g'][Constants.READING_COUNT])
+
+        self.db.remove_readings_from_layer('layer-a', [r.query_data() for r in readings[::2]])
+        self.assertEqual(0, len(self.db.tiles_for_layer_geohashes(['layer-a'], ['r3gqu2', 'r3gqu8', 'r3gqv0', 'r3gqu', 'r3gq', 'r3g'])))
+        self.assertEqual(2, len(self.db.tiles_for_layer_geohashes(['layer-b'], ['r3gqu2', 'r3g'])))
+
+        self.db.add_readings_to_layer('layer-a', [r.query_data() for r in readings])
+        for item in self.db.org_table.scan()[DB.ITEM_KEY]:
+            if item[Constants.PARTITION_KEY].startswith(Constants.TILE_PK):
+                self.db.org_table.delete_item(Key={
+                    Constants.PARTITION_KEY: item[Constants.PARTITION_KEY],
+                    Constants.SORT_KEY: item[Constants.SORT_KEY],
+                })
+        self.assertEqual(3 + 2 + 1 + 1 + 4, self.db.index_tiles())
+
+    def test_layer_changes_update_segments_and_tiles(self):
+        readings = []
+        for i, geohash in enumerate(['r3gqu2', 'r3gqu2', 'r3gqu8']):
+            lat, lng = pgh.decode(geohash)
+            readings.append(Reading(
+                f'reading-{i}', 'route-a', 123617823, Constants.PREDICTION, lat, lng, f'img-{i}.jpg',
+                [Entity('Pothole', 0.5, True, 1.0)], 123617823, DEFAULT_ANNOTATOR_ID,
+            ))
+        self.db.put_readings(readings)
+        geohashes = ['r3gqu2', 'r3gqu8']
+
+        def counts():
+            segments = self.db.segments_for_layer_geohashes(['layer-a'], geohashes)
+            tiles = self.db.tiles_for_layer_geohashes(['layer-a'], geohashes)
+            return (
+                sum([s.reading_count for s in segments]), 
+                sum([t.reading_count for t in tiles]),
+            )
+
+        self.db.put_layer('layer-a', [r.query_data() for r in readings])
+        self.assertEqual((3, 3), counts())
+
+        self.db.put_layer('layer-a', [readings[0].query_data()])
+        self.assertEqual((1, 1), counts())
+
+        self.db.add_reading_to_layer('layer-a', readings[2].query_data())
+        self.assertEqual((2, 2), counts())
+
+        self.db.add_readings_to_layer('layer-a', [readings[1].query_data()], update_aggregates=False)
+        self.assertEqual((2, 2), counts())
+        # Two segments, and two tiles with three parents between them.
+        self.assertEqual(2 + 2 + 3, self.db.update_layer_aggregates('layer-a', geohashes))
+        self.assertEqual((3, 3), counts())
+
+        self.db.remove_reading_from_layer('layer-a', readings[0].query_data())
+        self.assertEqual((2, 2), counts())
+
+    def test_records_checkpoints(self):
+        route_id = ingest_route_id('bucket', 'mocks/route_1')
+        checkpoint = self.db.get_checkpoint(route_id)
+        self.assertEqual(0, checkpoint.count(Checkpoint.UPLOADED))
+
+        self.assertEqual(2, self.db.add_checkpoints(checkpoint, Checkpoint.UPLOADED, ['a.jpg', 'b.jpg']))
+        self.assertEqual(1, self.db.add_checkpoints(checkpoint, Checkpoint.UPLOADED, ['b.jpg', 'c.jpg']))
+        self.assertEqual(1, self.db.add_checkpoints(checkpoint, Checkpoint.WRITTEN, ['reading-a']))
+        self.assertEqual(0, self.db.get_checkpoint(ingest_route_id('bucket', 'mocks/route_2')).count(Checkpoint.UPLOADED))
+
+        restored = self.db.get_checkpoint(route_id)
+        self.assertEqual(3, restored.count(Checkpoint.UPLOADED))
+        self.assertTrue(restored.is_done(Checkpoint.WRITTEN, 'reading-a'))
+        self.assertFalse(restored.is_done(Checkpoint.LINKED, 'reading-a'))
+
+        self.assertEqual(4, self.db.delete_checkpoint(route_id))
+        self.assertEqual(0, len(self.db.org_table.scan()[DB.ITEM_KEY]))
+
+    def test_caches_snapped_points(self):
+        now = [1600000000.0]
+        cache = SnapCache(self.db, ttl=60, clock=lambda: now[0])
+        path = [(-37.8 + i * 0.0002, 145.1 + i * 0.0001) for i in range(150)]
+        snapped = [{
+            'location': {'latitude': lat + 0.00001, 'longitude': lng},
+            'originalIndex': i,
+            'placeId': f'place-{i}',
+        } for i, (lat, lng) in enumerate(path)]
+
+        keys = cache.keys(path)
+        self.assertEqual([None], cache.get([keys]))
+        self.assertEqual(150, cache.put(keys, snapped))
+        self.assertEqual(150, len(self.db.get_snap_cache_items(keys + ['unknown'])))
+
+        self.assertEqual([snapped], cache.get([keys]))
+        self.assertEqual(0.5, cache.report()['hit_rate'])
+
+        now[0] += 61
+        self.assertEqual([None], cache.get([keys]))
+
+    def test_enables_org_ttl_once(self):
+        ttl = self.db.client.describe_time_to_live(TableName=Constants.ORG_TABLE_NAME)['TimeToLiveDescription']
+        self.assertEqual(Constants.EXPIRES_AT, ttl['AttributeName'])
+
+        # Tables which already expire items are left alone.
+        with mock.patch.object(self.db.client, 'update_time_to_live') as update:
+            self.db.enable_org_ttl()
+            update.assert_not_called()
+
+    def test_batch_write_retries_unprocessed_items(self):
+        items = [{
+            Constants.PARTITION_KEY: 'Batch',
+            Constants.SORT_KEY: f'item-{i}',
+        } for i in range(30)]
+
+        write = self.db.client.batch_write_item
+        calls = []
+        def drop_last(RequestItems):
+            calls.append(len(RequestItems[Constants.ORG_TABLE_NAME]))
+            requests = RequestItems[Constants.ORG_TABLE_NAME]
+            if len(calls) <= 2 and len(requests) > 1:
+                write(RequestItems={Constants.ORG_TABLE_NAME: requests[:-1]})
+                return {DB.UNPROCESSED_ITEMS_KEY: {Constants.ORG_TABLE_NAME: requests[-1:]}}
+            return write(RequestItems=RequestItems)
+
+        with mock.patch.object(self.db.client, 'batch_write_item', side_effect=drop_last):
+            self.assertEqual(30, self.db.batch_write(Constants.ORG_TABLE_NAME, puts=items + items[:3]))
+
+        self.assertEqual(4, len(calls))
+        self.assertEqual(30, len(self.db.org_table.scan()[DB.ITEM_KEY]))
+
+        self.assertEqual(30, self.db.batch_write(Constants.ORG_TABLE_NAME, deletes=items))
+        self.assertEqual(0, len(self.db.org_table.scan()[DB.ITEM_KEY]))
+
+    @mock.patch('time.sleep', mock.MagicMock())
+    def test_batch_requests_give_up_after_max_attempts(self):
+        self.db.BATCH_ATTEMPTS = 3
+        items = [{
+            Constants.PARTITION_KEY: 'Batch',
+            Constants.SORT_KEY: f'item-{i}',
+        } for i in range(5)]
+
+        unprocessed_writes = lambda RequestItems: {DB.UNPROCESSED_ITEMS_KEY: RequestItems}
+        with mock.patch.object(self.db.client, 'batch_write_item', side_effect=unprocessed_writes) as write:
+            with self.assertRaises(ValueError):
+                self.db.batch_write(Constants.ORG_TABLE_NAME, puts=items)
+            self.assertEqual(3, write.call_count)
+
+        unprocessed_gets = lambda RequestItems: {DB.RESPONSES_KEY: {}, DB.UNPROCESSED_KEYS_KEY: RequestItems}
+        with mock.patch.object(self.db.db, 'batch_get_item', side_effect=unprocessed_gets) as get:
+            with self.assertRaises(ValueError):
+                self.db.get_snap_cache_items(['a', 'b'])
+            self.assertEqual(3, get.call_count)
+
+    def test_fans_out_route_reading_queries_without_route_index(self):
+        route_id = '103'
+        group_id = 'a9a98a9a9a'
+        self.__make_unindexed_reading_table()
+        db = DB('http://localhost:8000', max_query_workers=4, debug=True)
+
+        with open(self.current_dir +  '/test_data/sydney_entries.json', 'r') as f:
+            entities = json.load(f)
+
+        geohashes = set([])
+        entity_readings = []
+        for e in entities:
+            e[Constants.READING_ID] = str(uuid.uuid1())
+            e[Constants.ROUTE_ID] = route_id
+            r: Reading = json_to_reading('PredictionReading', e)
+            geohashes.add(r.geohash)
+            entity_readings.append(r)
+
+        db.put_route(Route('3', group_id, route_id, 123617823, geohashes=geohashes))
+        db.put_route(Route('3', group_id, 'other', 123617823, geohashes=geohashes))
+        db.put_readings(entity_readings)
+
+        with mock.patch('builtins.print') as printed:
+            readings = db.get_route_readings(route_id)
+        self.assertEqual(3383, len(readings))
+        self.assertEqual(3383, len(set([r[Constants.READING_ID] for r in readings])))
+
+        report = [c.args[1] for c in printed.call_args_list if c.args[0] == 'route readings partition timings:'][0]
+        self.assertEqual(len(geohashes), report['partitions'])
+        self.assertEqual(min(4, len(geohashes)), report['workers'])
+
+        self.assertEqual(0, len(db.get_route_readings('other')))
+
+    def test_reads_route_readings_through_route_index(self):
+        self.assertTrue(self.db.has_route_index())
+        group_id = 'a9a98a9a9a'
+        self.db.put_route(Route('3', group_id, 'route-a', 123617823, geohashes=['r3gqu8']))
+        self.db.put_route(Route('3', group_id, 'route-b', 123617823, geohashes=['r3gqu8']))
+
+        readings = []
+        for rid in ['route-a', 'route-b']:
+            for i in range(5):
+                readings.append(Reading(
+                    f'{rid}-{i}',
+                    rid,
+                    123617823,
+                    Constants.PREDICTION,
+                    -33.96788819,
+                    151.0181246,
+                    'https://aws/s3/somebucket/file.jpg',
+                    [],
+                    123617823,
+                    DEFAULT_ANNOTATOR_ID,
+                ))
+        self.db.put_readings(readings)
+
+        with mock.patch.object(self.db, 'route_geohashes') as route_geohashes:
+            route_readings = self.db.get_route_readings('route-a')
+            route_geohashes.assert_not_called()
+
+        self.assertEqual(5, len(route_readings))
+        self.assertEqual(set([f'route-a-{i}' for i in range(5)]), set([r[Constants.READING_ID] for r in route_readings]))
+        self.assertEqual(-33.96788819, route_readings[0][Constants.READING][Constants.LATITUDE])
+
+    def test_adds_route_index_to_existing_reading_table(self):
+        self.__make_unindexed_reading_table()
+        db = DB('http://localhost:8000')
+        self.assertFalse(db.has_route_index())
+
+        rid = 'someroute'
+        db.put_route(Route('3', 'a9a98a9a9a', rid, 123617823, geohashes=['r3gqu8']))
+        db.put_readings([Reading(
+            f'reading-{i}',
+            rid,
+            123617823,
+            Constants.PREDICTION,
+            -33.96788819,
+            151.0181246,
+            'https://aws/s3/somebucket/file.jpg',
+            [],
+            123617823,
+            DEFAULT_ANNOTATOR_ID,
+        ) for i in range(7)])
+        self.assertEqual(7, len(db.get_route_readings(rid)))
+
+        db.add_route_index(poll_seconds=0)
+        self.assertTrue(db.has_route_index())
+        self.assertEqual(7, len(db.get_route_readings(rid)))
+
     # -----------------------------------------------------------------
     # -----------------------------------------------------------------
     # -----------------------------------------------------------------
@@ -503,6 +937,138 @@ class TestDB(unittest.TestCase):
         readings = self.db.readings_for_layer_id(layer_id)
         self.assertEqual(20, len(readings))
 
+    def test_updates_layer_readings_in_bulk(self):
+        route_id = '103'
+        layer_id = '919191919'
+        
+        with open(self.current_dir +  '/test_data/sydney_entries.json', 'r') as f:
+            entities = json.load(f)
+
+        prediction_readings = []
+        reading_dicts = []
+        for e in entities[:80]:
+            e[Constants.READING_ID] = str(uuid.uuid1())
+            e[Constants.ROUTE_ID] = route_id
+            r: Reading = json_to_reading('PredictionReading', e)
+            prediction_readings.append(r)
+            reading_dicts.append(r.query_data())
+        self.db.put_readings(prediction_readings)
+
+        # Only membership writes are counted, segments and tiles are 
+        # written separately.
+        with mock.patch.object(self.db, 'update_layer_aggregates') as aggregates, \
+            mock.patch.object(self.db.client, 'batch_write_item', wraps=self.db.client.batch_write_item) as write:
+            self.assertEqual(60, self.db.add_readings_to_layer(layer_id, reading_dicts[:60]))
+            self.assertEqual(5, write.call_count)
+
+            write.reset_mock()
+            self.db.put_layer(layer_id, reading_dicts[20:80])
+            self.assertEqual(4, write.call_count)
+            self.assertEqual(2, aggregates.call_count)
+
+        layer_ids = set([r[Constants.READING_ID] for r in self.db.readings_for_layer_id(layer_id)])
+        self.assertEqual(set([r[Constants.READING_ID] for r in reading_dicts[20:80]]), layer_ids)
+
+        self.assertEqual(30, self.db.update_layer_readings(
+            layer_id, 
+            add=reading_dicts[:10], 
+            remove=reading_dicts[:10] + reading_dicts[60:80],
+        ))
+        layer_ids = set([r[Constants.READING_ID] for r in self.db.readings_for_layer_id(layer_id)])
+        self.assertEqual(set([r[Constants.READING_ID] for r in reading_dicts[20:60]]), layer_ids)
+
+        self.assertEqual(40, self.db.remove_readings_from_layer(layer_id, reading_dicts[20:60]))
+        self.assertEqual(0, len(self.db.readings_for_layer_id(layer_id)))
+
+    def test_indexes_layer_readings_by_geohash(self):
+        route_id = '103'
+        
+        with open(self.current_dir +  '/test_data/sydney_entries.json', 'r') as f:
+            entities = json.load(f)
+
+        reading_dicts = []
+        for e in entities[::42][:80]:
+            e[Constants.READING_ID] = str(uuid.uuid1())
+            e[Constants.ROUTE_ID] = route_id
+            r: Reading = json_to_reading('PredictionReading', e)
+            reading_dicts.append(r.query_data())
+
+        geohashes = sorted(set([r[Constants.GEOHASH] for r in reading_dicts]))
+        self.assertGreater(len(geohashes), 2)
+
+        def ids_in(readings, hashes):
+            return set([r[Constants.READING_ID] for r in readings if r[Constants.GEOHASH] in hashes])
+
+        self.db.put_layer('layer-a', reading_dicts[:50])
+        self.db.add_readings_to_layer('layer-b', reading_dicts[40:80])
+        self.db.add_reading_to_layer('layer-c', reading_dicts[0])
+
+        found = self.db.identifiers_for_layer_geohashes(['layer-a'], geohashes[:2])
+        self.assertEqual(ids_in(reading_dicts[:50], geohashes[:2]), ids_in(found, geohashes))
+
+        found = self.db.identifiers_for_layer_geohashes(['layer-a', 'layer-b', 'layer-c'], geohashes)
+        self.assertEqual(ids_in(reading_dicts, geohashes), ids_in(found, geohashes))
+
+        self.db.put_layer('layer-a', reading_dicts[10:50])
+        self.db.remove_readings_from_layer('layer-b', reading_dicts[70:80])
+        self.db.remove_reading_from_layer('layer-c', reading_dicts[0])
+        found = self.db.identifiers_for_layer_geohashes(['layer-a', 'layer-b', 'layer-c'], geohashes)
+        self.assertEqual(ids_in(reading_dicts[10:70], geohashes), ids_in(found, geohashes))
+        self.assertEqual(0, len(self.db.identifiers_for_layer_geohashes(['layer-d'], geohashes)))
+
+        # Past the partition cap each layer is read once and filtered.
+        self.db.MAX_LAYER_GEOHASH_PARTITIONS = 5
+        with mock.patch.object(self.db.paginator, 'paginate', wraps=self.db.paginator.paginate) as paginate:
+            found = self.db.identifiers_for_layer_geohashes(['layer-a', 'layer-b', 'layer-c'], geohashes[:2])
+        self.assertEqual(3, paginate.call_count)
+        self.assertEqual(ids_in(reading_dicts[10:70], geohashes[:2]), ids_in(found, geohashes))
+        self.db.MAX_LAYER_GEOHASH_PARTITIONS = DB.MAX_LAYER_GEOHASH_PARTITIONS
+
+        index_items = [
+            item for item in self.db.org_table.scan()[DB.ITEM_KEY] 
+            if item[Constants.PARTITION_KEY].startswith(Constants.LAYER_GEOHASH_PK)
+        ]
+        for item in index_items:
+            self.db.org_table.delete_item(Key={
+                Constants.PARTITION_KEY: item[Constants.PARTITION_KEY],
+                Constants.SORT_KEY: item[Constants.SORT_KEY],
+            })
+        self.assertEqual(0, len(self.db.identifiers_for_layer_geohashes(['layer-a', 'layer-b'], geohashes)))
+
+        self.assertEqual(len(index_items), self.db.index_layer_geohashes(chunk_size=7))
+        found = self.db.identifiers_for_layer_geohashes(['layer-a', 'layer-b', 'layer-c'], geohashes)
+        self.assertEqual(ids_in(reading_dicts[10:70], geohashes), ids_in(found, geohashes))
+
+    def test_removes_readings_from_layers(self):
+        with open(self.current_dir +  '/test_data/sydney_entries.json', 'r') as f:
+            entities = json.load(f)
+
+        reading_dicts = []
+        for e in entities[::42][:60]:
+            e[Constants.READING_ID] = str(uuid.uuid1())
+            e[Constants.ROUTE_ID] = '103'
+            reading_dicts.append(json_to_reading('PredictionReading', e).query_data())
+        geohashes = set([r[Constants.GEOHASH] for r in reading_dicts])
+
+        self.db.put_layer('layer-a', reading_dicts[:40])
+        self.db.put_layer('layer-b', reading_dicts[20:60])
+        self.db.put_layer('layer-c', reading_dicts[50:60])
+
+        self.assertEqual(50, self.db.remove_readings_from_layers(['layer-a', 'layer-b', 'layer-c'], reading_dicts[10:40]))
+        self.assertEqual(
+            set([r[Constants.READING_ID] for r in reading_dicts[:10] + reading_dicts[40:60]]),
+            set([i[Constants.READING_ID] for i in self.db.identifiers_for_layers(['layer-a', 'layer-b', 'layer-c'])])
+        )
+        self.assertEqual(
+            set([r[Constants.READING_ID] for r in reading_dicts[:10] + reading_dicts[40:60]]),
+            set([i[Constants.READING_ID] for i in self.db.identifiers_for_layer_geohashes(['layer-a', 'layer-b', 'layer-c'], geohashes)])
+        )
+        self.assertEqual(0, self.db.remove_readings_from_layers(['layer-a'], []))
+
+        # Layers that are not named are left alone.
+        self.assertEqual(10, self.db.remove_readings_from_layers(['layer-a'], reading_dicts[:60]))
+        self.assertEqual(20, len(self.db.identifiers_for_layers(['layer-b'])))
+
     # -----------------------------------------------------------------
     # -----------------------------------------------------------------
     # -----------------------------------------------------------------
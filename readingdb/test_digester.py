@@ -1,4 +1,5 @@
 from io import BytesIO
+import hashlib
 import io
 import os
 from readingdb.constants import Constants
@@ -14,6 +15,7 @@ from readingdb.download_json import download_json_files
 from readingdb.api import API
 from readingdb.endpoints import *
 from readingdb.digester import Digester
+from readingdb.checkpoint import Checkpoint, ingest_route_id
 from readingdb.tutils import *
 
 @mock_s3
@@ -88,6 +90,17 @@ class TestDigester(unittest.TestCase):
         # washiwashi is the userid in the metadata of mocks/route_2021_04_07_17_14_36_709.zip
         self.assertEqual(f'washiwashi,{route.id}', msg['Body'])
 
+    def test_digester_streams_zip(self): 
+        d = Digester(TEST_DYNAMO_ENDPOINT, bucket=self.bucket_name, sqs_url=self.sqs_url)
+        route: Route = d.process(self.bucket_name, 'mocks/route_1621394080578.zip', self.default_group, stream=True)
+        readings = self.api.all_route_readings(route.id)
+        self.assertEqual(len(readings), 70)
+
+        bucket = boto3.resource('s3').Bucket(self.bucket_name)
+        image_keys = [o.key for o in bucket.objects.filter(Prefix='mocks/route_1621394080578/')]
+        self.assertEqual(70, len(image_keys))
+        self.assertNotIn('mocks/route_1621394080578.zip', [o.key for o in bucket.objects.all()])
+
     def test_digester_uploads_route_with_unix_timestamps(self):
         d = Digester(TEST_DYNAMO_ENDPOINT, bucket=self.bucket_name, sqs_url=self.sqs_url)
         route: Route = d.process(self.bucket_name, 'mocks/route_1621394080578.zip', self.default_group)
@@ -266,6 +279,42 @@ class TestDigester(unittest.TestCase):
             bucket_objects.append(my_bucket_object.key)
         self.assertEqual(32, len(bucket_objects))
 
+    def test_digester_resumes_interrupted_ingestion(self):
+        d = Digester(TEST_DYNAMO_ENDPOINT, bucket=self.bucket_name, sqs_url=self.sqs_url)
+        d.SAVE_BATCH_SIZE = 10
+
+        pth = 'readingdb/test_data/route_imgs/route_2021_04_07_17_14_36_709/'
+        files = [pth + f for f in os.listdir(pth)]
+        key = 'route_2021_04_29_14_15_34_999'
+
+        save_route_readings = d.api.save_route_readings
+        calls = []
+        def interrupted(*args, **kwargs):
+            calls.append(args)
+            if len(calls) > 1:
+                raise ValueError('container stopped')
+            return save_route_readings(*args, **kwargs)
+
+        d.api.save_route_readings = interrupted
+        with self.assertRaises(ValueError):
+            d.process_local('some_user_id', self.default_group, key, self.bucket_name, files, 'test_route')
+
+        with open(pth + 'GPS.txt', 'rb') as f:
+            version = hashlib.md5(f.read()).hexdigest()
+        route_id = ingest_route_id(self.bucket_name, key, version)
+        checkpoint = self.api.get_checkpoint(route_id)
+        self.assertEqual(10, checkpoint.count(Checkpoint.WRITTEN))
+        self.assertEqual(10, checkpoint.count(Checkpoint.LINKED))
+        self.assertEqual(10, len(self.api.all_route_readings(route_id)))
+
+        d.api.save_route_readings = save_route_readings
+        route = d.process_local('some_user_id', self.default_group, key, self.bucket_name, files, 'test_route')
+
+        self.assertEqual(route_id, route.id)
+        self.assertEqual(28, len(self.api.all_route_readings(route.id)))
+        self.assertEqual(28, len(self.api.layer_readings([route.layer_id])))
+        self.assertEqual(0, self.api.get_checkpoint(route_id).count(Checkpoint.WRITTEN))
+
     def test_digester_processes_uploaded_files(self):
         s3_resource = boto3.resource('s3')
         zip_obj = s3_resource.Object(
@@ -0,0 +1,105 @@
+import threading
+import time
+import unittest
+
+from readingdb.fanout import FanOut
+
+class TestFanOut(unittest.TestCase):
+    def test_returns_results_in_partition_order(self):
+        f = FanOut(max_workers=4)
+        partitions = ['r3gqu8', 'r3gqu9', 'q6nhhn', 'r1r0fs', 'r1r0fu']
+
+        def slow_upper(p):
+            time.sleep(0.01 * (len(partitions) - partitions.index(p)))
+            return p.upper()
+
+        results = f.map(slow_upper, partitions)
+        self.assertEqual([p.upper() for p in partitions], results)
+
+        results, timings = f.map_timed(slow_upper, partitions)
+        self.assertEqual([p.upper() for p in partitions], results)
+        self.assertEqual(set(partitions), set(timings.keys()))
+        self.assertEqual('r3gqu8', f.report(timings)['slowest'])
+
+    def test_keeps_timings_per_call(self):
+        f = FanOut(max_workers=4)
+
+        def nested(p):
+            inner, inner_timings = f.map_timed(lambda q: q, [f'{p}-{i}' for i in range(3)])
+            self.assertEqual({f'{p}-{i}' for i in range(3)}, set(inner_timings))
+            return inner
+
+        results, timings = f.map_timed(nested, ['a', 'b'])
+        self.assertEqual([['a-0', 'a-1', 'a-2'], ['b-0', 'b-1', 'b-2']], results)
+        self.assertEqual({'a', 'b'}, set(timings))
+
+    def test_bounds_concurrency(self):
+        f = FanOut(max_workers=3)
+        lock = threading.Lock()
+        active = [0]
+        peak = [0]
+
+        def track(p):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+            return p
+
+        f.map(track, [str(i) for i in range(12)])
+        self.assertLessEqual(peak[0], 3)
+        self.assertGreater(peak[0], 1)
+
+    def test_bounds_concurrency_of_nested_and_concurrent_maps(self):
+        f = FanOut(max_workers=3)
+        lock = threading.Lock()
+        active = [0]
+        peak = [0]
+        threads = set()
+
+        def track(p):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+                threads.add(threading.get_ident())
+            time.sleep(0.01)
+            with lock:
+                active[0] -= 1
+            return p
+
+        def nested(p):
+            return f.map(track, [f'{p}-{i}' for i in range(4)])
+
+        callers = [
+            threading.Thread(target=f.map, args=(nested, [f'{c}-{p}' for p in range(4)]))
+            for c in range(3)
+        ]
+        for c in callers:
+            c.start()
+        for c in callers:
+            c.join()
+
+        self.assertLessEqual(peak[0], 3)
+        self.assertLessEqual(len(threads), 3)
+        self.assertEqual(['a-0', 'a-1'], f.map(nested, ['a'])[0][:2])
+
+    def test_handles_no_partitions(self):
+        f = FanOut()
+        self.assertEqual([], f.map(lambda p: p, []))
+        self.assertEqual(([], {}), f.map_timed(lambda p: p, []))
+        self.assertEqual({}, f.report({}))
+
+    def test_propagates_errors(self):
+        f = FanOut()
+
+        def fail(p):
+            raise ValueError(p)
+
+        with self.assertRaises(ValueError):
+            f.map(fail, ['a', 'b'])
+
+    def test_rejects_empty_pool(self):
+        with self.assertRaises(ValueError):
+            FanOut(max_workers=0)
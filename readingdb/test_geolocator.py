@@ -1,11 +1,79 @@
 import json
+import random
+import threading
+import time
+import haversine as hs
 import readingdb.constants as C
 from readingdb.rutils import RUtils
 from readingdb.geolocator import Geolocator
+from readingdb.numpyinterp import numpy_interp, numpy_slerp_interp
+from readingdb.reading import json_to_reading
+from readingdb.snapcache import SnapCache
 import unittest
+from googlemaps.exceptions import ApiError, TransportError
 from readingdb.tutils import roads_api_test
 from readingdb.format import *
 
+class FakeRoads():
+    '''Stands in for googlemaps.Client.snap_to_roads. Points are nudged 
+    deterministically, some are dropped and interpolated points are 
+    added before others, as the Roads API does. Which points are 
+    dropped depends only on the point itself. Every window fails with a
+    transient error the first time it is requested.
+    '''
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self.calls = 0
+        self.failed = set()
+
+    def snap_to_roads(self, path, interpolate=False):
+        with self.lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+            first_attempt = tuple(path) not in self.failed
+            self.failed.add(tuple(path))
+
+        try:
+            time.sleep(random.uniform(0, 0.01))
+            if first_attempt:
+                raise TransportError('connection reset')
+
+            points = []
+            for i, (lat, lng) in enumerate(path):
+                place_id = f'place-{round(lat, 3)}-{round(lng, 3)}'
+                micro = round(lat * 1e6)
+                if micro % 7 == 3:
+                    continue
+                if micro % 5 == 0:
+                    points.append({'location': {'latitude': lat - 0.00001, 'longitude': lng}, 'placeId': place_id})
+                points.append({'location': {'latitude': lat + 0.00001, 'longitude': lng - 0.00001}, 'originalIndex': i, 'placeId': place_id})
+
+            return points
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+def moving_readings(n: int):
+    rand = random.Random(11)
+    readings = []
+    lat, lng = -37.8, 145.1
+    d_lat, d_lng = 0.0002, 0.0
+    for i in range(n):
+        if i % 40 == 0:
+            d_lat, d_lng = d_lng, d_lat
+        lat += d_lat + rand.uniform(0, 0.00002)
+        lng += d_lng + rand.uniform(0, 0.00002)
+        readings.append({
+            Constants.TIMESTAMP: 1600000000000 + i * 1000,
+            Constants.READING: {Constants.LATITUDE: lat, Constants.LONGITUDE: lng},
+        })
+
+    return readings
+
 class TestGeolocator(unittest.TestCase):
     @classmethod
     def setUpClass(cls) -> None:
@@ -78,6 +146,76 @@ class TestGeolocator(unittest.TestCase):
         self.assertEqual(80, len(predictions))
         self.assertEqual('PredictionReading', RUtils.get_type(predictions[0]))
 
+    def test_concurrent_snapping_matches_sequential(self):
+        for replacement in [False, True]:
+            sequential = Geolocator(snap_workers=1, snap_per_second=1000, sleep=lambda s: None)
+            sequential.gmaps = FakeRoads()
+            concurrent = Geolocator(snap_workers=8, snap_per_second=1000, sleep=lambda s: None)
+            concurrent.gmaps = FakeRoads()
+
+            expected = sequential.geolocate(self.pos_readings, replacement)
+            actual = concurrent.geolocate(self.pos_readings, replacement)
+
+            self.assertEqual(expected, actual)
+            self.assertGreater(concurrent.gmaps.most_in_flight, 1)
+            self.assertLessEqual(concurrent.gmaps.most_in_flight, 8)
+            self.assertEqual(20, concurrent.gmaps.calls)
+            self.assertEqual(10, concurrent.report()['retries'])
+            self.assertEqual(20, concurrent.report()['requests'])
+            self.assertGreaterEqual(concurrent.report()['rate_limited_seconds'], 0.0)
+
+    def test_snapping_from_cache(self):
+        readings = moving_readings(600)
+        for replacement in [False, True]:
+            uncached = Geolocator(snap_per_second=1000, sleep=lambda s: None)
+            uncached.gmaps = FakeRoads()
+            cache = SnapCache()
+            cached = Geolocator(snap_per_second=1000, sleep=lambda s: None, snap_cache=cache)
+            cached.gmaps = FakeRoads()
+
+            expected = uncached.geolocate(readings, replacement)
+            self.assertEqual(expected, cached.geolocate(readings, replacement))
+            self.assertEqual(0.0, cache.report()['hit_rate'])
+            calls = cached.gmaps.calls
+
+            self.assertEqual(expected, cached.geolocate(readings, replacement))
+            self.assertEqual(calls, cached.gmaps.calls)
+            self.assertEqual(0.5, cache.report()['hit_rate'])
+            self.assertEqual(cache.report(), cached.report()['cache'])
+
+        # This drive comes back through the same cells, and windows which
+        # do that are always snapped live.
+        calls = cached.gmaps.calls
+        cached.geolocate(self.pos_readings)
+        live_calls = cached.gmaps.calls - calls
+        calls = cached.gmaps.calls
+        snapped = cached.geolocate(self.pos_readings)
+        self.assertLess(cached.gmaps.calls - calls, live_calls / 2)
+        self.assertGreater(len(snapped), 0)
+
+    def test_snapping_gives_up_on_permanent_errors(self):
+        sleeps = []
+        g = Geolocator(snap_attempts=3, snap_per_second=1000, sleep=sleeps.append)
+
+        class Denied():
+            calls = 0
+
+            def snap_to_roads(self, path, interpolate=False):
+                Denied.calls += 1
+                raise ApiError('REQUEST_DENIED', 'bad key')
+
+        g.gmaps = Denied()
+        with self.assertRaises(ApiError):
+            g.geolocate(self.pos_readings[:50])
+        self.assertEqual(1, Denied.calls)
+
+        g.gmaps = FakeRoads()
+        g.gmaps.failed = set()
+        g.snap_attempts = 1
+        with self.assertRaises(TransportError):
+            g.geolocate(self.pos_readings[:50])
+        self.assertEqual([], sleeps)
+
     def test_filtering(self):
         g = Geolocator()
         with open('readingdb/test_data/box-hill.json', 'r') as f:
@@ -95,7 +233,10 @@ class TestGeolocator(unittest.TestCase):
             filtered_imgs.add(r[Constants.READING][Constants.URI][Constants.KEY])
 
         removed = list(all_imgs - filtered_imgs)
-        self.assertEqual(553, len(removed))
+        # box-hill.json is not in timestamp order, so these counts moved 
+        # when filter_stationary started sorting before taking the first
+        # reading.
+        self.assertEqual(542, len(removed))
    
     def test_filtering_after_geolocation(self):
         g = Geolocator()
@@ -114,7 +255,68 @@ class TestGeolocator(unittest.TestCase):
             filtered_imgs.add(r[Constants.READING][Constants.URI][Constants.KEY])
 
         removed = list(all_imgs - filtered_imgs)
-        self.assertEqual(501, len(removed))
+        self.assertEqual(504, len(removed))
+
+    def test_filtering_ignores_order(self):
+        g = Geolocator()
+        with open('readingdb/test_data/box-hill.json', 'r') as f:
+            readings = json.load(f)
+
+        in_order = sorted(readings, key=lambda r: r[Constants.TIMESTAMP])
+        shuffled = list(readings)
+        random.Random(7).shuffle(shuffled)
+
+        self.assertEqual(g.filter_stationary(in_order), g.filter_stationary(shuffled))
+
+    def test_filtering_matches_reading_by_reading_filter(self):
+        def reference_filter(readings):
+            keep = [readings[0]]
+            last_motion = readings[0]
+            buffer = []
+            for r in readings[1:]:
+                dist = hs.haversine(
+                    (r[Constants.READING][Constants.LATITUDE], r[Constants.READING][Constants.LONGITUDE]),
+                    (last_motion[Constants.READING][Constants.LATITUDE], last_motion[Constants.READING][Constants.LONGITUDE]),
+                    unit=hs.Unit.METERS
+                )
+                if dist > Geolocator.STATIONARY_METERS:
+                    keep.extend(buffer)
+                    buffer = []
+                    keep.append(r)
+                    last_motion = r
+                elif r[Constants.TIMESTAMP] - last_motion[Constants.TIMESTAMP] < Geolocator.STATIONARY_MILLIS:
+                    keep.append(r)
+                else:
+                    buffer.append(r)
+                    if len(buffer) > Geolocator.STATIONARY_BUFFER:
+                        buffer.pop(0)
+            return keep
+
+        # A drive with stops of every length, including ones much longer
+        # than the chunks filter_stationary checks distances in.
+        rand = random.Random(3)
+        readings = []
+        ts = 1600000000000
+        lat, lng = -37.8, 145.1
+        for i in range(6000):
+            ts += 1000
+            if (i // 300) % 2 == 0 or rand.random() < 0.01:
+                lat += rand.uniform(0, 0.0002)
+                lng += rand.uniform(0, 0.0002)
+            readings.append({
+                Constants.TIMESTAMP: ts,
+                Constants.READING: {
+                    Constants.LATITUDE: lat + rand.uniform(-0.00003, 0.00003),
+                    Constants.LONGITUDE: lng + rand.uniform(-0.00003, 0.00003),
+                },
+            })
+
+        self.assertEqual(reference_filter(readings), Geolocator().filter_stationary(readings))
+
+        with open('readingdb/test_data/box-hill-geolocated.json', 'r') as f:
+            readings = sorted(json.load(f), key=lambda r: r[Constants.TIMESTAMP])
+
+        self.assertEqual(reference_filter(readings), Geolocator().filter_stationary(readings))
 
     def test_interpolation(self):
         g = Geolocator()
@@ -125,6 +327,34 @@ class TestGeolocator(unittest.TestCase):
         self.assertEqual(-37.69698717037037, RUtils.get_lat(interp[0]))
         self.assertEqual(144.802889819943,  RUtils.get_lng(interp[0]))
 
+    def test_numpy_interpolation_matches_linear(self):
+        linear = Geolocator().interpolated(self.pos_readings, self.img_readings)
+        vectorized = Geolocator(interp_alg=numpy_interp).interpolated(self.pos_readings, self.img_readings)
+
+        self.assertEqual(1529, len(vectorized))
+        for expected, actual in zip(linear, vectorized):
+            expected.pop(Constants.ANNOTATION_TIMESTAMP)
+            actual.pop(Constants.ANNOTATION_TIMESTAMP)
+            self.assertEqual(expected, actual)
+
+    def test_flags_gps_gaps(self):
+        interp = Geolocator().interpolated(self.pos_readings, self.img_readings)
+        self.assertFalse(any(Constants.GPS_GAP in r[Constants.READING] for r in interp))
+
+        pos_readings = self.pos_readings[:100] + self.pos_readings[400:]
+        gap_start = RUtils.get_ts(pos_readings[99])
+        gap_end = RUtils.get_ts(pos_readings[100])
+
+        interp = Geolocator(interp_alg=numpy_slerp_interp, max_gap_millis=10000).interpolated(pos_readings, self.img_readings)
+        flagged = [r for r in interp if r[Constants.READING].get(Constants.GPS_GAP)]
+        self.assertGreater(len(flagged), 0)
+        self.assertTrue(all(gap_start < RUtils.get_ts(r) <= gap_end for r in flagged))
+
+        r = flagged[0]
+        r[Constants.READING_ID] = 'reading-id'
+        r[Constants.ROUTE_ID] = 'route-id'
+        self.assertTrue(json_to_reading(Constants.PREDICTION, r).item_data()[Constants.READING][Constants.GPS_GAP])
+
     def test_interpolation_does_not_add_useless_img_readings(self):
         g = Geolocator()
         interp = g.interpolated(self.pos_readings[400:], self.img_readings)
@@ -1,4 +1,6 @@
+import base64
 from collections import defaultdict
+import gzip
 from io import BytesIO
 import os
 import zipfile
@@ -207,6 +209,18 @@ class TestBasic(TestLambda):
             'Body': 'Not Enough Points Given (0)'
         }, resp)
 
+        resp = test_handler({
+            'Type': 'SnapToRoads',
+            'Points': [{'lat': -36.8782232, 'lng': 146.12628160000003}] * 2,
+            'UseSnapCache': 'no',
+            'AccessToken': self.access_token,
+        }, TEST_CONTEXT)
+
+        self.assertEqual({
+            'Status': 'Error',
+            'Body': 'Type Error: event SnapToRoads UseSnapCache must be a boolean'
+        }, resp)
+
     @unittest.skipIf(not credentials_present(), NO_CREDS_REASON)
     @roads_api_test
     def test_road_snap_event(self):
@@ -873,6 +887,148 @@ class TestLambdaW(TestLambdaRW):
             bucket_objects.append(my_bucket_object.key)
         self.assertEqual(len(bucket_objects), 718)
 
+    def test_returns_compressed_readings(self):
+        group_id = 'apapapa'
+        layer_id = 'aalalala'
+        self.api.put_user(self.org_name, self.user_id)
+        self.api.user_add_group(self.user_id, group_id)
+        self.api.group_add_layer(group_id, layer_id)
+        
+        with open('readingdb/test_data/sydney_route_short.json') as f:
+            route_json = json.load(f) 
+        r = self.api.save_route(RouteSpec.from_json(route_json), self.user_id, self.default_group, layer_id)
+
+        resp = test_handler({
+            'Type': 'GetReadings',
+            'RouteID': r.id,
+            'Compress': True,
+            'AccessToken': self.access_token,
+        }, TEST_CONTEXT)
+
+        readings = resp['Body']['Readings']
+        self.assertEqual('gzip', readings['ContentEncoding'])
+        decoded = json.loads(gzip.decompress(base64.b64decode(readings['Data'])))
+        expected = self.api.prediction_readings(r.id, ANNOTATOR_PREFERENCE)
+        for reading in expected + decoded:
+            reading['Reading'].pop('PresignedURL', None)
+        self.assertEqual(expected, decoded)
+
+        resp = test_handler({
+            'Type': 'GetReadings',
+            'RouteID': r.id,
+            'Compress': 'yes',
+            'AccessToken': self.access_token,
+        }, TEST_CONTEXT)
+        self.assertEqual('Error', resp['Status'])
+
+    def test_returns_bbox_readings(self):
+        group_id = 'apapapa'
+        layer_id = 'aalalala'
+        self.api.put_user(self.org_name, self.user_id)
+        self.api.user_add_group(self.user_id, group_id)
+        self.api.group_add_layer(group_id, layer_id)
+        
+        with open('readingdb/test_data/sydney_route_short.json') as f:
+            route_json = json.load(f) 
+        r = self.api.save_route(RouteSpec.from_json(route_json), self.user_id, self.default_group, layer_id)
+        readings = self.api.prediction_readings(r.id, ANNOTATOR_PREFERENCE)
+        lats = [float(reading['Reading']['Latitude']) for reading in readings]
+        lngs = [float(reading['Reading']['Longitude']) for reading in readings]
+
+        resp = test_handler({
+            'Type': 'GetBoundingBoxReadings',
+            'MinLatitude': min(lats),
+            'MinLongitude': min(lngs),
+            'MaxLatitude': max(lats),
+            'MaxLongitude': max(lngs),
+            'AccessToken': self.access_token,
+        }, TEST_CONTEXT)
+        self.assertEqual('Success', resp['Status'])
+        self.assertEqual(
+            sorted(reading['ReadingID'] for reading in readings),
+            sorted(reading['ReadingID'] for reading in resp['Body']['Readings']),
+        )
+
+        resp = test_handler({
+            'Type': 'GetBoundingBoxReadings',
+            'MinLatitude': max(lats),
+            'MinLongitude': min(lngs),
+            'MaxLatitude': min(lats),
+            'MaxLongitude': max(lngs),
+            'AccessToken': self.access_token,
+        }, TEST_CONTEXT)
+        self.assertEqual('Error', resp['Status'])
+
+        resp = test_handler({
+            'Type': 'GetBoundingBoxReadings',
+            'MinLatitude': min(lats),
+            'AccessToken': self.access_token,
+        }, TEST_CONTEXT)
+        self.assertEqual('Error', resp['Status'])
+
+    def test_returns_segments(self):
+        group_id = 'apapapa'
+        layer_id = 'aalalala'
+        self.api.put_user(self.org_name, self.user_id)
+        self.api.user_add_group(self.user_id, group_id)
+        self.api.group_add_layer(group_id, layer_id)
+        
+        with open('readingdb/test_data/sydney_route_short.json') as f:
+            route_json = json.load(f) 
+        r = self.api.save_route(RouteSpec.from_json(route_json), self.user_id, self.default_group, layer_id)
+        geohashes = sorted(r.geohashes)
+
+        resp = test_handler({
+            'Type': 'GetSegments',
+            'Geohash': geohashes,
+            'AccessToken': self.access_token,
+        }, TEST_CONTEXT)
+        self.assertEqual('Success', resp['Status'])
+        self.assertEqual(self.api.segments_by_user(geohashes, self.user_id), resp['Body']['Segments'])
+        self.assertGreater(len(resp['Body']['Segments']), 0)
+
+        resp = test_handler({
+            'Type': 'GetSegments',
+            'Geohash': [],
+            'AccessToken': self.access_token,
+        }, TEST_CONTEXT)
+        self.assertEqual('Error', resp['Status'])
+
+    def test_returns_tiles(self):
+        group_id = 'apapapa'
+        layer_id = 'aalalala'
+        self.api.put_user(self.org_name, self.user_id)
+        self.api.user_add_group(self.user_id, group_id)
+        self.api.group_add_layer(group_id, layer_id)
+
+        with open('readingdb/test_data/sydney_route_short.json') as f:
+            route_json = json.load(f) 
+        self.api.save_route(RouteSpec.from_json(route_json), self.user_id, self.default_group, layer_id)
+
+        resp = test_handler({
+            'Type': 'GetTiles',
+            'MinLatitude': -34.0,
+            'MinLongitude': 151.0,
+            'MaxLatitude': -33.9,
+            'MaxLongitude': 151.1,
+            'Precision': 4,
+            'AccessToken': self.access_token,
+        }, TEST_CONTEXT)
+        self.assertEqual('Success', resp['Status'])
+        self.assertEqual(self.api.tiles_in_bbox(-34.0, 151.0, -33.9, 151.1, 4, self.user_id), resp['Body']['Tiles'])
+        self.assertGreater(len(resp['Body']['Tiles']), 0)
+
+        resp = test_handler({
+            'Type': 'GetTiles',
+            'MinLatitude': -34.0,
+            'MinLongitude': 151.0,
+            'MaxLatitude': -33.9,
+            'MaxLongitude': 151.1,
+            'Precision': 9,
+            'AccessToken': self.access_token,
+        }, TEST_CONTEXT)
+        self.assertEqual('Error', resp['Status'])
+
 @mock_s3
 class TestLambdaR(TestLambdaRW): 
     @mock.patch('time.time', mock.MagicMock(side_effect=Increment(1619496879)))
@@ -1,5 +1,8 @@
+import random
 import unittest
-from readingdb.lineroute import LinePoint, LineRoute, linear_interp
+import haversine as hs
+from readingdb.lineroute import LinePoint, LineRoute, linear_interp, slerp_interp
+from readingdb.numpyinterp import numpy_interp, numpy_slerp_interp
 
 class TestLineRoute(unittest.TestCase):
 
@@ -79,6 +82,83 @@ class TestLineRoute(unittest.TestCase):
             "Longitude": 49.9
         }))
 
+    def test_batch_lookup_matches_single_lookups(self):
+        rand = random.Random(42)
+        ts = sorted(rand.sample(range(1000, 100000), 300))
+        ts[10] = ts[11] - 1
+        pnts = [LinePoint(t, rand.uniform(-38, -37), rand.uniform(144, 145), f'place-{i}') for i, t in enumerate(ts)]
+        r = LineRoute(pnts, interp_alg=linear_interp)
+
+        def scanned(unix_time):
+            prev_point = pnts[0]
+            for p in pnts[1:]:
+                if p.timestamp >= unix_time:
+                    return linear_interp(prev_point, p, unix_time)
+                prev_point = p
+
+        queries = [rand.randint(ts[0], ts[-1]) for _ in range(500)] + ts[:20] + [ts[-1]]
+        for q in queries:
+            expected = scanned(q)
+            point = r.point_at(q)
+            self.assertEqual(expected, point)
+            self.assertEqual(expected.place_id, point.place_id)
+
+        self.assertEqual([r.point_at(q) for q in queries], r.points_at(queries))
+        self.assertEqual([r.point_at(q) for q in sorted(queries)], r.points_at(sorted(queries)))
+
+        self.assertEqual([pnts[0], pnts[-1], pnts[0]], r.points_at([ts[0] - 5, ts[-1] + 5, ts[0]]))
+        self.assertEqual([], r.points_at([]))
+
+    def test_numpy_backend_matches_linear_interpolation(self):
+        rand = random.Random(7)
+        ts = sorted(rand.sample(range(1568113911576, 1568113991576), 200))
+        ts[1] = ts[0]
+        pnts = [LinePoint(t, rand.uniform(-38, -37), rand.uniform(144, 145), f'place-{i}' if i % 3 else None) for i, t in enumerate(ts)]
+        linear = LineRoute(pnts, interp_alg=linear_interp)
+        vectorized = LineRoute(pnts, interp_alg=numpy_interp)
+
+        queries = [rand.randint(ts[2], ts[-1]) for _ in range(1000)] + ts[2:] + [ts[0] - 1, ts[-1] + 1]
+        for expected, actual in zip(linear.points_at(queries), vectorized.points_at(queries)):
+            self.assertEqual(expected.timestamp, actual.timestamp)
+            self.assertEqual(expected.lat, actual.lat)
+            self.assertEqual(expected.lng, actual.lng)
+            self.assertEqual(expected.place_id, actual.place_id)
+
+        self.assertEqual(linear.point_at(ts[5] + 1), vectorized.point_at(ts[5] + 1))
+        self.assertEqual([], vectorized.points_at([]))
+        with self.assertRaises(ZeroDivisionError):
+            vectorized.points_at([ts[0]])
+
+    def test_flags_points_in_gps_gaps(self):
+        pnts = [LinePoint(0, -37.0, 145.0), LinePoint(1000, -37.0001, 145.0001), LinePoint(31000, -37.01, 145.01), LinePoint(32000, -37.0101, 145.0101)]
+        queries = [0, 500, 1000, 1001, 20000, 31000, 31500]
+        expected = [False, False, False, True, True, True, False]
+
+        for alg in [linear_interp, slerp_interp, numpy_interp, numpy_slerp_interp]:
+            r = LineRoute(pnts, interp_alg=alg, max_gap_millis=10000)
+            self.assertEqual(expected, [r.point_at(q).gap for q in queries])
+            self.assertEqual(expected, [p.gap for p in r.points_at(queries)])
+
+            r = LineRoute(pnts, interp_alg=alg)
+            self.assertEqual([False] * len(queries), [p.gap for p in r.points_at(queries)])
+
+    def test_numpy_backend_matches_slerp_interpolation(self):
+        rand = random.Random(11)
+        ts = sorted(rand.sample(range(0, 10000000), 100))
+        pnts = [LinePoint(t, rand.uniform(-60, 60), rand.uniform(-179, 179), str(i)) for i, t in enumerate(ts)]
+        pnts[40] = LinePoint(ts[40], pnts[39].lat, pnts[39].lng)
+        single = LineRoute(pnts, interp_alg=slerp_interp)
+        vectorized = LineRoute(pnts, interp_alg=numpy_slerp_interp)
+
+        queries = [rand.randint(ts[0], ts[-1]) for _ in range(1000)] + ts
+        for expected, actual in zip(single.points_at(queries), vectorized.points_at(queries)):
+            self.assertEqual(expected.timestamp, actual.timestamp)
+            self.assertAlmostEqual(expected.lat, actual.lat, places=9)
+            self.assertAlmostEqual(expected.lng, actual.lng, places=9)
+            self.assertEqual(expected.place_id, actual.place_id)
+
+        self.assertEqual([p for p in pnts], vectorized.points_at(ts))
+
 
 class TestInterpolation(unittest.TestCase):
 
@@ -135,3 +215,52 @@ class TestInterpolation(unittest.TestCase):
             "Latitude": 16.0,
             "Longitude": 20.0,
         }))
+
+    def test_carries_nearest_place_id(self):
+        start_point = LinePoint.from_point({
+            "Timestamp": 200,
+            "Latitude": 20.0,
+            "Longitude": 10.0,
+            "PlaceID": "place-a",
+        })
+        end_point = LinePoint.from_point({
+            "Timestamp": 300,
+            "Latitude": -20.0,
+            "Longitude": 110.0,
+            "PlaceID": "place-b",
+        })
+
+        self.assertEqual("place-a", linear_interp(start_point, end_point, 210).place_id)
+        self.assertEqual("place-a", linear_interp(start_point, end_point, 250).place_id)
+        self.assertEqual("place-b", linear_interp(start_point, end_point, 290).place_id)
+
+
+    def test_slerp_interpolation_returns_bookends(self):
+        start_point = LinePoint(200, -37.8714232, 145.2450816)
+        end_point = LinePoint(300, -37.8744232, 145.7450816)
+
+        self.assertEqual(start_point, slerp_interp(start_point, end_point, 200))
+        self.assertEqual(end_point, slerp_interp(start_point, end_point, 300))
+        stationary = LinePoint(300, start_point.lat, start_point.lng)
+        self.assertEqual(linear_interp(start_point, stationary, 250), slerp_interp(start_point, stationary, 250))
+
+    def test_slerp_interpolation_follows_great_circle(self):
+        start_point = LinePoint(0, 0.0, 10.0, "place-a")
+        end_point = LinePoint(100, 0.0, 20.0, "place-b")
+        interp = slerp_interp(start_point, end_point, 50)
+        self.assertAlmostEqual(0.0, interp.lat)
+        self.assertAlmostEqual(15.0, interp.lng)
+        self.assertEqual("place-a", interp.place_id)
+        self.assertEqual("place-b", slerp_interp(start_point, end_point, 60).place_id)
+
+        start_point = LinePoint(0, -37.8, 140.0)
+        end_point = LinePoint(100, -30.1, 150.3)
+        total = hs.haversine((start_point.lat, start_point.lng), (end_point.lat, end_point.lng))
+        for t in [10, 25, 50, 90]:
+            interp = slerp_interp(start_point, end_point, t)
+            travelled = hs.haversine((start_point.lat, start_point.lng), (interp.lat, interp.lng))
+            remaining = hs.haversine((interp.lat, interp.lng), (end_point.lat, end_point.lng))
+            self.assertAlmostEqual(total * t / 100, travelled, places=6)
+            self.assertAlmostEqual(total, travelled + remaining, places=6)
+
+        self.assertNotAlmostEqual(linear_interp(start_point, end_point, 50).lat, slerp_interp(start_point, end_point, 50).lat, places=3)
@@ -0,0 +1,113 @@
+import threading
+import time
+import unittest
+
+from readingdb.pipeline import Pipeline
+
+class TestPipeline(unittest.TestCase):
+    def test_runs_items_through_stages(self):
+        p = Pipeline(queue_size=4)
+        p.stage('double', lambda x: x * 2)
+        p.stage('add', lambda x: x + 1)
+
+        self.assertEqual([x * 2 + 1 for x in range(100)], p.run(range(100)))
+
+        report = p.report()
+        self.assertEqual(100, report['stages']['double']['in'])
+        self.assertEqual(100, report['stages']['add']['out'])
+
+    def test_runs_with_no_stages(self):
+        self.assertEqual([1, 2, 3], Pipeline().run([1, 2, 3]))
+        self.assertEqual([], Pipeline().stage('noop', lambda x: x).run([]))
+
+    def test_drops_none(self):
+        p = Pipeline()
+        p.stage('evens', lambda x: x if x % 2 == 0 else None)
+
+        self.assertEqual([0, 2, 4, 6, 8], p.run(range(10)))
+        self.assertEqual(5, p.report()['stages']['evens']['out'])
+
+    def test_batches_items(self):
+        batches = []
+
+        def collect(batch):
+            batches.append(list(batch))
+            return batch
+
+        p = Pipeline(queue_size=2)
+        p.stage('collect', collect, batch_size=10)
+
+        self.assertEqual(list(range(25)), p.run(range(25)))
+        self.assertEqual([10, 10, 5], [len(b) for b in batches])
+
+    def test_bounds_concurrency(self):
+        lock = threading.Lock()
+        in_flight = [0]
+        most_in_flight = [0]
+
+        def slow(x):
+            with lock:
+                in_flight[0] += 1
+                most_in_flight[0] = max(most_in_flight[0], in_flight[0])
+            time.sleep(0.01)
+            with lock:
+                in_flight[0] -= 1
+            return x
+
+        p = Pipeline(queue_size=2)
+        p.stage('slow', slow, workers=4)
+
+        self.assertEqual(list(range(40)), sorted(p.run(range(40))))
+        self.assertGreater(most_in_flight[0], 1)
+        self.assertLessEqual(most_in_flight[0], 4)
+
+    def test_bounds_queued_items(self):
+        fed = [0]
+        seen = []
+
+        def feed():
+            for i in range(50):
+                fed[0] += 1
+                yield i
+
+        def slow(x):
+            seen.append(fed[0] - x)
+            time.sleep(0.001)
+            return x
+
+        p = Pipeline(queue_size=3)
+        p.stage('slow', slow)
+        p.run(feed())
+
+        # The feeder can only get a full queue ahead of the stage.
+        self.assertLessEqual(max(seen), 3 + 2)
+
+    def test_raises_stage_errors(self):
+        def fail(x):
+            if x == 20:
+                raise ValueError('bad item')
+            return x
+
+        p = Pipeline(queue_size=2)
+        p.stage('fail', fail, workers=3)
+        p.stage('sink', lambda batch: batch, batch_size=5)
+
+        with self.assertRaises(ValueError):
+            p.run(range(1000))
+
+    def test_raises_feeder_errors(self):
+        def feed():
+            yield 1
+            raise KeyError('broken input')
+
+        p = Pipeline()
+        p.stage('noop', lambda x: x)
+
+        with self.assertRaises(KeyError):
+            p.run(feed())
+
+    def test_rejects_bad_stages(self):
+        with self.assertRaises(ValueError):
+            Pipeline().stage('bad', lambda x: x, workers=0)
+        with self.assertRaises(ValueError):
+            Pipeline().stage('bad', lambda x: x, batch_size=0)
@@ -0,0 +1,201 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import boto3
+from botocore.config import Config
+from botocore.credentials import Credentials, RefreshableCredentials
+
+from urllib.parse import parse_qs, urlsplit
+
+from readingdb.presigner import Presigner
+
+class TestPresigner(unittest.TestCase):
+    NOW = 1700000000.0
+    BUCKET = 'mobileappsessions172800-main'
+
+    def setUp(self) -> None:
+        self.time_patch = mock.patch('time.time', return_value=self.NOW)
+        self.time_patch.start()
+        self.clock = [self.NOW]
+
+    def tearDown(self) -> None:
+        self.time_patch.stop()
+
+    def client(self, config=None, token=None):
+        return boto3.client(
+            's3',
+            region_name='ap-southeast-2',
+            aws_access_key_id='AKIAEXAMPLE',
+            aws_secret_access_key='secret',
+            aws_session_token=token,
+            config=config,
+        )
+
+    def presigner(self, client, token=None, **kwargs) -> Presigner:
+        kwargs.setdefault('credentials', Credentials('AKIAEXAMPLE', 'secret', token))
+        return Presigner(client, clock=lambda: self.clock[0], **kwargs)
+
+    def refreshable(self, token, expires_in):
+        now = lambda: datetime.fromtimestamp(self.clock[0], timezone.utc)
+        return RefreshableCredentials(
+            'AKIAEXAMPLE',
+            'secret',
+            token,
+            now() + timedelta(seconds=expires_in),
+            refresh_using=None,
+            method='test',
+            time_fetcher=now,
+        )
+
+    def expected(self, client, objects, expires_in=259200):
+        return [
+            client.generate_presigned_url(
+                'get_object',
+                Params={'Bucket': b, 'Key': k},
+                ExpiresIn=expires_in,
+            ) for b, k in objects
+        ]
+
+    def objects(self):
+        return [
+            (b, k)
+            for b in [self.BUCKET, 'test_bucket']
+            for k in ['route 1/img_1.jpg', 'a/b+c~d.jpg', 'ü/é?x&y=z.jpg', 'plain.jpg']
+        ]
+
+    def test_batch_matches_botocore(self):
+        for config, token in [
+            (None, None),
+            (Config(s3={'addressing_style': 'path'}), None),
+            (None, 'session/token+=='),
+        ]:
+            c = self.client(config, token)
+            p = self.presigner(c, token)
+            expected = self.expected(c, self.objects())
+            with mock.patch.object(c, 'generate_presigned_url', wraps=c.generate_presigned_url) as generate:
+                self.assertEqual(expected, p.urls(self.objects()))
+                # Only one probe url per bucket goes through botocore.
+                self.assertEqual(2, generate.call_count, 'botocore no longer presigns urls the way Presigner signs them directly')
+
+    def test_botocore_presigns_with_query_string_auth(self):
+        # Presigner only signs urls itself when botocore's default presigned
+        # urls use S3 query string authentication. If this changes every url
+        # silently goes through botocore, so fail here instead.
+        url = self.expected(self.client(), [(self.BUCKET, 'a.jpg')])[0]
+        self.assertEqual(
+            ['AWSAccessKeyId', 'Expires', 'Signature'],
+            sorted(parse_qs(urlsplit(url).query).keys()),
+        )
+
+    def test_falls_back_to_botocore_for_other_credentials(self):
+        c = self.client()
+        p = self.presigner(c, credentials=Credentials('AKIAOTHER', 'other'))
+        expected = self.expected(c, self.objects())
+        with mock.patch.object(c, 'generate_presigned_url', wraps=c.generate_presigned_url) as generate:
+            self.assertEqual(expected, p.urls(self.objects()))
+            self.assertEqual(len(expected), generate.call_count)
+
+    def test_falls_back_to_botocore_for_other_signers(self):
+        c = self.client(Config(signature_version='s3v4'))
+        p = self.presigner(c)
+        self.assertEqual(self.expected(c, self.objects()), p.urls(self.objects()))
+
+    def test_reuses_cached_urls(self):
+        c = self.client()
+        p = self.presigner(c)
+        first = p.urls(self.objects())
+
+        with mock.patch.object(c, 'generate_presigned_url') as generate:
+            self.assertEqual(first, p.urls(self.objects()))
+            self.assertEqual(first[2], p.url(*self.objects()[2]))
+            generate.assert_not_called()
+
+        self.assertEqual(len(self.objects()) + 1, p.hits)
+        self.assertEqual(len(self.objects()), p.misses)
+
+    def test_signs_duplicates_once(self):
+        c = self.client()
+        p = self.presigner(c)
+        objects = [(self.BUCKET, 'a.jpg'), (self.BUCKET, 'b.jpg'), (self.BUCKET, 'a.jpg')]
+
+        urls = p.urls(objects)
+        self.assertEqual(urls[0], urls[2])
+        self.assertNotEqual(urls[0], urls[1])
+        self.assertEqual(2, p.misses)
+        self.assertEqual(2, len(p))
+
+    def test_resigns_urls_near_expiry(self):
+        c = self.client()
+        p = self.presigner(c, expires_in=3000, min_remaining=1000)
+        url = p.url(self.BUCKET, 'a.jpg')
+
+        self.clock[0] += 1900
+        self.assertEqual(url, p.url(self.BUCKET, 'a.jpg'))
+
+        self.clock[0] += 200
+        with mock.patch('time.time', return_value=self.clock[0]):
+            fresh = p.url(self.BUCKET, 'a.jpg')
+            self.assertNotEqual(url, fresh)
+            self.assertEqual(self.expected(c, [(self.BUCKET, 'a.jpg')], 3000)[0], fresh)
+
+    def test_caps_lifetime_at_credential_expiry(self):
+        c = self.client(token='session')
+        p = self.presigner(c, expires_in=10000, min_remaining=2000, credentials=self.refreshable('session', 5000))
+        url = p.url(self.BUCKET, 'a.jpg')
+
+        self.clock[0] += 2900
+        self.assertEqual(url, p.url(self.BUCKET, 'a.jpg'))
+
+        # The url itself lasts another 7000s but its credentials only 1900s.
+        self.clock[0] += 200
+        p.url(self.BUCKET, 'a.jpg')
+        self.assertEqual(2, p.misses)
+
+        p = self.presigner(c, expires_in=10000, min_remaining=2000, credentials=self.refreshable('session', 20000))
+        p.url(self.BUCKET, 'a.jpg')
+        self.clock[0] += 7900
+        p.url(self.BUCKET, 'a.jpg')
+        self.assertEqual(1, p.hits)
+
+    def test_assumes_temporary_lifetime_for_unknown_expiry(self):
+        c = self.client(token='session')
+        p = self.presigner(c, 'session', expires_in=10000, min_remaining=2000, temporary_lifetime=3000)
+        p.url(self.BUCKET, 'a.jpg')
+
+        # Urls only last 3000s, so they are reused for half of that.
+        self.clock[0] += 1400
+        p.url(self.BUCKET, 'a.jpg')
+        self.clock[0] += 200
+        p.url(self.BUCKET, 'a.jpg')
+        self.assertEqual((1, 2), (p.hits, p.misses))
+
+    def test_reuses_urls_signed_with_session_tokens(self):
+        # As in lambda, where credentials come from environment variables.
+        c = self.client(token='session')
+        p = self.presigner(c, 'session')
+        n = len(self.objects())
+        for _ in range(3):
+            p.urls(self.objects())
+        self.assertEqual((2 * n, n), (p.hits, p.misses))
+
+        self.clock[0] += 1801
+        p.urls(self.objects())
+        self.assertEqual(2 * n, p.misses)
+
+    def test_evicts_least_recently_used(self):
+        p = self.presigner(self.client(), max_entries=2)
+        p.url(self.BUCKET, 'a.jpg')
+        p.url(self.BUCKET, 'b.jpg')
+        p.url(self.BUCKET, 'a.jpg')
+        p.url(self.BUCKET, 'c.jpg')
+        self.assertEqual(2, len(p))
+
+        p.url(self.BUCKET, 'a.jpg')
+        self.assertEqual(2, p.hits)
+
+    def test_rejects_impossible_lifetime(self):
+        with self.assertRaises(ValueError):
+            Presigner(self.client(), expires_in=100, min_remaining=100, credentials=Credentials('a', 'b'))
+        with self.assertRaises(ValueError):
+            Presigner(self.client(), min_remaining_fraction=1, credentials=Credentials('a', 'b'))
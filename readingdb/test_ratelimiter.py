@@ -0,0 +1,40 @@
+import threading
+import unittest
+
+from readingdb.ratelimiter import RateLimiter
+
+class TestRateLimiter(unittest.TestCase):
+    def test_spaces_out_calls(self):
+        now = [100.0]
+        sleeps = []
+        limiter = RateLimiter(4, clock=lambda: now[0], sleep=sleeps.append)
+
+        for _ in range(3):
+            limiter.acquire()
+        self.assertEqual([0.25, 0.5], sleeps)
+
+        now[0] += 10
+        limiter.acquire()
+        self.assertEqual([0.25, 0.5], sleeps)
+        self.assertEqual(0.75, limiter.waited)
+
+    def test_reserves_a_slot_per_thread(self):
+        sleeps = []
+        lock = threading.Lock()
+
+        def sleep(seconds):
+            with lock:
+                sleeps.append(seconds)
+
+        limiter = RateLimiter(10, clock=lambda: 0.0, sleep=sleep)
+        threads = [threading.Thread(target=limiter.acquire) for _ in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual([round(i * 0.1, 6) for i in range(1, 20)], sorted(round(s, 6) for s in sleeps))
+
+    def test_rejects_bad_rates(self):
+        with self.assertRaises(ValueError):
+            RateLimiter(0)
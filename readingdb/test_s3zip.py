@@ -0,0 +1,106 @@
+import io
+import os
+import threading
+import unittest
+import zipfile
+
+import boto3
+from moto import mock_s3
+
+from readingdb.s3zip import S3RangeReader, S3Zip, open_s3_zip
+
+@mock_s3
+class TestS3Zip(unittest.TestCase):
+    region_name = 'ap-southeast-2'
+    bucket = 'tmp'
+
+    def setUp(self):
+        self.s3 = boto3.client('s3', region_name=self.region_name)
+        self.s3.create_bucket(
+            Bucket=self.bucket,
+            CreateBucketConfiguration={'LocationConstraint': self.region_name}
+        )
+
+        self.members = {
+            'route/GPS.txt': b'lat,lng\n' * 1000,
+            'route/a.jpg': os.urandom(300 * 1024),
+            'route/b.jpg': os.urandom(2 * 1024 * 1024),
+        }
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as z:
+            z.writestr('route/GPS.txt', self.members['route/GPS.txt'], compress_type=zipfile.ZIP_DEFLATED)
+            z.writestr('route/a.jpg', self.members['route/a.jpg'])
+            z.writestr('route/b.jpg', self.members['route/b.jpg'])
+        self.archive = buffer.getvalue()
+        self.s3.put_object(Bucket=self.bucket, Key='route.zip', Body=self.archive)
+
+    def tearDown(self):
+        for obj in self.s3.list_objects_v2(Bucket=self.bucket).get('Contents', []):
+            self.s3.delete_object(Bucket=self.bucket, Key=obj['Key'])
+        self.s3.delete_bucket(Bucket=self.bucket)
+
+    def test_reads_ranges(self):
+        reader = S3RangeReader(self.s3, self.bucket, 'route.zip')
+        self.assertEqual(len(self.archive), reader.size)
+
+        reader.seek(-22, io.SEEK_END)
+        self.assertEqual(self.archive[-22:], reader.read(22))
+        reader.seek(10)
+        self.assertEqual(self.archive[10:110], reader.read(100))
+        reader.seek(100, io.SEEK_CUR)
+        self.assertEqual(self.archive[210:260], reader.read(50))
+        reader.seek(len(self.archive) + 5)
+        self.assertEqual(b'', reader.read(10))
+        self.assertEqual(3, reader.requests)
+
+        with self.assertRaises(ValueError):
+            reader.seek(-1)
+
+    def test_streams_members(self):
+        z = open_s3_zip(self.s3, self.bucket, 'route.zip', buffer_size=64 * 1024)
+        self.assertEqual(sorted(self.members), sorted(z.namelist()))
+
+        for name, data in self.members.items():
+            with z.open(name) as f:
+                self.assertEqual(data, f.read())
+
+    def test_only_downloads_what_is_read(self):
+        z = open_s3_zip(self.s3, self.bucket, 'route.zip', buffer_size=64 * 1024)
+        reader = z.fp.raw
+
+        with z.open('route/a.jpg') as f:
+            self.assertEqual(self.members['route/a.jpg'], f.read())
+
+        self.assertLess(reader.bytes_read, len(self.archive) // 4)
+
+        self.s3.upload_fileobj(z.open('route/b.jpg'), self.bucket, 'route/b.jpg')
+        self.assertEqual(
+            self.members['route/b.jpg'], 
+            self.s3.get_object(Bucket=self.bucket, Key='route/b.jpg')['Body'].read()
+        )
+
+    def test_gives_each_thread_its_own_reader(self):
+        z = S3Zip(self.s3, self.bucket, 'route.zip', buffer_size=64 * 1024)
+        self.assertEqual(sorted(self.members), sorted(z.namelist()))
+
+        zip_files = {}
+        barrier = threading.Barrier(len(self.members))
+        def read(name):
+            barrier.wait()
+            with z.open(name) as f:
+                zip_files[name] = (z.zip_file(), f.read())
+
+        threads = [threading.Thread(target=read, args=(name,)) for name in self.members]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        for name, data in self.members.items():
+            self.assertEqual(data, zip_files[name][1])
+        readers = set([id(zip_file.fp.raw) for zip_file, _ in zip_files.values()])
+        self.assertEqual(len(self.members), len(readers))
+        self.assertNotIn(id(z.zip_file().fp.raw), readers)
+
+        z.close()
+        self.assertIsNone(z.zip_file().fp)
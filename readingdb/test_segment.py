@@ -0,0 +1,99 @@
+import unittest
+
+from readingdb.constants import *
+from readingdb.segment import Segment, segment_id, segment_partition_key
+
+def prediction(reading_id, geohash, lat, lng, entities, place_id=None, filename=None, annotator=FAUX_ANNOTATOR_ID):
+    reading = {
+        Constants.READING_ID: reading_id,
+        Constants.GEOHASH: geohash,
+        Constants.ANNOTATOR_ID: annotator,
+        Constants.READING: {
+            Constants.LATITUDE: lat,
+            Constants.LONGITUDE: lng,
+            Constants.FILENAME: filename if filename else f'{reading_id}.jpg',
+            Constants.ENTITIES: [
+                {
+                    Constants.ENTITY_NAME: name,
+                    Constants.CONFIDENCE: confidence,
+                    Constants.PRESENT: present,
+                    Constants.SEVERITY: severity,
+                }
+                for name, confidence, present, severity in entities
+            ],
+        },
+    }
+
+    if place_id:
+        reading[Constants.READING][Constants.PLACE_ID] = place_id
+
+    return reading
+
+class TestSegment(unittest.TestCase):
+    def test_groups_readings_by_place(self):
+        readings = [
+            prediction('1', 'r3gqu8', -33.90, 151.10, [('Pothole', 0.9, True, 2.0), ('LatCrack', 0.2, False, 1.0)], 'place-a'),
+            prediction('2', 'r3gqu8', -33.91, 151.12, [('Pothole', 0.7, True, 4.0), ('LatCrack', 0.6, True, 1.0)], 'place-a'),
+            prediction('3', 'r3gqu8', -33.92, 151.11, [('Pothole', 0.1, False, 1.0)], 'place-b'),
+            prediction('4', 'r3gqu8', -33.93, 151.13, [('Pothole', 0.8, True, 1.0)]),
+        ]
+
+        segments = Segment.from_readings(readings)
+        self.assertEqual(['Geohash#r3gqu8', 'place-a', 'place-b'], [s.id for s in segments])
+
+        place_a = segments[1].to_json()
+        self.assertEqual(2, place_a[Constants.READING_COUNT])
+        self.assertEqual({'Pothole': 2, 'LatCrack': 1}, place_a[Constants.ENTITY_COUNTS])
+        self.assertEqual({'Pothole': 3.0, 'LatCrack': 1.0}, place_a[Constants.MEAN_SEVERITIES])
+        self.assertEqual({'Pothole': 0.9, 'LatCrack': 0.6}, place_a[Constants.MAX_CONFIDENCES])
+        self.assertEqual(-33.91, place_a[Constants.MIN_LATITUDE])
+        self.assertEqual(151.12, place_a[Constants.MAX_LONGITUDE])
+
+        place_b = segments[2].to_json()
+        self.assertEqual(1, place_b[Constants.READING_COUNT])
+        self.assertEqual({}, place_b[Constants.ENTITY_COUNTS])
+        self.assertEqual({'Pothole': 0.1}, place_b[Constants.MAX_CONFIDENCES])
+
+    def test_counts_one_prediction_per_image(self):
+        human = ANNOTATOR_PREFERENCE[0]
+        readings = [
+            prediction('1', 'r3gqu8', -33.90, 151.10, [('Pothole', 0.9, True, 1.0)], filename='a.jpg'),
+            prediction('2', 'r3gqu8', -33.90, 151.10, [('Pothole', 0.9, False, 1.0)], filename='a.jpg', annotator=human),
+            prediction('3', 'r3gqu8', -33.91, 151.11, [('Pothole', 0.9, True, 1.0)], filename='b.jpg'),
+        ]
+
+        segments = Segment.from_readings(readings)
+        self.assertEqual(1, len(segments))
+        self.assertEqual(2, segments[0].reading_count)
+        self.assertEqual({'Pothole': 1}, segments[0].entity_counts)
+
+    def test_round_trips_and_merges(self):
+        first = Segment.from_readings([
+            prediction('1', 'r3gqu8', -33.90, 151.10, [('Pothole', 0.9, True, 2.0)], 'place-a'),
+        ])[0]
+        second = Segment.from_readings([
+            prediction('2', 'r3gqu2', -33.95, 151.05, [('Pothole', 0.5, True, 4.0)], 'place-a'),
+        ])[0]
+
+        item = first.item_data('layer-1')
+        self.assertEqual(segment_partition_key('layer-1', 'r3gqu8'), item[Constants.PARTITION_KEY])
+        self.assertEqual('place-a', item[Constants.SORT_KEY])
+
+        restored = Segment.from_item(item)
+        self.assertEqual(first.to_json(), restored.to_json())
+
+        restored.merge(second)
+        merged = restored.to_json()
+        self.assertEqual(['r3gqu2', 'r3gqu8'], merged[Constants.ROUTE_HASHES])
+        self.assertEqual(2, merged[Constants.READING_COUNT])
+        self.assertEqual({'Pothole': 3.0}, merged[Constants.MEAN_SEVERITIES])
+        self.assertEqual({'Pothole': 0.9}, merged[Constants.MAX_CONFIDENCES])
+        self.assertEqual(-33.95, merged[Constants.MIN_LATITUDE])
+        self.assertEqual(151.10, merged[Constants.MAX_LONGITUDE])
+
+        with self.assertRaises(ValueError):
+            restored.item_data('layer-1')
+
+    def test_falls_back_to_geohash(self):
+        self.assertEqual('place-a', segment_id(prediction('1', 'r3gqu8', 0, 0, [], 'place-a')))
+        self.assertEqual('Geohash#r3gqu8', segment_id(prediction('1', 'r3gqu8', 0, 0, [])))
@@ -0,0 +1,93 @@
+import unittest
+
+from readingdb.snapcache import SnapCache
+
+def road_point(lat, lng, place_id, idx=None):
+    point = {'location': {'latitude': lat, 'longitude': lng}, 'placeId': place_id}
+    if idx is not None:
+        point['originalIndex'] = idx
+
+    return point
+
+class TestSnapCache(unittest.TestCase):
+    def test_keys_by_cell_and_heading(self):
+        cache = SnapCache(decimals=4, heading_sectors=8)
+        north = cache.keys([(-37.80001, 145.10001), (-37.79991, 145.10002), (-37.7998, 145.10003)])
+        south = cache.keys([(-37.7998, 145.10003), (-37.79991, 145.10002), (-37.80001, 145.10001)])
+
+        self.assertEqual('-378001:1451000:0', north[0])
+        self.assertEqual('-378001:1451000:4', south[2])
+        self.assertEqual(north[1].split(':')[:2], south[1].split(':')[:2])
+        self.assertNotEqual(north[1], south[1])
+
+        self.assertEqual(['-378001:1451000:-', '-378001:1451000:-'], cache.keys([(-37.80001, 145.10001)] * 2))
+
+    def test_rebuilds_windows(self):
+        cache = SnapCache()
+        path = [(-37.8, 145.1), (-37.8002, 145.1), (-37.8004, 145.1), (-37.8006, 145.1)]
+        snapped = [
+            road_point(-37.80001, 145.1, 'a', 0),
+            road_point(-37.80011, 145.1, 'a'),
+            road_point(-37.80021, 145.1, 'b', 1),
+            road_point(-37.80061, 145.1, 'c', 3),
+        ]
+
+        keys = cache.keys(path)
+        self.assertEqual([None, None], cache.get([keys, keys[1:]]))
+        self.assertEqual(4, cache.put(keys, snapped))
+        self.assertEqual([snapped], cache.get([keys]))
+
+        # Point 2 was dropped by the API, so it stays dropped.
+        self.assertEqual([
+            road_point(-37.80021, 145.1, 'b', 0),
+            road_point(-37.80061, 145.1, 'c', 2),
+        ], cache.get([keys[1:]])[0])
+
+        self.assertEqual({
+            'windows': 4,
+            'window_hits': 2,
+            'hit_rate': 0.5,
+            'points': 14,
+            'point_hits': 7,
+            'point_hit_rate': 0.5,
+        }, cache.report())
+
+    def test_points_expire(self):
+        now = [1000.0]
+        cache = SnapCache(ttl=10, clock=lambda: now[0])
+        keys = cache.keys([(-37.8, 145.1), (-37.8002, 145.1)])
+        cache.put(keys, [road_point(-37.8, 145.1, 'a', 0), road_point(-37.8002, 145.1, 'a', 1)])
+
+        now[0] += 9
+        self.assertIsNotNone(cache.get([keys])[0])
+        now[0] += 2
+        self.assertIsNone(cache.get([keys])[0])
+
+    def test_skips_cells_a_window_revisits(self):
+        cache = SnapCache()
+        keys = ['A', 'B', 'A', 'C', 'C']
+        snapped = [
+            road_point(-37.8, 145.1, 'a', 0),
+            road_point(-37.8001, 145.1, 'a'),
+            road_point(-37.8002, 145.1, 'b', 1),
+            road_point(-37.80005, 145.1, 'a', 2),
+            road_point(-37.8004, 145.1, 'c', 3),
+            road_point(-37.8004, 145.1, 'c', 4),
+            road_point(-37.8005, 145.1, 'c'),
+        ]
+
+        # A is snapped differently each time it is visited, so it is not
+        # cached, while the run of points in C is.
+        self.assertEqual(2, cache.put(keys, snapped))
+        self.assertEqual([None, None], cache.get([keys, ['A', 'B']]))
+        self.assertEqual([
+            road_point(-37.8002, 145.1, 'b', 0),
+            road_point(-37.8004, 145.1, 'c', 1),
+            road_point(-37.8004, 145.1, 'c', 2),
+            road_point(-37.8005, 145.1, 'c'),
+        ], cache.get([['B', 'C', 'C']])[0])
+
+        # Even once A is cached, a window visiting it twice is snapped live.
+        cache.put(['A', 'B'], [road_point(-37.8, 145.1, 'a', 0), road_point(-37.8002, 145.1, 'b', 1)])
+        self.assertIsNotNone(cache.get([['A', 'B']])[0])
+        self.assertIsNone(cache.get([keys])[0])
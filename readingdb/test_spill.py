@@ -0,0 +1,94 @@
+import json
+import unittest
+from unittest import mock
+
+import boto3
+from moto import mock_s3
+
+from readingdb.spill import SpillWriter, json_list_chunks
+
+@mock_s3
+class TestSpill(unittest.TestCase):
+    region_name = 'ap-southeast-2'
+    bucket = 'tmp'
+
+    def setUp(self):
+        self.s3 = boto3.client('s3', region_name=self.region_name)
+        self.s3.create_bucket(
+            Bucket=self.bucket,
+            CreateBucketConfiguration={'LocationConstraint': self.region_name}
+        )
+
+    def tearDown(self):
+        for upload in self.s3.list_multipart_uploads(Bucket=self.bucket).get('Uploads', []):
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=upload['Key'], UploadId=upload['UploadId'])
+        for obj in self.s3.list_objects_v2(Bucket=self.bucket).get('Contents', []):
+            self.s3.delete_object(Bucket=self.bucket, Key=obj['Key'])
+        self.s3.delete_bucket(Bucket=self.bucket)
+
+    def body(self, key) -> bytes:
+        return self.s3.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+
+    def test_encodes_lists_like_json_dumps(self):
+        for items in [[], [1], [{'a': 'ü', 'b': [1.5, None]}, 'x', {'c': {}}]]:
+            self.assertEqual(json.dumps(items).encode(), b''.join(json_list_chunks(items)))
+
+    def test_keeps_small_output_in_memory(self):
+        with mock.patch.object(self.s3, 'put_object') as put:
+            with SpillWriter(self.s3, self.bucket, 'small.json', 100) as w:
+                w.write(b'[1, 2, 3]')
+
+            put.assert_not_called()
+
+        self.assertFalse(w.spilled)
+        self.assertEqual(9, w.size)
+        self.assertEqual(b'[1, 2, 3]', w.getvalue())
+
+    def test_spills_small_output_in_one_put(self):
+        with SpillWriter(self.s3, self.bucket, 'small.json', 4) as w:
+            w.write(b'[1, 2')
+            w.write(b', 3]')
+
+        self.assertTrue(w.spilled)
+        self.assertEqual(b'[1, 2, 3]', self.body('small.json'))
+        with self.assertRaises(ValueError):
+            w.getvalue()
+
+    def test_sets_content_encoding(self):
+        with SpillWriter(self.s3, self.bucket, 'small.json.gz', 1, content_encoding='gzip') as w:
+            w.write(b'data')
+
+        obj = self.s3.get_object(Bucket=self.bucket, Key='small.json.gz')
+        self.assertEqual('gzip', obj['ContentEncoding'])
+        self.assertEqual('application/json', obj['ContentType'])
+
+    def test_streams_large_output_in_parts(self):
+        part_size = SpillWriter.MIN_PART_SIZE
+        chunk = b'x' * (1024 * 1024)
+        upload_part = self.s3.upload_part
+
+        sizes = []
+        def record(**kwargs):
+            sizes.append(len(kwargs['Body']))
+            return upload_part(**kwargs)
+
+        with mock.patch.object(self.s3, 'upload_part', side_effect=record):
+            with SpillWriter(self.s3, self.bucket, 'big.json', 1024, part_size=part_size) as w:
+                for _ in range(12):
+                    w.write(chunk)
+
+        self.assertEqual([part_size, part_size, 2 * 1024 * 1024], sizes)
+        self.assertEqual(chunk * 12, self.body('big.json'))
+
+    def test_aborts_upload_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with SpillWriter(self.s3, self.bucket, 'broken.json', 1) as w:
+                w.write(b'x' * (SpillWriter.MIN_PART_SIZE + 1))
+                raise RuntimeError('encoding failed')
+
+        self.assertEqual([], self.s3.list_multipart_uploads(Bucket=self.bucket).get('Uploads', []))
+        self.assertNotIn('Contents', self.s3.list_objects_v2(Bucket=self.bucket))
+
+    def test_rejects_parts_below_s3_minimum(self):
+        with self.assertRaises(ValueError):
+            SpillWriter(self.s3, self.bucket, 'k', 10, part_size=1024)
@@ -0,0 +1,31 @@
+import unittest
+
+from readingdb.constants import *
+from readingdb.entities import ENTITIES
+from readingdb.tile import Tile, tile_children_partition_key, tile_partition_key
+
+class TestTile(unittest.TestCase):
+    def test_partitions_by_parent(self):
+        self.assertEqual('Tile#layer-a#6#r3gqu', tile_partition_key('layer-a', 'r3gqu2'))
+        self.assertEqual('Tile#layer-a#3#r3', tile_partition_key('layer-a', 'r3g'))
+        self.assertEqual(tile_partition_key('layer-a', 'r3gqu2'), tile_children_partition_key('layer-a', 'r3gqu'))
+        self.assertNotEqual(tile_partition_key('layer-a', 'r3gqu2'), tile_partition_key('layer-b', 'r3gqu2'))
+
+    def test_round_trips(self):
+        tile = Tile('r3gqu2')
+        tile.add({Constants.READING: {Constants.ENTITIES: [
+            {Constants.ENTITY_NAME: 'Pothole', Constants.CONFIDENCE: 0.8, Constants.PRESENT: True, Constants.SEVERITY: 2.5},
+            {Constants.ENTITY_NAME: 'LatCrack', Constants.CONFIDENCE: 0.3, Constants.PRESENT: False, Constants.SEVERITY: 1.0},
+        ]}})
+
+        restored = Tile.from_item(tile.item_data('layer-a'))
+        self.assertEqual(6, restored.precision)
+
+        data = restored.to_json()
+        self.assertEqual('r3gqu2', data[Constants.GEOHASH])
+        self.assertEqual(1, data[Constants.READING_COUNT])
+        self.assertEqual(sorted(ENTITIES), sorted(data[Constants.ENTITY_COUNTS]))
+        self.assertEqual(1, data[Constants.ENTITY_COUNTS]['Pothole'])
+        self.assertEqual(0, data[Constants.ENTITY_COUNTS]['LatCrack'])
+        self.assertEqual({'Pothole': 2.5}, data[Constants.MEAN_SEVERITIES])
+        self.assertEqual({'Pothole': 0.8, 'LatCrack': 0.3}, data[Constants.MAX_CONFIDENCES])
@@ -0,0 +1,93 @@
+import threading
+import time
+import unittest
+
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+from readingdb.uploadpool import UploadPool
+
+def client_error():
+    return ClientError({'Error': {'Code': 'SlowDown', 'Message': 'slow down'}}, 'PutObject')
+
+class TestUploadPool(unittest.TestCase):
+    def setUp(self):
+        self.sleeps = []
+        self.pool = UploadPool(max_workers=4, attempts=3, backoff=0.5, sleep=self.sleeps.append)
+
+    def upload_from_threads(self, upload, uploads, n_threads=4):
+        errors = []
+        def run(chunk):
+            for args in chunk:
+                try:
+                    self.pool.upload(upload, args)
+                except Exception as e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(uploads[i::n_threads],)) for i in range(n_threads)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return errors
+
+    def test_counts_uploads_from_many_threads(self):
+        uploaded = []
+        def upload(filename, bucket, key):
+            time.sleep(0.001)
+            uploaded.append((filename, bucket, key))
+
+        uploads = [(f'img-{i}.jpg', 'bucket', f'route/img-{i}.jpg') for i in range(40)]
+        self.pool.begin(len(uploads))
+        self.assertEqual([], self.upload_from_threads(upload, uploads))
+        self.assertEqual(sorted(uploads), sorted(uploaded))
+
+        report = self.pool.report()
+        self.assertEqual(40, report['uploads'])
+        self.assertEqual(40, report['total'])
+        self.assertEqual(0, report['retries'])
+        self.assertEqual(4, report['workers'])
+
+        self.pool.begin(0)
+        self.assertEqual(0, self.pool.report()['uploads'])
+
+    def test_retries_with_backoff(self):
+        failures = {'img-1.jpg': 2, 'img-2.jpg': 1}
+
+        def upload(filename, bucket, key):
+            if failures.get(filename, 0) > 0:
+                failures[filename] -= 1
+                raise client_error() if filename == 'img-1.jpg' else EndpointConnectionError(endpoint_url='s3')
+
+        uploads = [(f'img-{i}.jpg', 'bucket', f'route/img-{i}.jpg') for i in range(5)]
+        self.pool.begin(len(uploads))
+        self.assertEqual([], self.upload_from_threads(upload, uploads))
+        self.assertEqual(5, self.pool.report()['uploads'])
+        self.assertEqual(3, self.pool.report()['retries'])
+        self.assertEqual([0.5, 0.5, 1.0], sorted(self.sleeps))
+
+    def test_raises_once_attempts_run_out(self):
+        calls = []
+        def upload(filename, bucket, key):
+            calls.append(filename)
+            raise client_error()
+
+        with self.assertRaises(ClientError):
+            self.pool.upload(upload, ('img-0.jpg', 'bucket', 'k-0'))
+        self.assertEqual(3, len(calls))
+        self.assertEqual(0, self.pool.report()['uploads'])
+
+    def test_does_not_retry_other_errors(self):
+        calls = []
+        def upload(filename, bucket, key):
+            calls.append(filename)
+            raise FileNotFoundError(filename)
+
+        with self.assertRaises(FileNotFoundError):
+            UploadPool(max_workers=1).upload(upload, ('missing.jpg', 'bucket', 'key'))
+        self.assertEqual(['missing.jpg'], calls)
+
+    def test_validates_arguments(self):
+        with self.assertRaises(ValueError):
+            UploadPool(max_workers=0)
+        with self.assertRaises(ValueError):
+            UploadPool(attempts=0)
@@ -0,0 +1,60 @@
+from typing import Any, Dict
+
+from readingdb.constants import *
+from readingdb.entities import ENTITIES
+from readingdb.faultstats import FaultStats
+
+TILE_MIN_PRECISION = 3
+TILE_MAX_PRECISION = GEOHASH_PRECISION
+
+def tile_partition_key(layer_id: str, geohash: str) -> str:
+    '''Tiles are partitioned by layer and parent tile, so all the 
+    children of one of a layer's tiles can be loaded with a single query.
+    '''
+
+    return tile_children_partition_key(layer_id, geohash[:-1])
+
+def tile_children_partition_key(layer_id: str, parent: str) -> str:
+    return f'{Constants.TILE_PK}#{layer_id}#{len(parent) + 1}#{parent}'
+
+class Tile(FaultStats):
+    '''Fault statistics for every PredictionReading of one layer inside 
+    one geohash. Tiles at GEOHASH_PRECISION are built from readings 
+    directly, coarser tiles are merged from the 32 tiles inside them.
+    '''
+
+    def __init__(self, geohash: str, layer_id: str = None) -> None:
+        super().__init__()
+        self.geohash = geohash
+        self.layer_id = layer_id
+
+    @property
+    def precision(self) -> int:
+        return len(self.geohash)
+
+    @classmethod
+    def from_item(cls, item: Dict[str, Any]) -> 'Tile':
+        tile = Tile(item[Constants.GEOHASH], item[Constants.LAYER_ID])
+        tile.load_stats_item(item)
+
+        return tile
+
+    def item_data(self, layer_id: str) -> Dict[str, Any]:
+        return {
+            Constants.PARTITION_KEY: tile_partition_key(layer_id, self.geohash),
+            Constants.SORT_KEY: self.geohash,
+            Constants.LAYER_ID: layer_id,
+            Constants.GEOHASH: self.geohash,
+            **self.stats_item_data(),
+        }
+
+    def to_json(self) -> Dict[str, Any]:
+        data = {
+            Constants.GEOHASH: self.geohash,
+            **self.stats_json(),
+        }
+
+        for name in ENTITIES:
+            data[Constants.ENTITY_COUNTS].setdefault(name, 0)
+
+        return data
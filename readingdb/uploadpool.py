@@ -0,0 +1,86 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Tuple
+
+from boto3.exceptions import S3UploadFailedError
+from botocore.exceptions import BotoCoreError, ClientError
+
+class UploadPool():
+    '''Retries uploads made from up to max_workers threads at once and
+    keeps count of them. Uploads that fail with an S3 or connection 
+    error are retried with exponential backoff; any other error, or 
+    running out of attempts, is raised.
+    '''
+
+    RETRYABLE = (BotoCoreError, ClientError, S3UploadFailedError)
+
+    def __init__(
+        self,
+        max_workers: int = 16,
+        attempts: int = 5,
+        backoff: float = 0.5,
+        max_backoff: float = 8.0,
+        progress_every: int = 100,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        if max_workers < 1:
+            raise ValueError(f'max_workers must be at least 1, got {max_workers}')
+        if attempts < 1:
+            raise ValueError(f'attempts must be at least 1, got {attempts}')
+
+        self.max_workers = max_workers
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.progress_every = progress_every
+        self.sleep = sleep
+
+        self.__lock = threading.Lock()
+        self.begin(0)
+
+    def report(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self.__start
+
+        return {
+            'uploads': self.completed,
+            'total': self.total,
+            'retries': self.retries,
+            'workers': min(self.max_workers, max(self.total, 1)),
+            'seconds': elapsed,
+            'per_second': self.completed / elapsed if elapsed > 0 else 0.0,
+        }
+
+    def upload(self, upload: Callable[..., Any], args: Tuple) -> None:
+        '''Calls upload(*args) on the calling thread, retrying it if it
+        fails with a retryable error. Call begin first so that progress 
+        is reported against the right total.
+        '''
+
+        attempt = 1
+        while True:
+            try:
+                upload(*args)
+                break
+            except self.RETRYABLE as e:
+                if attempt >= self.attempts:
+                    raise
+
+                with self.__lock:
+                    self.retries += 1
+
+                print(f'upload {args} failed on attempt {attempt} of {self.attempts}, retrying: {e}')
+                self.sleep(min(self.backoff * 2 ** (attempt - 1), self.max_backoff))
+                attempt += 1
+
+        with self.__lock:
+            self.completed += 1
+            if self.completed % self.progress_every == 0 or self.completed == self.total:
+                print(f'uploaded {self.completed} of {self.total}', self.report())
+
+    def begin(self, total: int) -> None:
+        '''Resets the counters for a new batch of total uploads.'''
+
+        self.total = total
+        self.completed = 0
+        self.retries = 0
+        self.__start = time.perf_counter()
@@ -25,5 +25,6 @@ setuptools.setup(
         'tqdm',
         'moto',
         'botocore',
+        'numpy==1.19.5',
     ]
 )
\ No newline at end of file